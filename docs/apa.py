@@ -0,0 +1,213 @@
+import re
+
+# Parser for APA 7th edition reference entries, as returned by the citation
+# search. It splits an entry into authors, year, title and DOI and builds the
+# matching in-text citation:
+#   one author              (Selwyn, 2019)
+#   two authors             (Hattie & Timperley, 2007)
+#   three or more           (Holmes et al., 2019)
+#   group author            (UNESCO, 2021)
+#   no date                 (Jisc, n.d.)
+# Text before the entry ("Here is the reference: ...") is skipped, and an
+# author that looks like chat rather than a name ("Sorry, I could not find a
+# source. However, see Smith") makes the entry unparseable, so apologetic
+# or chatty search answers are not mistaken for references.
+# Everything is done with a handful of precompiled patterns and string
+# splits, so thousands of entries parse per second. Check changes against the
+# reference corpus with `python docs/benchmark.py apa`.
+
+# The date of an entry: (2020), (2020a), (2023, January 12), (n.d.), (in press)
+DATE_RE = re.compile(r"\(\s*(\d{4}[a-z]?|n\.\s?d\.(?:-[a-z])?|in press)\s*(?:,[^)]*)?\)\.?", re.IGNORECASE)
+
+# Initials of one author: J., J. A., J.-P., S. A. D., Y.-K.
+INITIALS_RE = re.compile(r"^[A-Z](?:[a-z]?\.)?(?:\s*-?\s*[A-Z](?:[a-z]?\.)?)*$")
+
+DOI_RE = re.compile(r"(?:https?://(?:dx\.)?doi\.org/|\bdoi:\s*)(10\.\d{4,9}/[^\s]+)", re.IGNORECASE)
+
+# "(Ed.)", "(Eds.)" and similar roles after the author list
+ROLE_RE = re.compile(r"\s*\((?:Ed|Eds|Trans|Comp|Comps)\.\)\s*\.?\s*$", re.IGNORECASE)
+
+# List markers, quotes and markdown emphasis the search model sometimes adds
+LEADING_NOISE_RE = re.compile(r"^\s*(?:[-*•]\s+|\d+[.)]\s+|reference:\s*)", re.IGNORECASE)
+EMPHASIS_RE = re.compile(r"\*+|`+")
+
+# Candidate ends of the title: sentence-ending punctuation followed by a space
+TITLE_END_RE = re.compile(r"(?<=[.?!])\s+(?=\S)")
+
+# What a source (journal volume and pages, URL, page range) looks like
+SOURCE_RE = re.compile(r",\s*\d|https?://|\(pp?\.")
+
+# Where an entry can start on a line with text before it: after a lead-in
+# ending in a colon, or after a sentence ending in a word of two or more
+# lowercase letters ("... a source. However, see Smith (2020)")
+LEAD_IN_RE = re.compile(r":\s+|(?<=[a-z]{2}[.!?])\s+(?=[A-Z])")
+
+# Group authors are names: at most this many words, capitalized apart from
+# the connecting words below, and without pronouns or chat
+GROUP_AUTHOR_MAX_WORDS = 8
+GROUP_AUTHOR_CONNECTORS = {
+    "of", "for", "and", "the", "on", "in", "at", "to", "&",
+    "de", "des", "du", "la", "le", "van", "der", "den", "von", "für", "y", "e", "et", "da", "di",
+}
+GROUP_AUTHOR_STOP_WORDS = {
+    "I", "We", "You", "It", "They", "He", "She", "My", "Our", "Your", "Here", "There", "This", "These",
+    "Sorry", "However", "Unfortunately", "Please", "Note", "See", "Try", "Perhaps", "Maybe", "According",
+}
+
+# Sentence punctuation inside a name: a colon, question or exclamation mark,
+# or a period after a word (not after an initial, as in "U.S.")
+NAME_PUNCTUATION_RE = re.compile(r"[:?!]|[^\W\d_]{2,}\.\s")
+
+# "Smith J" or "Smith J. A.": an individual author written without the comma
+SURNAME_INITIALS_RE = re.compile(r"^\S+(?:\s+[A-Z]\.?)+$")
+
+
+# Authors, year, title and DOI of one reference entry. `authors` holds the
+# surnames of individual authors, or the name of a group author. `year` is
+# "n.d." for undated works and may carry a suffix such as "2020a".
+class Reference:
+    def __init__(self, authors, year, title="", doi=None, group_author=False, truncated=False):
+        self.authors = authors
+        self.year = year
+        self.title = title
+        self.doi = doi
+        self.group_author = group_author
+        self.truncated = truncated
+
+    # Parenthetical in-text citation
+    def in_text(self):
+        return f"({self.narrative_author()}, {self.year})"
+
+    def narrative_author(self):
+        if not self.authors:
+            return "Anonymous"
+        if self.group_author or (len(self.authors) == 1 and not self.truncated):
+            return self.authors[0]
+        if len(self.authors) == 2 and not self.truncated:
+            return f"{self.authors[0]} & {self.authors[1]}"
+        return f"{self.authors[0]} et al."
+
+    def to_dict(self):
+        return {
+            "authors": self.authors,
+            "year": self.year,
+            "title": self.title,
+            "doi": self.doi,
+            "in_text": self.in_text(),
+        }
+
+
+# Surnames of the individual authors in `author_text`, or None if it does not
+# look like a list of "Surname, I." authors (e.g. a group author). The second
+# value tells whether the list was shortened with an ellipsis or "et al.".
+def split_authors(author_text):
+    truncated = False
+    parts = []
+    for part in author_text.split(","):
+        part = part.strip()
+        if part.startswith("&"):
+            part = part[1:].strip()
+        elif part.lower().startswith("and "):
+            part = part[4:].strip()
+        if part in ("...", "…") or part.lower() in ("et al.", "et al"):
+            truncated = True
+            continue
+        # The last author after an ellipsis: "... Wright, R."
+        if part.startswith(("...", "…")):
+            truncated = True
+            part = part.lstrip(".… ").strip()
+        # "Smith, J. and Jones" written without the comma before "and"
+        if " & " in part or " and " in part:
+            first, _, rest = re.split(r"\s(&|and)\s", part, maxsplit=1)
+            parts += [first.strip(), rest.strip()]
+            continue
+        if part:
+            parts.append(part)
+
+    surnames = []
+    i = 0
+    while i < len(parts):
+        if i + 1 < len(parts) and INITIALS_RE.match(parts[i + 1]):
+            surnames.append(parts[i])
+            i += 2
+        else:
+            return None, truncated
+    return surnames, truncated
+
+
+# Whether `text`, the author part of an entry that is not a list of
+# individual authors, can be the name of a group author
+def is_group_author(text):
+    words = text.split()
+    if len(words) > GROUP_AUTHOR_MAX_WORDS or NAME_PUNCTUATION_RE.search(text + " "):
+        return False
+    if SURNAME_INITIALS_RE.match(text):
+        return False
+    for word in words:
+        word = word.strip(",;")
+        if word in GROUP_AUTHOR_STOP_WORDS:
+            return False
+        if word[:1].islower() and word not in GROUP_AUTHOR_CONNECTORS:
+            return False
+    return True
+
+
+# Title of an entry from the text after its date. A title ends at the first
+# period; a question or exclamation mark only ends it when a source follows,
+# so "ChatGPT for good? On opportunities ..." stays one title.
+def extract_title(rest):
+    for match in TITLE_END_RE.finditer(rest):
+        if rest[match.start() - 1] == ".":
+            return rest[:match.start() - 1].strip()
+        following = rest[match.end():].split(". ", 1)[0]
+        if SOURCE_RE.search(following) or "." not in rest[match.end():]:
+            return rest[:match.start()].strip()
+    return rest.rstrip(".").strip()
+
+
+# Parse one APA reference entry; None if no date can be found in it or the
+# text before the date is not an author
+def parse_reference(text):
+    text = EMPHASIS_RE.sub("", text or "")
+    lines = [line for line in text.splitlines() if DATE_RE.search(line)]
+    if not lines:
+        return None
+    entry = LEADING_NOISE_RE.sub("", lines[0]).strip()
+
+    date = DATE_RE.search(entry)
+    if date is None:
+        return None
+    starts = [match.end() for match in LEAD_IN_RE.finditer(entry, 0, date.start())]
+    if starts:
+        entry = LEADING_NOISE_RE.sub("", entry[starts[-1]:]).strip()
+        date = DATE_RE.search(entry)
+    year = date.group(1)
+    if year[0] in "nN":
+        # "n.d.", "n. d." or a suffixed "n.d.-a"
+        year = "n.d." + year.replace(" ", "")[4:]
+    elif year[0] in "iI":
+        year = "in press"
+
+    author_text = ROLE_RE.sub("", entry[:date.start()]).strip().strip('"').strip()
+    surnames, truncated = split_authors(author_text)
+    if surnames:
+        authors, group_author = surnames, False
+    elif author_text:
+        author_text = author_text.rstrip(".").strip()
+        if not is_group_author(author_text):
+            return None
+        authors, group_author = [author_text], True
+    else:
+        authors, group_author = [], False
+
+    rest = entry[date.end():].strip()
+    title = extract_title(rest) if rest else ""
+    doi = DOI_RE.search(entry)
+    return Reference(
+        authors,
+        year,
+        title=title,
+        doi=doi.group(1).rstrip(".,;)") if doi else None,
+        group_author=group_author,
+        truncated=truncated
+    )
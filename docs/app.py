@@ -1,14 +1,299 @@
-import streamlit as st
 import os
-import re
-from openai import OpenAI
-from dotenv import load_dotenv
+import time
+import uuid
+
+import streamlit as st
+from citation_cache import CitationCache
+from completion_cache import create_completion_cache
+from export import EXPORT_FORMATS, ExportManager
+from form_schema import FIELD_NAMES, FIELDS, FORM_SCHEMA
+from jobs import JobManager
+from metrics import start_metrics_server
+from pipeline import compose_case_study_document, create_client, missing_required_fields
+from result_store import ResultStore, diff_texts
+from scheduler import get_scheduler
+from sections import DRAFT_MODE
+from speculation import SPECULATIVE_DRAFTING, SpeculationManager
+
+# Seconds between progress refreshes while a generation job is running
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+
+# Seconds between checks for finished exports while they are rendering
+EXPORT_POLL_INTERVAL = float(os.getenv("EXPORT_POLL_INTERVAL", "1.0"))
+
+# Seconds between checks for settled form sections while drafting ahead
+SPECULATIVE_POLL_INTERVAL = float(os.getenv("SPECULATIVE_POLL_INTERVAL", "2.0"))
+
+# Streamlit runs this script again on every widget interaction, so anything
+# expensive is built once per server process through st.cache_resource and
+# shared by all sessions. The OpenAI client (and with it the slow openai
+# import) and the caches are only created when the first case study is generated.
+
+
+# OpenAI client with a persistent connection pool (environment variables are loaded from .env)
+@st.cache_resource(show_spinner=False)
+def get_client():
+    return create_client()
+
+
+# Shared on-disk cache of citations found for placeholder topics
+@st.cache_resource(show_spinner=False)
+def get_citation_cache():
+    return CitationCache()
+
+
+# Cache of chat completions so identical resubmissions return instantly
+@st.cache_resource(show_spinner=False)
+def get_completion_cache():
+    return create_completion_cache()
+
+
+# History of generated case studies, kept across sessions and restarts
+@st.cache_resource(show_spinner=False)
+def get_result_store():
+    return ResultStore()
+
+
+# Worker pool running the generations of every session
+@st.cache_resource(show_spinner=False)
+def get_job_manager():
+    return JobManager(get_client(), get_completion_cache(), get_citation_cache(), get_result_store())
+
+
+# Background renderer of DOCX, PDF and HTML exports with its render cache
+@st.cache_resource(show_spinner=False)
+def get_export_manager():
+    return ExportManager()
+
+
+# Worker pool drafting sections ahead of submit for every session
+@st.cache_resource(show_spinner=False)
+def get_speculation_manager():
+    return SpeculationManager(get_client(), get_completion_cache(), get_citation_cache())
+
+
+# Prometheus endpoint for run metrics, if METRICS_PORT is set (on METRICS_HOST)
+@st.cache_resource(show_spinner=False)
+def start_metrics_endpoint():
+    return start_metrics_server()
+
+
+start_metrics_endpoint()
+
+
+# Render one form field from its schema entry
+def render_field(field):
+    if field.widget == "text_input":
+        return st.text_input(field.label, placeholder=field.placeholder, help=field.help, key=field.key)
+    return st.text_area(field.label, placeholder=field.placeholder, help=field.help, height=field.height, key=field.key)
+
+
+# Memoize `compute(*inputs)` in this session's state. The value is reused on
+# every rerun until one of the inputs is replaced, so large generated
+# documents are only composed once per generation.
+def session_memo(name, compute, *inputs):
+    memo = st.session_state.setdefault("_memo", {})
+    entry = memo.get(name)
+    if entry is None or entry[0] != inputs:
+        entry = memo[name] = (inputs, compute(*inputs))
+    return entry[1]
+
+
+# Rows of the timing panel table
+def timing_rows(run_metrics):
+    rows = []
+    for stage in run_metrics["stages"]:
+        row = {key: value for key, value in stage.items() if key not in ("models", "routes", "error")}
+        # Routed requests show the backend that answered them
+        if stage.get("routes"):
+            row["backend"] = ", ".join(
+                f"{route['backend']}{' (fallback)' if route['fallback'] else ''}" for route in stage["routes"]
+            )
+        rows.append(row)
+    return rows
+
+
+# Main pipeline stages in the order they are shown while a job runs
+PROGRESS_STAGES = [
+    ("draft", "Drafting the case study"),
+    ("citations", "Finding sources for citations"),
+    ("integration", "Inserting citations and references"),
+    ("questions", "Writing guiding questions"),
+]
+
+STAGE_ICONS = {"pending": "⬜", "running": "⏳", "done": "✅", "failed": "❌"}
+
+
+# Copy a finished job's result into the session so the tabs show it
+def collect_job_result(job):
+    result = job.result
+    st.session_state.run_id = job.run_id
+    st.session_state.result_fields = job.fields
+    st.session_state.final_case_study = result["final_case_study"]
+    st.session_state.review_questions = result["review_questions"]
+    st.session_state.run_timings = result["timings"]
+    st.session_state.run_metrics = result["metrics"]
+    st.session_state.generation_complete = True
+    st.session_state.current_tab = "Case Study"
+    # From now on the URL points at the stored run rather than the job
+    st.query_params.pop("job", None)
+    if job.run_id:
+        st.query_params["run"] = job.run_id
+
+
+# Show a stored run from the result store, optionally filling the form with its inputs.
+# The form can only be filled before its widgets are drawn (at the start of a
+# run or in a widget callback).
+def load_stored_run(run, fill_form=False):
+    st.session_state.run_id = run["id"]
+    st.session_state.result_fields = run["fields"]
+    st.session_state.final_case_study = run["final_case_study"]
+    st.session_state.review_questions = run["review_questions"]
+    st.session_state.run_timings = None
+    st.session_state.run_metrics = run.get("metrics")
+    st.session_state.generation_complete = True
+    if fill_form:
+        for key in FIELD_NAMES:
+            st.session_state[key] = run["fields"].get(key, "")
 
-# Load environment variables
-load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Callback of the history buttons in the sidebar
+def open_stored_run(run_id):
+    run = get_result_store().get(run_id)
+    if run is None:
+        st.session_state.job_error = "That case study is no longer in the history."
+        return
+    load_stored_run(run, fill_form=True)
+    st.query_params.pop("job", None)
+    st.query_params["run"] = run_id
+
+
+# Callback of the history key field in the sidebar
+def use_history_key():
+    history_key = st.session_state.history_key_input.strip()
+    st.session_state.history_key_input = ""
+    if history_key:
+        st.session_state.owner_id = history_key
+
+
+def format_run_time(created_at):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(created_at))
+
+
+# Progress of the session's running job, refreshed every JOB_POLL_INTERVAL
+# seconds without rerunning the rest of the page. Once the job has finished
+# the whole app is rerun to show the result (or the error).
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def job_progress():
+    job_id = st.session_state.job_id
+    job = get_job_manager().get(job_id) if job_id else None
+    if job is None or job.status in ("done", "failed"):
+        if job is None:
+            st.session_state.job_error = "The generation job is no longer available. Please submit the form again."
+        elif job.status == "failed":
+            st.session_state.job_error = f"Generation failed: {job.error}"
+        else:
+            collect_job_result(job)
+        st.session_state.job_id = None
+        st.rerun()
+
+    if job.status == "queued":
+        position = get_job_manager().queue_position(job_id)
+        st.info(f"Waiting for a free worker{f' (position {position} in the queue)' if position else ''}...")
+        return
+
+    stages = job.stage_snapshot()
+    lookups = [status for name, status in stages.items() if name.startswith("citation:")]
+    finished = sum(1 for name, _ in PROGRESS_STAGES if stages.get(name) == "done")
+    st.progress(finished / len(PROGRESS_STAGES), text="Generating your case study...")
+    lines = []
+    for name, label in PROGRESS_STAGES:
+        line = f"{STAGE_ICONS[stages.get(name, 'pending')]} {label}"
+        if name == "citations" and lookups:
+            line += f" ({sum(1 for status in lookups if status != 'running')}/{len(lookups)} searched)"
+        # Long case studies go through these stages in chunks
+        chunks = [status for chunk, status in stages.items() if chunk.startswith(f"{name}: chunk ")]
+        if chunks and stages.get(name) == "running":
+            line += f" ({sum(1 for status in chunks if status != 'running')}/{len(chunks)} chunks)"
+        lines.append(line)
+    st.markdown("  \n".join(lines))
+
+    draft = job.draft
+    if draft and stages.get("draft") == "running":
+        st.markdown(draft + "▌")
+
+
+# Speculative drafts of this session
+def session_speculator():
+    if "speculator" not in st.session_state:
+        st.session_state.speculator = get_speculation_manager().session()
+    return st.session_state.speculator
+
+
+# Section fingerprints of a stored run
+def run_fingerprints(run_id):
+    run = get_result_store().get(run_id) if run_id else None
+    return {section["fingerprint"] for section in (run or {}).get("sections") or []}
+
+
+# Passes the form values to the session's speculator every
+# SPECULATIVE_POLL_INTERVAL seconds, so sections are drafted once they settle
+@st.fragment(run_every=SPECULATIVE_POLL_INTERVAL)
+def speculative_drafting():
+    speculator = session_speculator()
+    # Sections of the case study on screen are reused on submit anyway
+    known = session_memo("run_fingerprints", run_fingerprints, st.session_state.run_id)
+    speculator.observe({key: st.session_state.get(key, "") for key in FIELD_NAMES}, known=known)
+    ready, running = speculator.counts()
+    if speculator.exhausted:
+        st.caption("Drafting ahead is paused for this session because too many drafts went unused.")
+    elif ready or running:
+        st.caption(f"Drafted ahead: {ready} section{'s' if ready != 1 else ''} ready, {running} in progress.")
+    else:
+        st.caption("Sections are drafted in the background once the required fields are filled in and a section stops changing.")
+
+
+# Download buttons of the case study: markdown straight away, the other
+# formats once the export worker has rendered them
+def export_buttons(document):
+    exports = get_export_manager()
+    columns = st.columns(len(EXPORT_FORMATS) + 1)
+    columns[0].download_button(
+        label="Download Markdown",
+        data=document,
+        file_name="ai_case_study.md",
+        mime="text/markdown",
+        on_click="ignore"
+    )
+    for column, (export_format, (extension, mime, label)) in zip(columns[1:], EXPORT_FORMATS.items()):
+        data = exports.get(document, export_format)
+        if data is not None:
+            lost = exports.lost_characters(document, export_format)
+            column.download_button(
+                label=f"Download {label}" + (" (simplified)" if lost else ""),
+                data=data,
+                file_name=f"ai_case_study.{extension}",
+                mime=mime,
+                on_click="ignore",
+                help=(
+                    f"The {label} fonts cannot show {' '.join(lost[:10])}: accents are dropped and other "
+                    "characters replaced. The Word and HTML exports keep them."
+                ) if lost else None
+            )
+        elif exports.status(document, export_format) == "failed":
+            column.button(f"{label} export failed", disabled=True, key=f"export_{export_format}")
+        else:
+            column.button(f"Preparing {label}...", disabled=True, key=f"export_{export_format}")
+
+
+# Download buttons while exports are still rendering. Checks every
+# EXPORT_POLL_INTERVAL seconds and reruns the app once they are all done.
+@st.fragment(run_every=EXPORT_POLL_INTERVAL)
+def pending_export_buttons(document):
+    if not get_export_manager().pending(document):
+        st.rerun()
+    export_buttons(document)
+
 
 # Set up page configuration
 st.set_page_config(
@@ -20,6 +305,15 @@ st.set_page_config(
 st.title("AI Case Study Generator")
 st.markdown("This tool generates APA 7th edition formatted case studies on AI implementation in educational contexts.")
 
+# Whose history this session shows. Only the owner's own runs are listed, so
+# the ID is a secret: it is never put in the URL (a shared link only opens the
+# one run in it). Someone who wants the same history on a later visit or
+# another browser copies it as their history key and enters it there.
+if 'owner_id' not in st.session_state:
+    st.session_state.owner_id = uuid.uuid4().hex
+# Links shared before the ID was taken out of the URL still carry it
+st.query_params.pop("owner", None)
+
 # Add sidebar with instructions and about
 with st.sidebar:
     st.header("Instructions")
@@ -30,6 +324,45 @@ with st.sidebar:
     4. Check the **Guiding Questions** tab for suggestions to expand your work.
     """)
     
+    st.header("Options")
+    st.checkbox(
+        "Show timing panel",
+        key="show_timing_panel",
+        help="Show per-stage timings, token usage and estimated cost for the last generation in the Case Study tab."
+    )
+    # The single-request draft mode has no sections to draft ahead
+    st.checkbox(
+        "Draft sections while I type",
+        value=SPECULATIVE_DRAFTING and DRAFT_MODE != "single",
+        key="speculative_drafting",
+        disabled=DRAFT_MODE == "single",
+        help="Start drafting each section in the background once the required fields are filled in and the section stops changing, so generating takes less time. Drafts of sections you change again are thrown away."
+    )
+    
+    # Recently generated case studies, newest first
+    st.header("History")
+    recent_runs = get_result_store().history(st.session_state.owner_id, limit=10)
+    if not recent_runs:
+        st.caption("Generated case studies will be listed here.")
+    for run in recent_runs:
+        st.button(
+            f"{run['title'] or 'Untitled'} · {format_run_time(run['created_at'])}",
+            key=f"history_{run['id']}",
+            help=f"Open this case study{' by ' + run['author'] if run['author'] else ''} and fill the form with its inputs.",
+            on_click=open_stored_run,
+            args=(run["id"],),
+            use_container_width=True
+        )
+    with st.expander("History key"):
+        st.caption("Keep this key private: anyone who enters it sees your history. Enter it on a later visit or in another browser to get the same history back.")
+        st.code(st.session_state.owner_id, language=None)
+        st.text_input(
+            "Use a history key",
+            key="history_key_input",
+            on_change=use_history_key,
+            placeholder="Paste a history key"
+        )
+    
     st.header("About")
     st.markdown("""
     This tool uses OpenAI's GPT model to generate structured case studies 
@@ -50,6 +383,12 @@ if 'current_tab' not in st.session_state:
 if 'generation_complete' not in st.session_state:
     st.session_state.generation_complete = False
 
+# Timings and metrics record of the most recent generation run
+if 'run_timings' not in st.session_state:
+    st.session_state.run_timings = None
+if 'run_metrics' not in st.session_state:
+    st.session_state.run_metrics = None
+
 # Add session state for author and acknowledgements if not present
 if 'author_name' not in st.session_state:
     st.session_state.author_name = ''
@@ -60,425 +399,69 @@ if 'acknowledgements' not in st.session_state:
 if 'case_study_title' not in st.session_state:
     st.session_state.case_study_title = ''
 
+# Generation job of this session. The job ID is also kept in the URL, so a
+# reloaded page or a reconnected browser picks the job (or its result) up again.
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
+    st.session_state.job_error = None
+    job_id = st.query_params.get("job")
+    adopted_job = get_job_manager().get(job_id) if job_id else None
+    if adopted_job is not None:
+        st.session_state.job_id = job_id
+        for key in FIELD_NAMES:
+            st.session_state[key] = adopted_job.fields.get(key, "")
+
+# Form values the shown case study was generated from
+if 'result_fields' not in st.session_state:
+    st.session_state.result_fields = {}
+
+# Stored run being shown. A run ID in the URL is opened straight from the
+# result store, so a refresh never loses a finished generation.
+if 'run_id' not in st.session_state:
+    st.session_state.run_id = None
+    run_id = st.query_params.get("run")
+    stored_run = get_result_store().get(run_id) if run_id and not st.session_state.job_id else None
+    if stored_run is not None:
+        load_stored_run(stored_run, fill_form=True)
+
 # Create tabs
 tab1, tab2, tab3 = st.tabs(["Input Form", "Case Study", "Guiding Questions"])
 
 # Input Form tab
 with tab1:
-    # Updated helper function following Streamlit conventions
-    def field_with_help(field_type, key, label, placeholder, help_text, height=None, **kwargs):
-        if field_type == "text_input":
-            field = st.text_input(
-                label, 
-                placeholder=placeholder,
-                help=help_text,
-                key=key, 
-                **kwargs
-            )
-        elif field_type == "text_area":
-            field = st.text_area(
-                label, 
-                placeholder=placeholder, 
-                help=help_text,
-                height=height, 
-                key=key, 
-                **kwargs
-            )
-        return field
-
     # Main form
     st.header("Case Study Information")
 
-    # Function to find and replace citation placeholders with real academic sources
-    def enhance_citations(case_study):
-        # Extract citation placeholders from the case study
-        placeholders = re.findall(r'\(placeholder:?\s*([^)]+)\)', case_study)
-        
-        if not placeholders:
-            return case_study, []  # No placeholders found
-        
-        # Create a list to store the references and their mappings
-        references = []
-        placeholder_to_citation = {}
-        
-        # For each placeholder, search for an appropriate academic source
-        for placeholder_text in placeholders:
-            placeholder_text = placeholder_text.strip()
-            
-            # Use OpenAI to find an appropriate academic source for this placeholder
-            try:
-                search_prompt = f"""
-                Find a real academic source (journal article or book) that would be appropriate for a citation about: '{placeholder_text}' 
-                in the context of AI in education or educational technology implementation.
-                
-                Return ONLY a properly formatted APA 7th edition reference entry.
-                Do not include any explanation or additional text.
-                """
-                
-                completion = client.chat.completions.create(
-                    model="gpt-4o-search-preview",
-                    web_search_options={},  # Enable web search
-                    messages=[
-                        {"role": "user", "content": search_prompt}
-                    ]
-                )
-                
-                # Get the citation from the response
-                citation = completion.choices[0].message.content.strip()
-                
-                # Extract author and year for in-text citation
-                author_year_match = re.match(r'([^(]+)\((\d{4})', citation)
-                if author_year_match:
-                    author = author_year_match.group(1).strip().split(',')[0].strip()
-                    year = author_year_match.group(2)
-                    in_text_citation = f"({author}, {year})"
-                else:
-                    # Fallback if we can't parse the author/year
-                    in_text_citation = f"(Author, YYYY)"
-                    
-                # Add to mapping and references list
-                full_placeholder = f"(placeholder: {placeholder_text})"
-                placeholder_to_citation[full_placeholder] = {
-                    "in_text": in_text_citation,
-                    "full_reference": citation
-                }
-                references.append(citation)
-                
-                # Log the mapping for debugging (will not be displayed to user)
-                print(f"Mapped '{full_placeholder}' to {in_text_citation}")
-                
-            except Exception as e:
-                # If there's an error, keep the placeholder
-                print(f"Error finding citation for '{placeholder_text}': {str(e)}")
-                continue
-        
-        # Replace placeholders in the case study
-        enhanced_case_study = case_study
-        for placeholder, citation_info in placeholder_to_citation.items():
-            enhanced_case_study = enhanced_case_study.replace(placeholder, citation_info["in_text"])
-        
-        # Return the enhanced case study and the list of references
-        return enhanced_case_study, references
-
-    # Function to rewrite case study with proper academic citations
-    def integrate_citations(case_study, references):
-        # Skip if no references were found
-        if not references or len(references) == 0:
-            return case_study
-        
-        # Prepare the citation integration prompt
-        citation_prompt = f"""
-        You are an expert academic writer specializing in education technology and AI implementation case studies.
-        
-        Below is a case study about AI implementation in education that contains citation placeholders in the format (placeholder: topic).
-        
-        Please rewrite this case study by:
-        1. Integrating the following academic references appropriately throughout the text where the placeholders appear
-        2. Maintaining the exact same content and structure of the original case study
-        3. Adding a properly formatted References section at the end following APA 7th edition guidelines
-        4. Using proper in-text citations (Author, Year) that correspond to the references list
-        
-        Case Study:
-        {case_study}
-        
-        Available References to Integrate:
-        {chr(10).join(references)}
-        
-        Important instructions:
-        - Preserve the academic narrative flow of the case study
-        - Maintain the EXACT same section structure as the original case study - do not add or remove any sections
-        - Keep all section headings exactly as they are in the original
-        - Do NOT add any subheadings
-        - Maintain all original content and insights
-        - Only modify the citation placeholders to use proper academic citations
-        - Use each reference where it is most relevant to the topic being discussed
-        - Ensure every reference is used at least once in the text
-        - Add a properly formatted References section at the end
-        """
-        
-        try:
-            # Call OpenAI to rewrite the case study with proper citations
-            completion = client.chat.completions.create(
-                model="gpt-4.1",
-                messages=[
-                    {"role": "developer", "content": "You are an expert academic writer specializing in education technology and AI implementation case studies. You follow APA 7th edition formatting perfectly."},
-                    {"role": "user", "content": citation_prompt}
-                ]
-            )
-            
-            # Return the rewritten case study
-            return completion.choices[0].message.content
-        
-        except Exception as e:
-            # If there's an error, log it and return the original case study with references appended
-            print(f"Error integrating citations: {str(e)}")
-            
-            # Fallback: Append references as a simple list
-            reference_section = "\n\n## References\n\n"
-            for ref in references:
-                reference_section += f"{ref}\n\n"
-            
-            return case_study + reference_section
-
-    with st.form("case_study_form"):
-        # Case Study Title (required)
-        case_study_title = field_with_help(
-            "text_input",
-            "case_study_title",
-            "Case Study Title",
-            "e.g., Implementing AI in Undergraduate Biology Courses",
-            "Enter a descriptive title for your case study. This will appear at the top of the case study.",
-        )
-        # Author's Name (required)
-        author_name = field_with_help(
-            "text_input",
-            "author_name",
-            "Author's Name",
-            "e.g., Jane Doe",
-            "Enter the full name of the author. This will appear at the top of the case study.",
-        )
-        # Section 1: Introduction and Context of AI Use
-        st.subheader("1. Introduction and Context of AI Use")
-        
-        # Course Level
-        course_level = field_with_help(
-            "text_input",
-            "course_level",
-            "Course Level",
-            "e.g., Undergraduate, Graduate, Professional Development",
-            "Specify the academic level at which the AI was implemented. This provides context for the educational setting and target audience."
-        )
-        
-        # Educational Context
-        educational_context = field_with_help(
-            "text_area",
-            "educational_context",
-            "Educational Context",
-            "Describe the specific educational context (course, discipline, learner demographics).",
-            "Include details about the course or program, subject area, discipline, and student demographics. This helps situate your case study in a specific educational framework.",
-            height=100
-        )
-        
-        # Problem or Goal
-        problem_goal = field_with_help(
-            "text_area",
-            "problem_goal",
-            "Problem, Opportunity, or Goal",
-            "Define the key problem, opportunity, or goal addressed through AI integration.",
-            "Clearly articulate what motivated the AI implementation. Was it to solve a particular challenge, improve a process, or enhance learning outcomes? This establishes the purpose of your AI integration.",
-            height=100
-        )
-        
-        # Section 2: Description of AI Technology
-        st.subheader("2. Description of AI Technology")
-        
-        # AI Tools
-        ai_tools = field_with_help(
-            "text_area",
-            "ai_tools",
-            "AI Tools or Platforms",
-            "Identify the specific AI tools or platforms used (e.g., specific software, applications, models).",
-            "Name and describe the specific AI tools, platforms, or technologies used. Be as specific as possible (e.g., 'OpenAI GPT-4' rather than just 'AI'). This helps others understand exactly what tools were employed.",
-            height=100
-        )
-        
-        # AI Functionality
-        ai_functionality = field_with_help(
-            "text_area",
-            "ai_functionality",
-            "AI Functionality",
-            "Explain briefly how the technology functions (e.g., machine learning model, generative AI).",
-            "Provide a concise explanation of how the AI technology works. This doesn't need to be highly technical but should give readers a basic understanding of the technological approach.",
-            height=100
-        )
-        
-        # Justification
-        ai_justification = field_with_help(
-            "text_area",
-            "ai_justification",
-            "Technology Justification",
-            "Justify the choice of AI technology in relation to the stated educational objectives.",
-            "Explain why this specific AI technology was chosen for your educational context. Connect the technology choice directly to your learning objectives or challenges being addressed.",
-            height=100
-        )
-        
-        # Section 3: Implementation Process
-        st.subheader("3. Implementation Process")
-        
-        # Preparation Phase
-        preparation_phase = field_with_help(
-            "text_area",
-            "preparation_phase",
-            "Preparation Phase",
-            "Describe the preparation phase (training faculty, curating datasets, ethical clearance, etc.)",
-            "Detail the steps taken before actual implementation, such as faculty training, technology setup, data preparation, securing permissions, or pilot testing. This shows the groundwork required for successful implementation.",
-            height=100
-        )
-        
-        # Execution Phase
-        execution_phase = field_with_help(
-            "text_area",
-            "execution_phase",
-            "Execution Phase",
-            "Detail the actual deployment in classes, workshops, or support systems.",
-            "Describe how the AI was actually deployed and used in the educational setting. Include information about the timeline, student interaction, and integration into existing teaching practices.",
-            height=100
-        )
-        
-        # Post-deployment Support
-        post_deployment = field_with_help(
-            "text_area",
-            "post_deployment",
-            "Post-deployment Support",
-            "Explain ongoing technical or pedagogical assistance, monitoring, etc.",
-            "Outline the support systems put in place after implementation, such as technical support, monitoring for issues, continuous training, or iterative improvements based on feedback.",
-            height=100
-        )
-        
-        # Section 4: Ethical and Inclusive Considerations
-        st.subheader("4. Ethical and Inclusive Considerations")
-        
-        # Ethical Practices
-        ethical_practices = field_with_help(
-            "text_area",
-            "ethical_practices",
-            "Ethical AI Practices",
-            "Describe specific actions taken to ensure ethical AI practices (e.g., addressing biases, transparency).",
-            "Explain specific measures taken to ensure ethical use of AI, such as bias detection and mitigation, transparent communication about AI use, data privacy protections, or informed consent processes.",
-            height=100
-        )
-        
-        # Inclusivity
-        inclusivity = field_with_help(
-            "text_area",
-            "inclusivity",
-            "Inclusivity and Accessibility",
-            "Detail how inclusivity and accessibility were ensured through AI design or adaptation.",
-            "Describe how the AI implementation accounted for diverse learning needs, accessibility requirements, and inclusion of all students regardless of background or ability.",
-            height=100
-        )
-        
-        # EDI Principles
-        edi_principles = field_with_help(
-            "text_area",
-            "edi_principles",
-            "EDI Principles",
-            "Explain how Equity, Diversity, and Inclusion principles informed decisions about AI use.",
-            "Articulate how considerations of equity, diversity, and inclusion shaped the implementation approach, including how potential barriers were identified and addressed.",
-            height=100
-        )
-        
-        # Section 5: Outcomes and Educational Impact
-        st.subheader("5. Outcomes and Educational Impact")
-        
-        # Impact
-        impact = field_with_help(
-            "text_area",
-            "impact",
-            "AI Impact",
-            "Clearly articulate how AI directly impacted teaching practices, learning experiences, or educational outcomes.",
-            "Describe the concrete ways in which the AI implementation affected teaching and learning. Focus on specific changes, improvements, or transformations rather than general statements.",
-            height=100
-        )
-        
-        # Evidence
-        evidence = field_with_help(
-            "text_area",
-            "evidence",
-            "Evidence of Impact",
-            "Provide evidence such as student or faculty feedback, qualitative observations, or quantitative measures.",
-            "Include specific evidence that demonstrates the impact, such as assessment results, student feedback, faculty observations, or comparative data. This strengthens the credibility of your case study.",
-            height=100
-        )
-        
-        # Critical Reflection
-        critical_reflection = field_with_help(
-            "text_area",
-            "critical_reflection",
-            "Critical Reflection",
-            "Reflect critically on the role of AI in enhancing or transforming educational experiences.",
-            "Offer thoughtful analysis of how and why AI influenced the educational experience, considering both intended and unintended effects, limitations, and deeper implications.",
-            height=100
-        )
-        
-        # Section 6: Challenges and Limitations
-        st.subheader("6. Challenges and Limitations of AI Implementation")
-        
-        # Challenges
-        challenges = field_with_help(
-            "text_area",
-            "challenges",
-            "Challenges and Barriers",
-            "Document any significant technical, pedagogical, or institutional barriers encountered.",
-            "Honestly describe difficulties encountered during implementation, which might include technical issues, resistance to adoption, institutional constraints, or pedagogical challenges.",
-            height=100
-        )
-        
-        # Mitigation Strategies
-        mitigation_strategies = field_with_help(
-            "text_area",
-            "mitigation_strategies",
-            "Mitigation Strategies",
-            "Describe strategies employed to overcome or mitigate these challenges.",
-            "Explain approaches used to address the challenges identified, including adaptations, workarounds, or solutions developed in response to specific barriers.",
-            height=100
-        )
-        
-        # Reflective Insights
-        reflective_insights = field_with_help(
-            "text_area",
-            "reflective_insights",
-            "Reflective Insights",
-            "Provide reflective insights or recommendations for future AI integrations.",
-            "Share deeper reflections on what was learned through addressing challenges, including insights that might help others avoid similar issues or more effectively implement AI.",
-            height=100
-        )
-        
-        # Section 7: Sustainability and Future AI Use
-        st.subheader("7. Sustainability and Future AI Use")
-        
-        # Future Plans
-        future_plans = field_with_help(
-            "text_area",
-            "future_plans",
-            "Future Plans",
-            "Outline plans or possibilities for continuing, scaling, or adapting AI use in similar contexts.",
-            "Describe how this AI implementation might continue, expand, or evolve in the future, including plans for sustainability, scaling, or adaptation to other contexts.",
-            height=100
-        )
-        
-        # Future Research
-        future_research = field_with_help(
-            "text_area",
-            "future_research",
-            "Future Research",
-            "Highlight potential areas for future research or development arising from the current implementation.",
-            "Identify questions, gaps, or opportunities for further investigation that emerged from this implementation, suggesting avenues for future research or development.",
-            height=100
-        )
-        
-        # Recommendations
-        recommendations = field_with_help(
-            "text_area",
-            "recommendations",
-            "Recommendations",
-            "Suggest recommendations for institutional support or policy considerations for ongoing AI adoption.",
-            "Offer specific, actionable recommendations for institutional policies, support structures, or resources that would facilitate effective AI integration in educational settings.",
-            height=100
-        )
-        
-        # Acknowledgements (optional, at the end)
-        acknowledgements = field_with_help(
-            "text_area",
-            "acknowledgements",
-            "Acknowledgements (optional)",
-            "Add any acknowledgements you wish to include at the end of the case study.",
-            "This section is optional. Use it to thank contributors, institutions, or anyone who supported your work.",
-            height=70
+    # Values of widgets inside a form only arrive on submit, so drafting
+    # ahead shows the same widgets in a plain container instead
+    speculate = st.session_state.speculative_drafting and DRAFT_MODE != "single"
+    with st.container(border=True) if speculate else st.form("case_study_form"):
+        # Widgets are generated from the form schema, section by section
+        for section in FORM_SCHEMA:
+            if section.title:
+                st.subheader(section.title)
+            for field in section.fields:
+                render_field(field)
+        
+        # Skip cached responses and generate everything again
+        st.checkbox(
+            "Force regeneration",
+            key="force_regeneration",
+            help="Ignore cached results from earlier submissions of the same content and generate a fresh case study."
         )
         
         # Submit button
-        submitted = st.form_submit_button("Generate Case Study")
+        if speculate:
+            submitted = st.button("Generate Case Study")
+        else:
+            submitted = st.form_submit_button("Generate Case Study")
+
+    if not speculate:
+        if "speculator" in st.session_state:
+            # Drafting ahead was switched off
+            st.session_state.speculator.reset()
+    elif not submitted:
+        speculative_drafting()
     
     # Notification area after the form
     if st.session_state.final_case_study is not None and st.session_state.generation_complete:
@@ -489,187 +472,109 @@ with tab1:
 
     # Generate case study when form is submitted
     if submitted:
-        required_fields = [case_study_title, author_name, course_level, educational_context, problem_goal, ai_tools]
-        if not all(required_fields):
-            st.error("Please fill out at least the Case Study Title, Author's Name, Course Level, Educational Context, Problem/Goal, and AI Tools fields before generating the case study.")
+        fields = {key: st.session_state.get(key, "") for key in FIELD_NAMES}
+        missing = missing_required_fields(fields)
+        if missing:
+            st.error(
+                "Please fill out the following fields before generating the case study: "
+                + "; ".join(FIELDS[key].label for key in missing) + "."
+            )
         else:
-            with st.spinner("Generating your case study..."):
-                # Prepare the structured sections and check if they're empty
-                section1 = f"""
-                Course Level: {course_level}
-                
-                Educational Context: {educational_context}
-                
-                Problem, Opportunity, or Goal: {problem_goal}
-                """
-                
-                section2 = f"""
-                AI Tools or Platforms: {ai_tools}
-                
-                AI Functionality: {ai_functionality}
-                
-                Technology Justification: {ai_justification}
-                """
-                
-                section3 = f"""
-                Preparation Phase: {preparation_phase}
-                
-                Execution Phase: {execution_phase}
-                
-                Post-deployment Support: {post_deployment}
-                """
-                
-                section4 = f"""
-                Ethical AI Practices: {ethical_practices}
-                
-                Inclusivity and Accessibility: {inclusivity}
-                
-                EDI Principles: {edi_principles}
-                """
-                
-                section5 = f"""
-                AI Impact: {impact}
-                
-                Evidence of Impact: {evidence}
-                
-                Critical Reflection: {critical_reflection}
-                """
-                
-                section6 = f"""
-                Challenges and Barriers: {challenges}
-                
-                Mitigation Strategies: {mitigation_strategies}
-                
-                Reflective Insights: {reflective_insights}
-                """
-                
-                section7 = f"""
-                Future Plans: {future_plans}
-                
-                Future Research: {future_research}
-                
-                Recommendations: {recommendations}
-                """
-                
-                # Check which sections have content
-                section_content = {
-                    "1. Introduction and Context of AI Use": section1.strip(),
-                    "2. Description of AI Technology": section2.strip(),
-                    "3. Implementation Process": section3.strip(),
-                    "4. Ethical and Inclusive Considerations": section4.strip(),
-                    "5. Outcomes and Educational Impact": section5.strip(),
-                    "6. Challenges and Limitations of AI Implementation": section6.strip(),
-                    "7. Sustainability and Future AI Use": section7.strip()
-                }
-                
-                # Create the case study structure with only non-empty sections
-                case_study_sections = ""
-                for title, content in section_content.items():
-                    # Check if the section has any actual content beyond field labels
-                    has_content = False
-                    for line in content.split('\n'):
-                        # Skip lines that are just field labels without content
-                        if ':' in line and line.split(':', 1)[1].strip() == '':
-                            continue
-                        if line.strip():  # Any non-empty line that's not just a field label
-                            has_content = True
-                            break
-                    
-                    if has_content:
-                        case_study_sections += f"\n\n{title}\n{content}\n"
-                
-                # Prepare prompt for case study generation
-                case_study_prompt = f"""
-                Generate a comprehensive case study in APA 7th edition format about AI implementation in an educational context based on the following information.
-                
-                The case study should be written as a cohesive academic narrative that flows naturally between topics, while covering only these sections that have content:
-                {case_study_sections}
-                
-                Format guidelines:
-                - Write in a flowing academic narrative style that connects ideas across sections
-                - Include ONLY the main section headings as provided above to improve readability
-                - DO NOT include sections that were not provided in the input
-                - Do NOT include any subheadings within sections
-                - Create placeholder for citations for any academic claim.
-                - The tone should be academic but accessible, with a focus on practical insights
-                
-                When you need to include a citation, use the format (placeholder: topic) where "topic" briefly describes what the citation is about. For example, (placeholder: AI bias in education) or (placeholder: learning analytics).
-                """
-                
-                # Generate the case study using OpenAI API
-                completion = client.chat.completions.create(
-                    model="gpt-4.1",  # Using GPT-4 for higher quality output
-                    messages=[
-                        {"role": "developer", "content": "You are an expert academic writer specializing in education technology and AI implementation case studies. You follow APA 7th edition formatting perfectly."},
-                        {"role": "user", "content": case_study_prompt}
-                    ]
-                )
-                
-                case_study = completion.choices[0].message.content
-                
-                # Find academic citations for placeholders
-                with st.spinner("Searching for academic sources..."):
-                    _, references = enhance_citations(case_study)
-                    
-                    # Now integrate citations properly throughout the case study
-                    if references:
-                        with st.spinner("Integrating academic citations into the case study..."):
-                            final_case_study = integrate_citations(case_study, references)
-                    else:
-                        final_case_study = case_study
-                
-                # Generate review questions 
-                with st.spinner("Generating guiding questions for expansion..."):
-                    review_prompt = f"""
-                    Based on the following case study, generate 5-7 thoughtful questions that could help the author expand and improve their work.
-                    Focus on areas that might be underdeveloped, need more evidence, or could benefit from additional perspectives.
-                    
-                    Case study: {final_case_study}
-                    """
-                    
-                    # Generate the review questions using OpenAI API
-                    review_completion = client.chat.completions.create(
-                        model="gpt-4.1",
-                        messages=[
-                            {"role": "developer", "content": "You are an expert academic reviewer who provides constructive feedback on case studies about AI in education."},
-                            {"role": "user", "content": review_prompt}
-                        ]
-                    )
-                    
-                    review_questions = review_completion.choices[0].message.content
-                
-                # Store results in session state
-                st.session_state.final_case_study = final_case_study
-                st.session_state.review_questions = review_questions
-                st.session_state.generation_complete = True
-                
-                # Automatically switch to the Case Study tab
-                st.session_state.current_tab = "Case Study"
-                st.rerun()
+            # Sections unchanged since the case study on screen are reused, unless regeneration is forced
+            previous = None
+            if st.session_state.run_id and not st.session_state.force_regeneration:
+                previous = get_result_store().get(st.session_state.run_id)
+            # Sections drafted ahead are handed to the job, which reuses them the same way
+            speculative = None
+            if speculate:
+                speculator = session_speculator()
+                if st.session_state.force_regeneration:
+                    speculator.reset()
+                else:
+                    speculative = speculator.claim(fields)
+            # The job runs on the shared worker pool; this rerun returns straight away
+            job_id = get_job_manager().submit(
+                fields,
+                bypass_cache=st.session_state.force_regeneration,
+                previous=previous,
+                owner=st.session_state.owner_id,
+                speculative=speculative
+            )
+            st.session_state.job_id = job_id
+            st.session_state.job_error = None
+            st.session_state.generation_complete = False
+            st.query_params["job"] = job_id
+
+    if st.session_state.job_id:
+        st.info("⏳ Your case study is being generated. Follow its progress in the Case Study tab.")
+    elif st.session_state.job_error:
+        st.error(st.session_state.job_error)
 
 # Case Study tab
 with tab2:
-    if st.session_state.final_case_study:
+    if st.session_state.job_id:
+        job_progress()
+    elif st.session_state.final_case_study:
         st.header("Generated Case Study (APA 7th Edition)")
         # Compose the full case study with title, author, and acknowledgements
-        case_study_title_display = st.session_state.get("case_study_title", "")
-        author_name_display = st.session_state.get("author_name", "")
-        case_study_display = (
-            f"# {case_study_title_display}\n\n"
-            f"**Author:** {author_name_display}\n\n"
-            f"{st.session_state.final_case_study}"
+        case_study_display = session_memo(
+            "case_study_display",
+            compose_case_study_document,
+            st.session_state.result_fields.get("case_study_title", ""),
+            st.session_state.result_fields.get("author_name", ""),
+            st.session_state.final_case_study,
+            st.session_state.result_fields.get("acknowledgements", "")
         )
-        if st.session_state.acknowledgements and st.session_state.acknowledgements.strip():
-            case_study_display += f"\n\n**Acknowledgements**\n{st.session_state.acknowledgements.strip()}"
         st.markdown(case_study_display)
         
-        # Add download button for the case study
-        st.download_button(
-            label="Download Case Study",
-            data=case_study_display,
-            file_name="ai_case_study.md",
-            mime="text/markdown"
-        )
+        # Diff against earlier generations of the same case study
+        earlier_versions = get_result_store().versions(st.session_state.run_id, st.session_state.owner_id) if st.session_state.run_id else []
+        if earlier_versions:
+            with st.expander(f"Compare with an earlier version ({len(earlier_versions)} available)"):
+                compare_id = st.selectbox(
+                    "Earlier version",
+                    [run["id"] for run in earlier_versions],
+                    format_func=lambda run_id: next(
+                        f"{format_run_time(run['created_at'])} · {run['author'] or 'unknown author'}"
+                        for run in earlier_versions if run["id"] == run_id
+                    ),
+                    key="compare_run_id"
+                )
+                compare_run = get_result_store().get(compare_id)
+                diff = session_memo(
+                    "version_diff",
+                    diff_texts,
+                    compare_run["final_case_study"] if compare_run else "",
+                    st.session_state.final_case_study
+                )
+                st.code(diff or "No differences in the case study text.", language="diff")
+        
+        # Optional timing panel for the last run
+        if st.session_state.get("show_timing_panel") and st.session_state.run_metrics:
+            run_metrics = st.session_state.run_metrics
+            with st.expander("Timing panel", expanded=True):
+                totals = run_metrics["totals"]
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Total time", f"{run_metrics['total_time']:.1f}s")
+                col2.metric("First token", f"{run_metrics['time_to_first_token']:.1f}s")
+                col3.metric("Tokens", f"{totals['prompt_tokens'] + totals['completion_tokens']:,}")
+                col4.metric("Est. cost", f"${totals['cost_usd']:.4f}")
+                st.dataframe(session_memo("timing_rows", timing_rows, run_metrics), use_container_width=True)
+                scheduler_stats = get_scheduler().stats()
+                st.caption(
+                    f"Request scheduler: {scheduler_stats['queued']} queued, "
+                    f"{scheduler_stats['in_flight']} in flight, "
+                    f"{scheduler_stats['retries']} retries, "
+                    f"{scheduler_stats['rate_limited']} rate-limited responses since start"
+                )
+        
+        # Download buttons for the case study. Exports are rendered in the
+        # background once per document; the buttons refresh when they are ready.
+        session_memo("export_submitted", get_export_manager().submit, case_study_display)
+        if get_export_manager().pending(case_study_display):
+            pending_export_buttons(case_study_display)
+        else:
+            export_buttons(case_study_display)
     else:
         st.info("Please generate a case study using the Input Form tab.")
 
@@ -684,7 +589,8 @@ with tab3:
             label="Download Guiding Questions",
             data=st.session_state.review_questions,
             file_name="guiding_questions.md", 
-            mime="text/markdown"
+            mime="text/markdown",
+            on_click="ignore"
         )
     else:
         st.info("Please generate a case study first to get guiding questions.")
@@ -0,0 +1,183 @@
+import itertools
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+from metrics import MeteredClient, current_stage, note_route
+
+# Per-stage routing of chat completions to model backends. By default every
+# stage goes to the OpenAI client passed to the pipeline. A stage can instead
+# be routed to another OpenAI-compatible endpoint, such as a llama.cpp or
+# vLLM server on the same machine, and to another model there. When the
+# routed backend fails or does not answer within the route's latency
+# threshold, the request falls back to another backend. Every routing
+# decision is recorded on the stage in the run metrics.
+#
+# Requests to another backend go through the same wrappers as the default
+# client (scheduler, completion cache, metrics), and only carry the request
+# parameters the backend accepts: OpenAI-only options such as
+# web_search_options or stream_options are dropped.
+#
+#   BACKENDS='{"local": {"base_url": "http://localhost:8080/v1"}}'
+#   MODEL_ROUTES='{"questions": {"backend": "local", "model": "qwen2.5-3b-instruct", "timeout": 20}}'
+
+# Name of the client the pipeline is given
+DEFAULT_BACKEND = "openai"
+
+# Extra backends by name: {"base_url", "api_key" or "api_key_env", and
+# optionally "params", the request parameters it accepts}
+BACKENDS = json.loads(os.getenv("BACKENDS", "{}"))
+
+# Request parameters sent to a backend that does not list its own
+BACKEND_PARAMS = ("model", "messages", "stream", "timeout", "temperature", "top_p", "max_tokens", "stop", "seed")
+
+# Routes by stage: "draft", "section", "stitch", "citation", "integration" or
+# "questions". A route has a "backend", optionally a "model" (default: the
+# model the stage asks for), a latency threshold "timeout" in seconds and a
+# "fallback" backend ("" for none) with an optional "fallback_model".
+MODEL_ROUTES = json.loads(os.getenv("MODEL_ROUTES", "{}"))
+
+# Latency threshold of routes that do not set their own, in seconds
+ROUTE_TIMEOUT = float(os.getenv("ROUTE_TIMEOUT", "30"))
+
+_backend_clients = {}
+_backend_clients_lock = threading.Lock()
+
+
+# Route key of a stage name: per-section and per-citation stages share one route
+def route_key(stage_name):
+    return (stage_name or "").split(":", 1)[0]
+
+
+# OpenAI client for a configured backend, built once per process
+def get_backend_client(name, backends=None):
+    backends = BACKENDS if backends is None else backends
+    with _backend_clients_lock:
+        if name not in _backend_clients:
+            if name not in backends:
+                raise ValueError(f"Unknown backend '{name}', configure it in BACKENDS")
+            from openai import OpenAI
+
+            from pipeline import create_http_client
+
+            config = backends[name]
+            _backend_clients[name] = OpenAI(
+                base_url=config["base_url"],
+                api_key=os.getenv(config.get("api_key_env", "")) or config.get("api_key") or "none",
+                max_retries=0,
+                http_client=create_http_client()
+            )
+        return _backend_clients[name]
+
+
+# Request parameters `name` accepts
+def backend_params(name, backends=None):
+    backends = BACKENDS if backends is None else backends
+    return tuple(backends.get(name, {}).get("params", BACKEND_PARAMS))
+
+
+# Client wrapper that drops the request parameters a backend does not accept
+class FilteredClient:
+    def __init__(self, client, params=BACKEND_PARAMS):
+        self.client = client
+        self.params = params
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def create(self, **request):
+        return self.client.chat.completions.create(**{k: v for k, v in request.items() if k in self.params})
+
+
+# `backend_client` wrapped in the same wrappers as `client`: every wrapper in
+# its chain with a `rewrap(client)` method (scheduler, cache, metrics, ...)
+# is applied again around `backend_client`, innermost first
+def wrap_like(client, backend_client):
+    wrappers = []
+    while client is not None:
+        if hasattr(type(client), "rewrap"):
+            wrappers.append(client)
+        client = getattr(client, "__dict__", {}).get("client")
+    for wrapper in reversed(wrappers):
+        backend_client = wrapper.rewrap(backend_client)
+    return backend_client
+
+
+# Client wrapper that sends each request to the backend routed for the
+# current stage. `client` is the default backend; `backend_clients` maps the
+# other backend names to their raw clients (built from BACKENDS when
+# missing). Those are wrapped like `client`, so their requests are
+# scheduled, cached and added to the run metrics like the default
+# backend's, and filtered to the parameters the backend accepts.
+# Streamed requests only count as answered once their first chunk arrives,
+# so a slow first token also triggers the fallback.
+class RoutedClient:
+    def __init__(self, client, routes=None, backend_clients=None, backends=None):
+        self.client = client
+        self.routes = MODEL_ROUTES if routes is None else routes
+        self.backends = BACKENDS if backends is None else backends
+        self.backend_clients = {name: self._wrap(name, c) for name, c in (backend_clients or {}).items()}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _wrap(self, name, backend_client):
+        wrapped = wrap_like(self.client, FilteredClient(backend_client, backend_params(name, self.backends)))
+        # Usage is always metered, even when the default client is not
+        return wrapped if isinstance(wrapped, MeteredClient) else MeteredClient(wrapped)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def create(self, **request):
+        stage = current_stage()
+        route = self.routes.get(route_key(stage.name if stage is not None else None))
+        if route is None:
+            return self.client.chat.completions.create(**request)
+
+        backend = route["backend"]
+        model = route.get("model", request.get("model"))
+        threshold = route.get("timeout", ROUTE_TIMEOUT)
+        routed = {**request, "model": model, "timeout": min(threshold, request.get("timeout") or threshold)}
+        start = time.perf_counter()
+        try:
+            response = self._send(backend, routed)
+            note_route(backend, model, time.perf_counter() - start)
+            return response
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            fallback = route.get("fallback", DEFAULT_BACKEND)
+            note_route(backend, model, elapsed, error=str(e))
+            if not fallback or fallback == backend:
+                raise
+            print(f"Backend '{backend}' failed after {elapsed:.2f}s, falling back to '{fallback}': {str(e)}")
+
+        fallback_model = route.get("fallback_model", request.get("model"))
+        start = time.perf_counter()
+        response = self._send(fallback, {**request, "model": fallback_model})
+        note_route(fallback, fallback_model, time.perf_counter() - start, fallback=True)
+        return response
+
+    def _send(self, backend, request):
+        if backend == DEFAULT_BACKEND:
+            client = self.client
+        else:
+            if backend not in self.backend_clients:
+                self.backend_clients[backend] = self._wrap(backend, get_backend_client(backend, self.backends))
+            client = self.backend_clients[backend]
+
+        response = client.chat.completions.create(**request)
+        if not request.get("stream"):
+            return response
+        chunks = iter(response)
+        first = next(chunks, None)
+        return itertools.chain([first] if first is not None else [], chunks)
+
+
+# Wrap `client` in a RoutedClient when any routes are configured
+def route_client(client, routes=None, backend_clients=None, backends=None):
+    routes = MODEL_ROUTES if routes is None else routes
+    if not routes:
+        return client
+    return RoutedClient(client, routes=routes, backend_clients=backend_clients, backends=backends)
@@ -0,0 +1,224 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from citation_cache import CitationCache
+from completion_cache import CachedClient, create_completion_cache
+from form_schema import FIELD_NAMES
+from pipeline import compose_case_study_document, create_client, missing_required_fields, run_pipeline
+from scheduler import BATCH, ScheduledClient
+
+# Headless batch generation of case studies.
+#
+#   python docs/batch.py cohort.jsonl --output-dir out --workers 8
+#
+# Each input record has the shape of react-app/sample-data.json (camelCase
+# keys such as "caseStudyTitle"; snake_case form field names also work).
+# Inputs may be .jsonl files with one record per line or .json files holding
+# a single record or a list of records. Every finished record is written to
+# the output directory straight away and logged to a checkpoint file, so an
+# interrupted run picks up where it stopped when started again.
+
+DEFAULT_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+
+CHECKPOINT_NAME = "checkpoint.jsonl"
+
+# One client, completion cache and citation cache per worker process, created on first use
+_worker_client = None
+_worker_completion_cache = None
+_worker_cache = None
+_worker_lock = threading.Lock()
+
+
+def camel_to_snake(name):
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+
+# Map an input record onto the form field names used by the pipeline
+def normalize_record(record):
+    fields = {}
+    for key, value in record.items():
+        field = camel_to_snake(key)
+        if field in FIELD_NAMES:
+            fields[field] = value if isinstance(value, str) else str(value)
+    return fields
+
+
+# Stable ID for a record: its own "id" if present, otherwise a hash of its fields
+def record_id(record, fields):
+    if record.get("id"):
+        return re.sub(r'[^\w.-]', '_', str(record["id"]))
+    canonical = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+# Yield the records from .json and .jsonl input files
+def load_records(paths):
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping {path}:{line_number}: {e}", file=sys.stderr)
+            else:
+                data = json.load(f)
+                yield from (data if isinstance(data, list) else [data])
+
+
+# IDs of records that finished successfully in an earlier run
+def load_checkpoint(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Partially written line from a crash
+            if entry.get("status") == "done":
+                done.add(entry["id"])
+    return done
+
+
+# Append one entry to the checkpoint and force it to disk
+def write_checkpoint(checkpoint, entry):
+    checkpoint.write(json.dumps(entry) + "\n")
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
+
+
+# Write a file so that readers never see it half written
+def write_atomic(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def get_worker_resources():
+    global _worker_client, _worker_completion_cache, _worker_cache
+    with _worker_lock:
+        if _worker_client is None:
+            _worker_client = create_client()
+            _worker_completion_cache = create_completion_cache()
+            _worker_cache = CitationCache()
+        return _worker_client, _worker_completion_cache, _worker_cache
+
+
+# Generate one case study and write <id>.md and <id>.json to `output_dir`.
+# `force` skips cached completions and regenerates everything.
+def process_record(rid, fields, output_dir, force=False):
+    client, completion_cache, cache = get_worker_resources()
+    start = time.perf_counter()
+    # Batch requests yield to interactive ones from the app in the same process
+    run_client = CachedClient(ScheduledClient(client, priority=BATCH), completion_cache, bypass=force)
+    result = run_pipeline(run_client, fields, cache=cache)
+    elapsed = time.perf_counter() - start
+
+    document = compose_case_study_document(
+        fields.get("case_study_title", ""),
+        fields.get("author_name", ""),
+        result["final_case_study"],
+        fields.get("acknowledgements", "")
+    )
+    document_path = os.path.join(output_dir, f"{rid}.md")
+    write_atomic(document_path, document)
+    write_atomic(
+        os.path.join(output_dir, f"{rid}.json"),
+        json.dumps({"id": rid, "inputs": fields, **result}, indent=2, ensure_ascii=False)
+    )
+    return {"id": rid, "elapsed": elapsed, "output": document_path}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def print_summary(done, failed, skipped, latencies, wall_time):
+    print("\nBatch summary")
+    print(f"  completed: {done}")
+    print(f"  failed:    {failed}")
+    print(f"  skipped:   {skipped} (already in checkpoint)")
+    print(f"  wall time: {wall_time:.1f}s")
+    if latencies:
+        print(f"  throughput: {done / wall_time * 60:.2f} case studies/min")
+        print(
+            f"  latency:   mean {sum(latencies) / len(latencies):.1f}s, "
+            f"p50 {percentile(latencies, 0.5):.1f}s, p95 {percentile(latencies, 0.95):.1f}s"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate case studies in bulk from JSON/JSONL records.")
+    parser.add_argument("inputs", nargs="+", help="JSON or JSONL files with case study records")
+    parser.add_argument("-o", "--output-dir", default="batch_output", help="directory for generated case studies")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="number of records processed at once")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread",
+                        help="run workers as threads (default) or separate processes")
+    parser.add_argument("--force", action="store_true", help="ignore cached completions and regenerate every record")
+    parser.add_argument("--checkpoint", help=f"checkpoint file (default: <output-dir>/{CHECKPOINT_NAME})")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    checkpoint_path = args.checkpoint or os.path.join(args.output_dir, CHECKPOINT_NAME)
+    completed = load_checkpoint(checkpoint_path)
+
+    jobs = {}
+    skipped = 0
+    for record in load_records(args.inputs):
+        fields = normalize_record(record)
+        rid = record_id(record, fields)
+        if rid in completed:
+            skipped += 1
+            continue
+        jobs[rid] = fields
+
+    done = failed = 0
+    latencies = []
+    start = time.perf_counter()
+    executor_class = ProcessPoolExecutor if args.executor == "process" else ThreadPoolExecutor
+
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+            executor_class(max_workers=max(1, args.workers)) as executor:
+        futures = {}
+        for rid, fields in jobs.items():
+            missing = missing_required_fields(fields)
+            if missing:
+                failed += 1
+                print(f"[{rid}] missing required fields: {', '.join(missing)}", file=sys.stderr)
+                write_checkpoint(checkpoint, {"id": rid, "status": "failed", "error": f"missing {', '.join(missing)}"})
+                continue
+            futures[executor.submit(process_record, rid, fields, args.output_dir, args.force)] = rid
+
+        for future in as_completed(futures):
+            rid = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{rid}] failed: {e}", file=sys.stderr)
+                write_checkpoint(checkpoint, {"id": rid, "status": "failed", "error": str(e)})
+                continue
+            done += 1
+            latencies.append(outcome["elapsed"])
+            write_checkpoint(checkpoint, {"id": rid, "status": "done", "output": outcome["output"], "elapsed": outcome["elapsed"]})
+            print(f"[{rid}] done in {outcome['elapsed']:.1f}s -> {outcome['output']} ({done}/{len(futures)})")
+
+    print_summary(done, failed, skipped, latencies, time.perf_counter() - start)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,571 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from batch import load_records, normalize_record, percentile
+
+# Performance benchmarks for the case study generator.
+#
+#   python docs/benchmark.py startup --runs 5 --reruns 20
+#
+# "startup" measures what a user waits for before the form appears and on
+# every interaction afterwards:
+#   cold start   - a fresh Python process importing Streamlit and running app.py once
+#   rerun        - running app.py again in a warm process with a generated
+#                  case study on screen, as Streamlit does on every interaction
+#   client init  - building the OpenAI client, which is deferred until the
+#                  first generation
+# Pass --max-cold / --max-rerun to fail (exit code 1) when a median exceeds a
+# budget, so slow startups show up as regressions.
+#
+#   python docs/benchmark.py load --profile realistic --concurrency 1 4 8
+#
+# "load" runs the whole pipeline (section assembly, streamed draft, citation
+# search, citation assembly or polish pass, guiding questions) through a real
+# OpenAI client against a local fake chat-completions server, so no API
+# credits are spent. The server's latency, token rate and error rates come
+# from a profile in fake_openai.SERVER_PROFILES. For every concurrency level
+# it reports p50/p95 run latency, time to first token, draft time and
+# throughput. Pass several --draft-mode values to A/B the draft modes, e.g.
+# "--draft-mode single parallel" to compare one drafting call with
+# concurrently drafted, stitched sections.
+#
+#   python docs/benchmark.py apa --count 50000
+#
+# "apa" checks the APA reference parser against the reference corpus in
+# docs/data/apa_references.json, next to the single author/year regex it
+# replaced, checks that the corpus's non-references (entries with a null
+# "in_text", such as apologetic search answers) are rejected, and measures
+# how many references per second it parses. Pass
+# --min-rate to fail when throughput drops below a floor.
+#
+#   python docs/benchmark.py index --repeat 1000
+#
+# "index" measures the local citation index: building it from the corpus,
+# opening the memory-mapped index file, and matching placeholder topics (the
+# fake server's topics unless --topics is given) against it, with the share
+# of topics answered without a web search. Pass --max-load / --max-lookup-ms
+# to fail when loading or the p95 lookup exceeds a budget.
+#
+#   python docs/benchmark.py export --sections 8 40 200
+#
+# "export" renders generated-looking case studies of growing size (sections
+# of filler text with citations and a References section) to every export
+# format, and reports the render time and file size per format, next to the
+# time to serve an already rendered file from the render cache. Pass
+# --max-seconds to fail when a render exceeds a budget.
+
+DOCS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(DOCS_DIR, "app.py")
+SAMPLE_DATA_PATH = os.path.join(DOCS_DIR, os.pardir, "react-app", "sample-data.json")
+APA_CORPUS_PATH = os.path.join(DOCS_DIR, "data", "apa_references.json")
+
+# In-text citation as derived before the APA parser, for comparison
+LEGACY_IN_TEXT_RE = re.compile(r'([^(]+)\((\d{4})')
+
+# Runs in a fresh interpreter and prints the cold start timings as JSON
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=60).run()
+first_run = time.perf_counter()
+import pipeline
+client_start = time.perf_counter()
+pipeline.create_client()
+client_init = time.perf_counter() - client_start
+print(json.dumps({
+    "import": imported - start,
+    "first_run": first_run - imported,
+    "cold_start": first_run - start,
+    "client_init": client_init,
+    "errors": [str(e.value) for e in at.exception],
+}))
+"""
+
+
+def summarize(values):
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "max": max(values),
+    }
+
+
+def print_stats(label, stats):
+    print(
+        f"  {label:<12} mean {stats['mean'] * 1000:7.1f}ms  p50 {stats['p50'] * 1000:7.1f}ms  "
+        f"p95 {stats['p95'] * 1000:7.1f}ms  max {stats['max'] * 1000:7.1f}ms"
+    )
+
+
+# Cold start timings of `runs` fresh processes
+def measure_cold_start(runs):
+    env = {**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "benchmark"}
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, APP_PATH],
+            cwd=DOCS_DIR, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        if sample["errors"]:
+            raise RuntimeError(f"app.py raised during startup: {sample['errors'][0]}")
+        sample["process"] = time.perf_counter() - start
+        samples.append(sample)
+    return samples
+
+
+# Sample generated document of roughly `size_kb` kilobytes for the rerun measurement
+def sample_document(size_kb):
+    paragraph = "AI-supported feedback changed how students revised their drafts (Hattie & Timperley, 2007). " * 8
+    sections = [f"## Section {i + 1}\n\n{paragraph}" for i in range(max(1, size_kb * 1024 // len(paragraph)))]
+    return "\n\n".join(sections)
+
+
+# Wall and CPU time of `reruns` script reruns in a warm process, alternating
+# plain reruns with a sidebar toggle so widget-triggered reruns are covered
+# too. AppTest polls for the script to finish, so wall times include its
+# polling interval; CPU time is the better measure of the script's own cost.
+# With `document_kb` the session starts with a generated case study of that size.
+def measure_reruns(reruns, document_kb=0):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    if document_kb:
+        at.session_state.final_case_study = sample_document(document_kb)
+        at.session_state.review_questions = "1. What evidence supports the reported impact?\n" * 7
+        at.session_state.generation_complete = True
+    at.run()
+    wall, cpu = [], []
+    for i in range(reruns):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        if i % 2:
+            at.sidebar.checkbox(key="show_timing_panel").check().run()
+        else:
+            at.run()
+        wall.append(time.perf_counter() - start)
+        cpu.append(time.process_time() - cpu_start)
+    if at.exception:
+        raise RuntimeError(f"app.py raised during a rerun: {at.exception[0].value}")
+    return wall, cpu
+
+
+def run_startup(args):
+    print(f"Cold start ({args.runs} fresh processes)")
+    cold = measure_cold_start(args.runs)
+    results = {key: summarize([sample[key] for sample in cold])
+               for key in ("process", "import", "first_run", "cold_start", "client_init")}
+    for key in ("process", "import", "first_run", "cold_start", "client_init"):
+        print_stats(key, results[key])
+
+    print(f"Reruns ({args.reruns} in a warm process, {args.document_kb} KB case study)")
+    wall, cpu = measure_reruns(args.reruns, args.document_kb)
+    results["rerun"] = summarize(wall)
+    results["rerun_cpu"] = summarize(cpu)
+    print_stats("rerun", results["rerun"])
+    print_stats("rerun_cpu", results["rerun_cpu"])
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if args.max_cold is not None and results["cold_start"]["p50"] > args.max_cold:
+        failures.append(f"cold start p50 {results['cold_start']['p50']:.3f}s exceeds {args.max_cold:.3f}s")
+    if args.max_rerun is not None and results["rerun_cpu"]["p50"] > args.max_rerun:
+        failures.append(f"rerun CPU p50 {results['rerun_cpu']['p50']:.3f}s exceeds {args.max_rerun:.3f}s")
+    for failure in failures:
+        print(f"Regression: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+# Run `runs` pipelines, `concurrency` at a time, against `server`. Returns the
+# wall time and one {"latency", "time_to_first_token", "draft_time", "error"} dict per run.
+def run_load_level(server, fields_list, concurrency, runs, rate_limits, polish, draft_mode):
+    from openai import OpenAI
+
+    from pipeline import create_http_client, run_pipeline
+    from scheduler import RequestScheduler, ScheduledClient
+
+    client = ScheduledClient(
+        OpenAI(api_key="benchmark", base_url=server.base_url, max_retries=0, http_client=create_http_client()),
+        scheduler=RequestScheduler(rate_limits=rate_limits)
+    )
+
+    def one_run(i):
+        start = time.perf_counter()
+        try:
+            result = run_pipeline(client, fields_list[i % len(fields_list)], polish=polish, draft_mode=draft_mode)
+        except Exception as e:
+            return {"latency": time.perf_counter() - start, "time_to_first_token": None, "draft_time": None, "error": str(e)}
+        return {
+            "latency": time.perf_counter() - start,
+            "time_to_first_token": result["timings"]["draft"]["time_to_first_token"],
+            "draft_time": result["timings"]["draft"]["total_time"],
+            "error": None,
+        }
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(one_run, range(runs)))
+    return time.perf_counter() - start, samples
+
+
+def run_load(args):
+    from fake_openai import FakeChatServer, case_study_responder
+    from scheduler import RATE_LIMITS
+
+    fields_list = [normalize_record(record) for record in load_records(args.input)]
+    rate_limits = RATE_LIMITS if args.rate_limits else {}
+    print(
+        f"Load test: profile '{args.profile}', {len(fields_list)} input record(s), "
+        f"{'polish pass' if args.polish else 'local citation assembly'}, "
+        f"{'with' if args.rate_limits else 'without'} local rate limits"
+    )
+    print(
+        f"  {'draft mode':<10} {'concurrency':>11} {'runs':>5} {'errors':>6} {'p50':>8} {'p95':>8} "
+        f"{'ttft p50':>9} {'draft p50':>10} {'runs/min':>9} {'requests':>9} {'429s':>5} {'500s':>5}"
+    )
+
+    results = []
+    for draft_mode in args.draft_mode:
+        for concurrency in args.concurrency:
+            runs = max(args.runs, concurrency)
+            with FakeChatServer.from_profile(args.profile, responder=case_study_responder(), seed=args.seed) as server:
+                # The pipeline logs every run; keep the table readable
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output) if not args.verbose else contextlib.nullcontext():
+                    wall_time, samples = run_load_level(
+                        server, fields_list, concurrency, runs, rate_limits, args.polish, draft_mode
+                    )
+                server_stats = server.stats()
+
+            succeeded = [sample for sample in samples if sample["error"] is None]
+            latencies = [sample["latency"] for sample in succeeded] or [0.0]
+            ttfts = [sample["time_to_first_token"] for sample in succeeded] or [0.0]
+            draft_times = [sample["draft_time"] for sample in succeeded] or [0.0]
+            level = {
+                "draft_mode": draft_mode,
+                "concurrency": concurrency,
+                "runs": runs,
+                "errors": len(samples) - len(succeeded),
+                "wall_time": wall_time,
+                "throughput_per_min": len(succeeded) / wall_time * 60,
+                "latency": summarize(latencies),
+                "time_to_first_token": summarize(ttfts),
+                "draft_time": summarize(draft_times),
+                "server": server_stats,
+            }
+            results.append(level)
+            print(
+                f"  {draft_mode:<10} {concurrency:>11} {runs:>5} {level['errors']:>6} {level['latency']['p50']:>7.2f}s "
+                f"{level['latency']['p95']:>7.2f}s {level['time_to_first_token']['p50']:>8.2f}s "
+                f"{level['draft_time']['p50']:>9.2f}s {level['throughput_per_min']:>9.1f} {server_stats['requests']:>9} "
+                f"{server_stats['rate_limited']:>5} {server_stats['failed']:>5}"
+            )
+            for sample in samples:
+                if sample["error"] is not None:
+                    print(f"    run failed: {sample['error']}", file=sys.stderr)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"profile": args.profile, "polish": args.polish, "levels": results}, f, indent=2)
+    return 1 if any(level["errors"] for level in results) else 0
+
+
+def legacy_in_text(reference):
+    match = LEGACY_IN_TEXT_RE.match(reference)
+    if match:
+        return f"({match.group(1).strip().split(',')[0].strip()}, {match.group(2)})"
+    return "(Author, YYYY)"
+
+
+# Fields of a corpus entry the parser got wrong, as (field, expected, parsed).
+# Entries whose "in_text" is null are not references and must not parse.
+def check_reference(entry):
+    from apa import parse_reference
+
+    reference = parse_reference(entry["reference"])
+    if entry["in_text"] is None:
+        return [("reference", None, reference.in_text())] if reference is not None else []
+    if reference is None:
+        return [("reference", "parsed", None)]
+    parsed = reference.to_dict()
+    return [
+        (key, entry[key], parsed[key])
+        for key in ("in_text", "year", "authors", "title", "doi")
+        if key in entry and (entry[key] is not None or key == "doi") and parsed[key] != entry[key]
+    ]
+
+
+def run_apa(args):
+    from apa import parse_reference
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    mismatches = [(entry, check_reference(entry)) for entry in corpus]
+    failed = [(entry, problems) for entry, problems in mismatches if problems]
+    valid = [entry for entry in corpus if entry["in_text"] is not None]
+    negatives = len(corpus) - len(valid)
+    rejected = negatives - sum(1 for entry, _ in failed if entry["in_text"] is None)
+    correct = len(valid) - (len(failed) - (negatives - rejected))
+    legacy_correct = sum(1 for entry in valid if legacy_in_text(entry["reference"]) == entry["in_text"])
+    print(f"APA parser: {correct}/{len(valid)} corpus references parsed correctly")
+    print(f"  non-references rejected: {rejected}/{negatives}")
+    print(f"  legacy author/year regex: {legacy_correct}/{len(valid)} correct in-text citations")
+    for entry, problems in failed:
+        print(f"  {entry['reference'][:70]}...", file=sys.stderr)
+        for key, expected, parsed in problems:
+            print(f"    {key}: expected {expected!r}, parsed {parsed!r}", file=sys.stderr)
+
+    references = [entry["reference"] for entry in valid]
+    samples = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for i in range(args.count):
+            reference = parse_reference(references[i % len(references)])
+            reference.in_text()
+        samples.append(args.count / (time.perf_counter() - start))
+    rate = percentile(samples, 0.5)
+    print(f"  throughput: {rate:,.0f} references/s (median of {args.repeat} x {args.count})")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "corpus": len(valid),
+                "correct": correct,
+                "negatives": negatives,
+                "rejected": rejected,
+                "legacy_correct": legacy_correct,
+                "references_per_second": rate,
+            }, f, indent=2)
+
+    if args.min_rate is not None and rate < args.min_rate:
+        print(f"Regression: {rate:,.0f} references/s is below {args.min_rate:,.0f}", file=sys.stderr)
+        return 1
+    return 1 if failed else 0
+
+
+def run_index(args):
+    import tempfile
+
+    from citation_index import CitationIndex, build_index
+    from fake_openai import PLACEHOLDER_TOPICS
+
+    topics = PLACEHOLDER_TOPICS
+    if args.topics:
+        with open(args.topics, encoding="utf-8") as f:
+            topics = [line.strip() for line in f if line.strip()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_path = os.path.join(directory, "citations.index")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            build_index(args.corpus, index_path)
+        build_time = time.perf_counter() - start
+
+        load_times = []
+        for _ in range(args.loads):
+            start = time.perf_counter()
+            index = CitationIndex(index_path, threshold=args.threshold)
+            load_times.append(time.perf_counter() - start)
+            index.close()
+
+        index = CitationIndex(index_path, threshold=args.threshold)
+        answered = {topic: index.lookup(topic) for topic in topics}
+        latencies = []
+        for _ in range(args.repeat):
+            for topic in topics:
+                start = time.perf_counter()
+                index.lookup(topic)
+                latencies.append(time.perf_counter() - start)
+        size = os.path.getsize(index_path)
+        sources = len(index)
+        index.close()
+
+    load = summarize(load_times)
+    lookup = summarize(latencies)
+    hits = sum(1 for citation_info in answered.values() if citation_info is not None)
+    print(f"Citation index: {sources} sources, {size / 1024:.1f} KiB, built in {build_time * 1000:.1f}ms")
+    print(f"  load: p50 {load['p50'] * 1000:.2f}ms, max {load['max'] * 1000:.2f}ms ({args.loads} loads)")
+    print(f"  lookup: p50 {lookup['p50'] * 1e6:.0f}us, p95 {lookup['p95'] * 1e6:.0f}us ({len(latencies)} lookups)")
+    print(f"  answered locally: {hits}/{len(topics)} topics at threshold {args.threshold}")
+    for topic, citation_info in answered.items():
+        print(f"    {topic:<45} {citation_info['in_text'] if citation_info else '-> web search'}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "sources": sources,
+                "index_bytes": size,
+                "build_time": build_time,
+                "load": load,
+                "lookup": lookup,
+                "answered": hits,
+                "topics": len(topics),
+            }, f, indent=2)
+
+    failed = False
+    if args.max_load is not None and load["p50"] > args.max_load:
+        print(f"Regression: index load {load['p50']:.3f}s exceeds {args.max_load}s", file=sys.stderr)
+        failed = True
+    if args.max_lookup_ms is not None and lookup["p95"] * 1000 > args.max_lookup_ms:
+        print(f"Regression: p95 lookup {lookup['p95'] * 1000:.3f}ms exceeds {args.max_lookup_ms}ms", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+# Markdown case study with `sections` sections of `words` words each, cited
+# from the local citation corpus, as the app would show it
+def build_export_document(sections, words):
+    import random
+
+    from apa import parse_reference
+    from citation_index import CITATION_CORPUS_PATH, format_apa
+    from fake_openai import FILLER_SENTENCES
+    from pipeline import compose_case_study_document
+
+    with open(CITATION_CORPUS_PATH, encoding="utf-8") as f:
+        references = sorted(format_apa(item) for item in json.load(f))
+    rng = random.Random(sections * 1000 + words)
+    parts = []
+    for number in range(1, sections + 1):
+        sentences = []
+        while sum(len(sentence.split()) for sentence in sentences) < words:
+            sentence = rng.choice(FILLER_SENTENCES)
+            if rng.random() < 0.2:
+                sentence = sentence[:-1] + f" {parse_reference(rng.choice(references)).in_text()}."
+            sentences.append(sentence)
+        # Paragraphs of about five sentences
+        paragraphs = [" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5)]
+        parts.append(f"## {number}. Section {number}\n\n" + "\n\n".join(paragraphs))
+    case_study = "\n\n".join(parts) + "\n\n## References\n\n" + "\n\n".join(references)
+    return compose_case_study_document("Benchmark Case Study", "Benchmark Author", case_study, "Generated for benchmarking.")
+
+
+def run_export(args):
+    from export import EXPORT_FORMATS, ExportCache, ExportManager, render_document
+
+    print(f"Export rendering, median of {args.repeat} renders")
+    print(f"  {'sections':>8} {'document':>9} {'format':>6} {'render':>9} {'size':>9} {'cached get':>11}")
+    results = []
+    failed = False
+    for sections in args.sections:
+        document = build_export_document(sections, args.words)
+        exports = ExportManager(cache=ExportCache(":memory:"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            exports.submit(document)
+            exports.wait(document)
+        for export_format in EXPORT_FORMATS:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                data = render_document(document, export_format)
+                timings.append(time.perf_counter() - start)
+            serve_timings = []
+            for _ in range(20):
+                start = time.perf_counter()
+                exports.get(document, export_format)
+                serve_timings.append(time.perf_counter() - start)
+            render_time = percentile(timings, 0.5)
+            serve_time = percentile(serve_timings, 0.5)
+            results.append({
+                "sections": sections,
+                "document_bytes": len(document.encode("utf-8")),
+                "format": export_format,
+                "render_seconds": render_time,
+                "cached_get_seconds": serve_time,
+                "bytes": len(data),
+            })
+            print(
+                f"  {sections:>8} {len(document) / 1024:>7.0f}KB {export_format:>6} {render_time * 1000:>7.1f}ms "
+                f"{len(data) / 1024:>7.0f}KB {serve_time * 1000:>9.2f}ms"
+            )
+            if args.max_seconds is not None and render_time > args.max_seconds:
+                print(f"Regression: {export_format} render of {sections} sections took {render_time:.2f}s", file=sys.stderr)
+                failed = True
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"words_per_section": args.words, "results": results}, f, indent=2)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the case study generator.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    startup = subparsers.add_parser("startup", help="cold start and rerun time of the Streamlit app")
+    startup.add_argument("--runs", type=int, default=5, help="fresh processes for the cold start measurement")
+    startup.add_argument("--reruns", type=int, default=20, help="reruns measured in a warm process")
+    startup.add_argument("--max-cold", type=float, help="fail if the median cold start exceeds this many seconds")
+    startup.add_argument("--document-kb", type=int, default=100,
+                         help="size of the generated case study in the session during reruns (0: none)")
+    startup.add_argument("--max-rerun", type=float, help="fail if the median rerun CPU time exceeds this many seconds")
+    startup.add_argument("--json", help="also write the results to this JSON file")
+    startup.set_defaults(run=run_startup)
+
+    from fake_openai import SERVER_PROFILES
+    from sections import DRAFT_MODE, DRAFT_MODES
+
+    load = subparsers.add_parser("load", help="pipeline latency and throughput against a fake API server")
+    load.add_argument("--profile", choices=list(SERVER_PROFILES), default="realistic", help="fake server behaviour")
+    load.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8], help="concurrent runs to measure")
+    load.add_argument("--runs", type=int, default=8, help="runs per concurrency level (at least the concurrency)")
+    load.add_argument("--input", nargs="+", default=[SAMPLE_DATA_PATH], help="JSON/JSONL input records")
+    load.add_argument("--draft-mode", choices=DRAFT_MODES, nargs="+", default=[DRAFT_MODE],
+                      help="draft modes to measure; several modes are compared side by side")
+    load.add_argument("--polish", action="store_true", help="run the LLM citation polish pass")
+    load.add_argument("--rate-limits", action="store_true", help="apply the per-model rate limits configured in RATE_LIMITS")
+    load.add_argument("--seed", type=int, default=0, help="seed for the fake server's latency and errors")
+    load.add_argument("--verbose", action="store_true", help="show the pipeline's own log output")
+    load.add_argument("--json", help="also write the results to this JSON file")
+    load.set_defaults(run=run_load)
+
+    apa = subparsers.add_parser("apa", help="accuracy and throughput of the APA reference parser")
+    apa.add_argument("--corpus", default=APA_CORPUS_PATH, help="JSON list of references with their expected fields")
+    apa.add_argument("--count", type=int, default=20000, help="references parsed per throughput sample")
+    apa.add_argument("--repeat", type=int, default=5, help="throughput samples")
+    apa.add_argument("--min-rate", type=float, help="fail below this many references per second")
+    apa.add_argument("--json", help="also write the results to this JSON file")
+    apa.set_defaults(run=run_apa)
+
+    from citation_index import CITATION_CORPUS_PATH, CITATION_INDEX_THRESHOLD
+
+    index = subparsers.add_parser("index", help="load time and lookup latency of the local citation index")
+    index.add_argument("--corpus", default=CITATION_CORPUS_PATH, help="CSL-JSON corpus to index")
+    index.add_argument("--topics", help="text file with one placeholder topic per line")
+    index.add_argument("--threshold", type=float, default=CITATION_INDEX_THRESHOLD, help="match threshold, 0-1")
+    index.add_argument("--loads", type=int, default=20, help="times the index file is opened")
+    index.add_argument("--repeat", type=int, default=200, help="lookups per topic")
+    index.add_argument("--max-load", type=float, help="fail if the median load exceeds this many seconds")
+    index.add_argument("--max-lookup-ms", type=float, help="fail if the p95 lookup exceeds this many milliseconds")
+    index.add_argument("--json", help="also write the results to this JSON file")
+    index.set_defaults(run=run_index)
+
+    export = subparsers.add_parser("export", help="render time of the DOCX, PDF and HTML exports")
+    export.add_argument("--sections", type=int, nargs="+", default=[8, 40, 200], help="document sizes in sections")
+    export.add_argument("--words", type=int, default=400, help="words per section")
+    export.add_argument("--repeat", type=int, default=3, help="renders per format and size")
+    export.add_argument("--max-seconds", type=float, help="fail if a median render exceeds this many seconds")
+    export.add_argument("--json", help="also write the results to this JSON file")
+    export.set_defaults(run=run_export)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
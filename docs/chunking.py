@@ -0,0 +1,145 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import submit_in_context, track_stage
+from prompts import count_tokens
+
+# Section-aware chunking of long case studies for the stages that read the
+# whole document (the citation polish pass and the guiding questions). The
+# document is split into units (headings and sentences), and the units are
+# packed into chunks of at most CHUNK_TOKENS tokens that break at "## "
+# section headings whenever possible, otherwise between paragraphs, and only
+# as a last resort between sentences. Chunks are processed with bounded
+# concurrency and reassembled in document order, so the size of every prompt,
+# and the number of prompts in flight, stays the same however long the
+# document grows.
+
+# When long documents are chunked:
+#   "auto"   - when the document does not fit the prompt of the stage reading
+#              it (see should_chunk)
+#   "always" - every document, even one that fits into a single chunk
+#   "off"    - never; long documents are digested or fall back instead
+CHUNK_MODE = os.getenv("CHUNK_MODE", "auto")
+
+CHUNK_MODES = ("auto", "always", "off")
+
+# Largest chunk of the document sent in one prompt, in tokens
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "3000"))
+
+# Chunks processed at the same time
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+
+# A "## " heading line, or text up to the end of a paragraph, a heading or a
+# sentence followed by a capitalized one. Units keep their trailing whitespace.
+UNIT_RE = re.compile(
+    r"^##[^\n]*(?:\n\s*|\Z)|.+?(?:\n[ \t]*\n\s*|\n(?=## )|(?<=[.!?])\s+(?=[A-Z])|\Z)",
+    re.MULTILINE | re.DOTALL
+)
+
+
+# Whether `text` should be processed in chunks under `mode`. In "auto" mode
+# that is when it is longer than `max_tokens`, the room the stage's prompt
+# has for the document (see prompts.prompt_room); a document that fits one
+# prompt is never chunked, and without a limit nothing is.
+def should_chunk(text, mode=CHUNK_MODE, max_tokens=None, model=None):
+    if mode not in CHUNK_MODES:
+        raise ValueError(f"Unknown chunk mode '{mode}', expected one of {', '.join(CHUNK_MODES)}")
+    if mode == "off":
+        return False
+    if mode == "always":
+        return True
+    return max_tokens is not None and count_tokens(text, model) > max_tokens
+
+
+# Units of a document, so that "".join(units) is the stripped document.
+# Documents that differ only within sentences, such as a draft and the same
+# draft with its citations filled in, split into the same number of units.
+def split_units(text):
+    return [match.group(0) for match in UNIT_RE.finditer(text.strip()) if match.group(0)]
+
+
+def is_heading(unit):
+    return unit.startswith("## ")
+
+
+# Split the unit indices `indices` into groups, each starting at a unit for
+# which `starts_group` is true
+def group_units(indices, starts_group):
+    groups = []
+    for i in indices:
+        if not groups or starts_group(i):
+            groups.append([])
+        groups[-1].append(i)
+    return groups
+
+
+# Pack units into chunks of at most `max_tokens` tokens. Whole sections are
+# kept together when they fit; a longer section is split between its
+# paragraphs, and a paragraph longer than a chunk between its sentences. A
+# single sentence longer than a chunk becomes a chunk of its own. Returns the
+# chunks as (start, end) unit ranges.
+def plan_chunks(units, max_tokens=CHUNK_TOKENS, model=None):
+    sizes = [count_tokens(unit, model) for unit in units]
+    chunks = []
+    start, size = 0, 0
+
+    def add(group):
+        nonlocal start, size
+        group_size = sum(sizes[i] for i in group)
+        if size and size + group_size > max_tokens:
+            chunks.append((start, group[0]))
+            start, size = group[0], 0
+        size += group_size
+
+    sections = group_units(range(len(units)), lambda i: is_heading(units[i]))
+    for section in sections:
+        if sum(sizes[i] for i in section) <= max_tokens:
+            add(section)
+            continue
+        # A paragraph starts after a unit that ends with a line break; the
+        # heading stays with the text that follows it
+        for paragraph in group_units(section, lambda i: i > section[0] and units[i - 1].endswith("\n") and not is_heading(units[i - 1])):
+            if sum(sizes[i] for i in paragraph) <= max_tokens:
+                add(paragraph)
+                continue
+            for sentence in group_units(paragraph, lambda i: i > paragraph[0] and not is_heading(units[i - 1])):
+                add(sentence)
+    if start < len(units):
+        chunks.append((start, len(units)))
+    return chunks
+
+
+def chunk_text(units, span):
+    return "".join(units[span[0]:span[1]]).strip()
+
+
+# Join processed chunks back into one document, with the whitespace that
+# separated them in the original
+def join_chunks(outputs, units, spans):
+    parts = []
+    for output, (_, end) in zip(outputs, spans):
+        separator = units[end - 1][len(units[end - 1].rstrip()):]
+        parts.append(output.strip() + separator)
+    return "".join(parts).strip()
+
+
+# Headings of the sections a chunk covers, for logging and prompts
+def chunk_headings(text):
+    return [line[3:].strip() for line in text.splitlines() if line.startswith("## ")]
+
+
+# Call `fn(index, chunk)` for every chunk with at most `max_concurrency`
+# calls at a time, each tracked as its own "<stage>: chunk i/n" stage.
+# Results come back in chunk order.
+def map_chunks(fn, chunks, stage, max_concurrency=CHUNK_CONCURRENCY):
+    def process(index):
+        with track_stage(f"{stage}: chunk {index + 1}/{len(chunks)}"):
+            return fn(index, chunks[index])
+
+    if not chunks:
+        return []
+    workers = max(1, min(max_concurrency, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{stage}-chunk") as executor:
+        futures = [submit_in_context(executor, process, i) for i in range(len(chunks))]
+        return [future.result() for future in futures]
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+import time
+
+from citations import normalize_topic
+
+# Where resolved citations are stored between runs
+CITATION_CACHE_PATH = os.getenv(
+    "CITATION_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".citation_cache.sqlite3")
+)
+
+# How long a cached citation stays valid before it is searched for again
+CITATION_CACHE_TTL = float(os.getenv("CITATION_CACHE_TTL_DAYS", "30")) * 24 * 60 * 60
+
+# Maximum number of topics kept; the least recently used are evicted first
+CITATION_CACHE_MAX_ENTRIES = int(os.getenv("CITATION_CACHE_MAX_ENTRIES", "5000"))
+
+
+# On-disk cache mapping a normalized placeholder topic to its APA reference
+# and in-text citation. Safe to share between threads; several processes may
+# use the same file thanks to SQLite's WAL mode.
+class CitationCache:
+    def __init__(self, path=CITATION_CACHE_PATH, ttl=CITATION_CACHE_TTL, max_entries=CITATION_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS citations (
+                topic TEXT PRIMARY KEY,
+                full_reference TEXT NOT NULL,
+                in_text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS citations_last_used ON citations (last_used)")
+
+    # Return {"in_text", "full_reference"} for a topic, or None on a miss.
+    # An entry `validate` rejects is deleted and counts as a miss.
+    def get(self, topic, validate=None):
+        key = normalize_topic(topic)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT full_reference, in_text, created_at FROM citations WHERE topic = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            full_reference, in_text, created_at = row
+            expired = self.ttl is not None and now - created_at > self.ttl
+            if expired or (validate is not None and not validate(full_reference)):
+                self._conn.execute("DELETE FROM citations WHERE topic = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE citations SET last_used = ? WHERE topic = ?", (now, key))
+            self.hits += 1
+        return {"in_text": in_text, "full_reference": full_reference}
+
+    # Store the citation found for a topic, evicting old entries if the cache is full
+    def put(self, topic, full_reference, in_text):
+        key = normalize_topic(topic)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO citations (topic, full_reference, in_text, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, full_reference, in_text, now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM citations").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM citations WHERE topic IN "
+                    "(SELECT topic FROM citations ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM citations")
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM citations").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,318 @@
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+
+from apa import parse_reference
+
+# Local index of vetted education-technology sources. Citation placeholders
+# are matched against it before any web search: a topic is answered from the
+# index when its best BM25 match covers enough of the topic's terms, and only
+# falls through to the search model otherwise.
+#
+# The corpus is a CSL-JSON file (the format Zotero, Mendeley and pandoc
+# export) and is indexed on the title and keywords of every entry, keywords
+# counting double. The index is built into a binary file in the user's cache
+# directory (never the source tree, which may be read-only or shared) the
+# first time it is needed and rebuilt whenever the corpus changes. The
+# postings are read straight from the memory-mapped file, so loading only
+# parses the small header. Check load time and lookup latency with
+# `python docs/benchmark.py index`.
+
+# Answer placeholders from the local index first ("0" to disable)
+CITATION_INDEX = os.getenv("CITATION_INDEX", "1") != "0"
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# CSL-JSON corpus of vetted sources
+CITATION_CORPUS_PATH = os.getenv("CITATION_CORPUS_PATH", os.path.join(_DATA_DIR, "edtech_references.json"))
+
+# Directory for the built index: $XDG_CACHE_HOME, ~/.cache, or the temporary
+# directory when there is no home directory
+_CACHE_DIR = os.path.join(
+    os.getenv("XDG_CACHE_HOME")
+    or (os.path.expanduser("~/.cache") if os.path.isabs(os.path.expanduser("~")) else tempfile.gettempdir()),
+    "case-study-generator"
+)
+
+# Where the built index is kept. Named after the corpus path, so that
+# different corpora do not keep replacing each other's index.
+CITATION_INDEX_PATH = os.getenv("CITATION_INDEX_PATH", os.path.join(
+    _CACHE_DIR,
+    "{}-{}.index".format(
+        os.path.splitext(os.path.basename(CITATION_CORPUS_PATH))[0],
+        hashlib.sha256(os.path.abspath(CITATION_CORPUS_PATH).encode("utf-8")).hexdigest()[:12]
+    )
+))
+
+# Share of a topic's term weight the best match must cover to be used, 0-1
+CITATION_INDEX_THRESHOLD = float(os.getenv("CITATION_INDEX_THRESHOLD", "0.6"))
+
+# Bumped whenever the file layout or the tokenizer changes
+INDEX_VERSION = 1
+INDEX_MAGIC = b"CIDX"
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Term frequency weight of keywords relative to the title
+KEYWORD_WEIGHT = 2
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+    a an and are as at be by for from how in into is it its of on or over the their this to use using
+    via what when where which who why with within without
+""".split())
+
+
+# Crude stemmer, so that "tutoring systems" matches "tutoring system" and
+# "personalised" matches "personalized"
+def stem(word):
+    word = re.sub(r"is(e|ed|es|ing|ation|ations)$", r"iz\1", word)
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if re.search(r"(?:s|x|z|ch|sh)es$", word):
+        return word[:-2]
+    for suffix in ("ing", "ed", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith("ss"):
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in TOKEN_RE.findall((text or "").lower()) if word not in STOPWORDS]
+
+
+# "Family, G. I." for a CSL name; literal names (group authors) as they are
+def format_name(name):
+    if "literal" in name:
+        return name["literal"]
+    initials = " ".join(
+        "-".join(part[0] + "." for part in given.split("-") if part)
+        for given in name.get("given", "").replace(".", " ").split()
+    )
+    return f"{name['family']}, {initials}" if initials else name["family"]
+
+
+# APA author list: "A", "A, & B", up to 20 names, then the first 19, an
+# ellipsis and the last
+def format_authors(names):
+    names = [format_name(name) for name in names]
+    if len(names) == 1:
+        return names[0]
+    if len(names) > 20:
+        return ", ".join(names[:19]) + ", . . . " + names[-1]
+    return ", ".join(names[:-1]) + ", & " + names[-1]
+
+
+# APA 7th edition reference entry for a CSL-JSON item
+def format_apa(item):
+    editors = "author" not in item and "editor" in item
+    names = item.get("author") or item.get("editor") or []
+    author = format_authors(names) if names else ""
+    if editors:
+        author += " (Eds.)" if len(names) > 1 else " (Ed.)"
+    year = (item.get("issued", {}).get("date-parts") or [[None]])[0][0]
+    title = item["title"].rstrip(".")
+    # Titles ending in a question or exclamation mark take no period
+    title += "" if title.endswith(("?", "!")) else "."
+    parts = [f"{author.rstrip('.')}." if author else "", f"({year or 'n.d.'}).", title]
+
+    container = item.get("container-title")
+    publisher = item.get("publisher")
+    if item.get("type") == "article-journal" and container:
+        source = container
+        if item.get("volume"):
+            source += f", {item['volume']}"
+            if item.get("issue"):
+                source += f"({item['issue']})"
+        if item.get("page"):
+            source += f", {item['page']}"
+        parts.append(source + ".")
+    elif container:
+        pages = f" (pp. {item['page']})" if item.get("page") else ""
+        parts.append(f"In {container}{pages}.")
+        if publisher:
+            parts.append(publisher + ".")
+    elif publisher and publisher != author:
+        # A group author that published its own work is not repeated
+        parts.append(publisher + ".")
+    if item.get("DOI"):
+        parts.append(f"https://doi.org/{item['DOI']}")
+    return " ".join(part for part in parts if part)
+
+
+# Terms of a corpus entry with their weighted frequencies
+def item_terms(item):
+    counts = {}
+    for term in tokenize(item.get("title")):
+        counts[term] = counts.get(term, 0) + 1
+    for term in tokenize(item.get("keyword")):
+        counts[term] = counts.get(term, 0) + KEYWORD_WEIGHT
+    return counts
+
+
+# Size and modification time of the corpus, stored in the index to detect changes
+def corpus_signature(corpus_path):
+    stat = os.stat(corpus_path)
+    return [INDEX_VERSION, stat.st_size, stat.st_mtime_ns]
+
+
+# Build the index file for `corpus_path`. The file holds a magic number, the
+# length of a JSON header and the header itself, followed by the postings: a
+# run of (document, weighted term frequency) uint32 pairs per term. The header
+# maps each term to the start and length of its run and lists the documents
+# with their reference entry, in-text citation and length.
+def build_index(corpus_path=CITATION_CORPUS_PATH, index_path=CITATION_INDEX_PATH):
+    with open(corpus_path, encoding="utf-8") as f:
+        items = json.load(f)
+
+    postings = {}
+    documents = []
+    for doc_id, item in enumerate(items):
+        reference = format_apa(item)
+        terms = item_terms(item)
+        for term, frequency in terms.items():
+            postings.setdefault(term, []).append((doc_id, frequency))
+        documents.append({
+            "id": item["id"],
+            "full_reference": reference,
+            "in_text": parse_reference(reference).in_text(),
+            "length": sum(terms.values()),
+        })
+
+    terms = {}
+    body = bytearray()
+    for term in sorted(postings):
+        entries = postings[term]
+        terms[term] = [len(body) // 4, len(entries)]
+        for doc_id, frequency in entries:
+            body += struct.pack("<II", doc_id, frequency)
+
+    header = json.dumps({
+        "signature": corpus_signature(corpus_path),
+        "documents": documents,
+        "terms": terms,
+    }).encode("utf-8")
+    # Pad the header so the postings start on a 4-byte boundary
+    header += b" " * (-(len(header) + 8) % 4)
+
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    temporary_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(INDEX_MAGIC + struct.pack("<I", len(header)) + header + body)
+    os.replace(temporary_path, index_path)
+    print(f"Built citation index of {len(documents)} sources and {len(terms)} terms at {index_path}")
+
+
+# BM25 index over a memory-mapped index file
+class CitationIndex:
+    def __init__(self, index_path=CITATION_INDEX_PATH, threshold=CITATION_INDEX_THRESHOLD):
+        self.path = index_path
+        self.threshold = threshold
+        with open(index_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:4] != INDEX_MAGIC:
+            raise ValueError(f"{index_path} is not a citation index")
+        header_length = struct.unpack_from("<I", self._mmap, 4)[0]
+        header = json.loads(self._mmap[8:8 + header_length])
+        self.signature = header["signature"]
+        self.documents = header["documents"]
+        self.terms = header["terms"]
+        self.postings = memoryview(self._mmap)[8 + header_length:].cast("I")
+
+        count = max(1, len(self.documents))
+        self.average_length = sum(doc["length"] for doc in self.documents) / count or 1
+        # Weight of a term that no document contains, for the coverage of unknown terms
+        self.unknown_idf = math.log(1 + (count + 0.5) / 0.5)
+        self.idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, (_, frequency) in self.terms.items()
+        }
+
+    def __len__(self):
+        return len(self.documents)
+
+    # Best matches for `topic`: [(document, bm25 score, coverage)], best first.
+    # Coverage is the share of the topic's idf weight the document contains.
+    def search(self, topic, limit=5):
+        query = set(tokenize(topic))
+        if not query:
+            return []
+        total_idf = sum(self.idf.get(term, self.unknown_idf) for term in query)
+
+        scores = {}
+        covered = {}
+        for term in query:
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            start, frequency = entry
+            idf = self.idf[term]
+            for i in range(start, start + 2 * frequency, 2):
+                doc_id, tf = self.postings[i], self.postings[i + 1]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.documents[doc_id]["length"] / self.average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                covered[doc_id] = covered.get(doc_id, 0.0) + idf
+
+        ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))[:limit]
+        return [(self.documents[doc_id], scores[doc_id], covered[doc_id] / total_idf) for doc_id in ranked]
+
+    # {"in_text", "full_reference"} of the best match for `topic`, or None if
+    # it covers less of the topic than the threshold
+    def lookup(self, topic):
+        matches = self.search(topic, limit=1)
+        if not matches:
+            return None
+        document, _, coverage = matches[0]
+        if coverage < self.threshold:
+            return None
+        return {"in_text": document["in_text"], "full_reference": document["full_reference"]}
+
+    def close(self):
+        self.postings.release()
+        self._mmap.close()
+
+
+# Open the index at `index_path`, building it first when it is missing or
+# older than the corpus
+def load_citation_index(corpus_path=CITATION_CORPUS_PATH, index_path=CITATION_INDEX_PATH, threshold=CITATION_INDEX_THRESHOLD):
+    if os.path.exists(index_path):
+        try:
+            index = CitationIndex(index_path, threshold=threshold)
+        except (ValueError, struct.error):
+            # Truncated or written by something else; rebuilt below
+            index = None
+        if index is not None:
+            if index.signature == corpus_signature(corpus_path):
+                return index
+            index.close()
+    build_index(corpus_path, index_path)
+    return CitationIndex(index_path, threshold=threshold)
+
+
+_citation_index = None
+_citation_index_lock = threading.Lock()
+
+
+# Process-wide index, loaded on first use. None when the index is disabled
+# or cannot be loaded, in which case every placeholder is searched for.
+def get_citation_index():
+    global _citation_index
+    if not CITATION_INDEX:
+        return None
+    with _citation_index_lock:
+        if _citation_index is None:
+            try:
+                _citation_index = load_citation_index()
+            except Exception as e:
+                print(f"Citation index unavailable, using web search only: {str(e)}")
+                _citation_index = False
+        return _citation_index or None
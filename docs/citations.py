@@ -0,0 +1,378 @@
+import os
+import re
+import string
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from apa import parse_reference
+from citation_index import get_citation_index
+from metrics import note_cache_hit, note_route, submit_in_context, track_stage
+from prompts import build_prompt
+
+# Model used to search the web for academic sources
+CITATION_MODEL = "gpt-4o-search-preview"
+
+# Maximum number of citation searches running at the same time
+CITATION_CONCURRENCY = int(os.getenv("CITATION_CONCURRENCY", "5"))
+
+# Seconds a single citation search may take before it is abandoned
+CITATION_TIMEOUT = float(os.getenv("CITATION_TIMEOUT", "60"))
+
+# Start citation searches while the draft is still streaming ("0" to disable)
+PREFETCH_CITATIONS = os.getenv("PREFETCH_CITATIONS", "1") != "0"
+
+# Run the LLM rewrite of the whole case study after citations have been
+# inserted locally ("1" to enable). Off by default: local assembly already
+# produces the in-text citations and References section.
+CITATION_POLISH = os.getenv("CITATION_POLISH", "0") == "1"
+
+# Citation placeholders written by the draft model, e.g. (placeholder: AI bias in education)
+PLACEHOLDER_RE = re.compile(r'\(placeholder:?\s*([^)]+)\)')
+PLACEHOLDER_OPENING = "(placeholder"
+
+
+# Normalize a placeholder topic so trivially different spellings share a
+# cache entry, e.g. "AI bias in Education." and "ai  bias in education"
+def normalize_topic(topic):
+    return " ".join(re.sub(r"[^\w\s-]", " ", topic.lower()).split())
+
+
+# Result of scanning a document for citation placeholders. `topics` maps each
+# normalized topic to the first spelling seen, in document order.
+class PlaceholderScan:
+    def __init__(self):
+        self.topics = {}
+        self.total = 0
+
+    @property
+    def unique(self):
+        return len(self.topics)
+
+    def stats(self):
+        return {"total": self.total, "unique": self.unique}
+
+
+# Collect every placeholder in a single pass, keeping one entry per normalized topic
+def extract_placeholders(text):
+    scan = PlaceholderScan()
+    for match in PLACEHOLDER_RE.finditer(text):
+        topic = match.group(1).strip()
+        scan.total += 1
+        scan.topics.setdefault(normalize_topic(topic), topic)
+    return scan
+
+
+# Rewrite all placeholders in one substitution pass. `citations` maps a
+# normalized topic to {"in_text", "full_reference"}; unresolved placeholders
+# are left untouched.
+def replace_placeholders(text, citations):
+    def substitute(match):
+        citation_info = citations.get(normalize_topic(match.group(1)))
+        if citation_info is None:
+            return match.group(0)
+        return citation_info["in_text"]
+
+    return PLACEHOLDER_RE.sub(substitute, text)
+
+
+# Remove the placeholders left in `text`, with the space before them, so no
+# "(placeholder: ...)" reaches the reader when a source could not be found
+def remove_placeholders(text):
+    return re.sub(r"[ \t]*" + PLACEHOLDER_RE.pattern, "", text)
+
+
+SEARCH_TEMPLATE = """
+    Find a real academic source (journal article or book) that would be appropriate for a citation about: '{placeholder_text}'
+    in the context of AI in education or educational technology implementation.
+
+    Return ONLY a properly formatted APA 7th edition reference entry.
+    Do not include any explanation or additional text.
+    """
+
+
+# Build the prompt asking the search model for one APA reference
+def build_search_prompt(placeholder_text):
+    return build_prompt("search", SEARCH_TEMPLATE, model=CITATION_MODEL, placeholder_text=placeholder_text)
+
+
+# Derive an (Author, Year) in-text citation from an APA reference entry,
+# with "&", "et al.", group authors and "n.d." as APA requires
+def in_text_from_reference(citation):
+    reference = parse_reference(citation)
+    if reference is not None:
+        return reference.in_text()
+    # Fallback if we can't parse the author/year
+    return "(Author, YYYY)"
+
+
+# Give references that share an in-text citation, such as two different
+# (Smith, 2020) works, year suffixes in both the in-text citation and the
+# reference entry: (Smith, 2020a), (Smith, 2020b). Suffixes follow the
+# alphabetical order of the reference titles as APA requires.
+def disambiguate_citations(resolved):
+    groups = {}
+    for citation_info in resolved.values():
+        groups.setdefault(citation_info["in_text"], set()).add(citation_info["full_reference"])
+
+    renamed = {}
+    for in_text, group in groups.items():
+        in_text_match = re.match(r'^\((.+), (\d{4}|n\.d\.)\)$', in_text)
+        if len(group) < 2 or not in_text_match:
+            continue
+        author, year = in_text_match.groups()
+        ordered = sorted(group, key=lambda reference: reference_sort_key(reference.split(").", 1)[-1]))
+        for index, reference in enumerate(ordered):
+            suffix = string.ascii_lowercase[index % 26] * (index // 26 + 1)
+            # Undated works get n.d.-a, n.d.-b
+            suffixed = f"{year}-{suffix}" if year == "n.d." else f"{year}{suffix}"
+            renamed[reference] = {
+                "in_text": f"({author}, {suffixed})",
+                "full_reference": reference.replace(f"({year}", f"({suffixed}", 1)
+            }
+
+    return {key: renamed.get(info["full_reference"], info) for key, info in resolved.items()}
+
+
+# Sort key that ignores case and leading punctuation or markup
+def reference_sort_key(reference):
+    return re.sub(r'^[^\w]+', '', reference).lower()
+
+
+# Alphabetized reference list without duplicates
+def build_reference_list(resolved):
+    return sorted({info["full_reference"] for info in resolved.values()}, key=reference_sort_key)
+
+
+# Append an APA References section to a case study whose in-text citations
+# are already in place
+def append_reference_section(case_study, references):
+    if not references:
+        return case_study
+    reference_section = "\n\n## References\n\n"
+    for ref in references:
+        reference_section += f"{ref}\n\n"
+    return case_study.rstrip() + reference_section
+
+
+# Search for an academic source for a single placeholder topic.
+# Returns the APA reference, or None if the search failed or timed out.
+def find_citation(client, placeholder_text, timeout=CITATION_TIMEOUT):
+    try:
+        completion = client.chat.completions.create(
+            model=CITATION_MODEL,
+            web_search_options={},  # Enable web search
+            messages=[
+                {"role": "user", "content": build_search_prompt(placeholder_text)}
+            ],
+            timeout=timeout
+        )
+        return completion.choices[0].message.content.strip()
+    except Exception as e:
+        # If there's an error, the caller keeps the placeholder
+        print(f"Error finding citation for '{placeholder_text}': {str(e)}")
+        return None
+
+
+# Resolve one placeholder topic to {"in_text", "full_reference"}, answering
+# from the local citation index or `cache` when possible and writing new
+# search results back to the cache. Returns None if no source could be found.
+# `queued_at` is when the lookup was queued, for the run metrics.
+def resolve_citation(client, placeholder_text, cache=None, timeout=CITATION_TIMEOUT, queued_at=None):
+    with track_stage(f"citation: {placeholder_text}", queued_at=queued_at):
+        index = get_citation_index()
+        if index is not None:
+            start = time.perf_counter()
+            citation_info = index.lookup(placeholder_text)
+            if citation_info is not None:
+                note_route("citation-index", None, time.perf_counter() - start)
+                return citation_info
+
+        if cache is not None:
+            # Entries cached by older versions may not be references at all
+            cached = cache.get(placeholder_text, validate=lambda reference: parse_reference(reference) is not None)
+            if cached is not None:
+                note_cache_hit()
+                # ... or carry a less exact in-text citation
+                return {**cached, "in_text": in_text_from_reference(cached["full_reference"])}
+
+        citation = find_citation(client, placeholder_text, timeout=timeout)
+        if citation is None:
+            return None
+
+        # An answer such as "I could not find a specific source." is a failed
+        # lookup, and is neither cached nor cited
+        reference = parse_reference(citation)
+        if reference is None:
+            print(f"Search for '{placeholder_text}' did not return a reference: {citation[:100]}")
+            return None
+
+        citation_info = {
+            "in_text": reference.in_text(),
+            "full_reference": citation
+        }
+        if cache is not None:
+            cache.put(placeholder_text, citation, citation_info["in_text"])
+        return citation_info
+
+
+# Resolve several placeholder topics with at most `max_concurrency` searches
+# in flight. Results come back in the same order as `placeholders`, with None
+# for any lookup that failed.
+def lookup_citations(client, placeholders, max_concurrency=CITATION_CONCURRENCY, timeout=CITATION_TIMEOUT, cache=None):
+    if not placeholders:
+        return []
+
+    workers = max(1, min(max_concurrency, len(placeholders)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="citation") as executor:
+        futures = [
+            submit_in_context(executor, resolve_citation, client, placeholder_text, cache, timeout, time.perf_counter())
+            for placeholder_text in placeholders
+        ]
+        return [future.result() for future in futures]
+
+
+# Incremental placeholder detector for streamed text. Feed it tokens as they
+# arrive; it returns each placeholder as soon as its closing parenthesis is
+# seen, once per normalized topic.
+class PlaceholderDetector:
+    # Longest unterminated "(..." tail kept while waiting for a closing parenthesis
+    MAX_PENDING = 500
+
+    def __init__(self):
+        self.scan = PlaceholderScan()
+        self._pending = ""
+
+    # Add streamed text; returns [(normalized_topic, topic)] for newly seen topics
+    def feed(self, text):
+        self._pending += text
+        new_topics = []
+        scanned_to = 0
+        for match in PLACEHOLDER_RE.finditer(self._pending):
+            scanned_to = match.end()
+            topic = match.group(1).strip()
+            key = normalize_topic(topic)
+            self.scan.total += 1
+            if key not in self.scan.topics:
+                self.scan.topics[key] = topic
+                new_topics.append((key, topic))
+
+        # Keep the tail from the earliest placeholder that is still open (its
+        # topic may hold a nested "(", as in "(placeholder: effect of AI (LLM)
+        # tutors)"), or else from a trailing "(" that may still become one
+        start = self._pending.find(PLACEHOLDER_OPENING, scanned_to)
+        while start != -1 and ")" in self._pending[start:]:
+            start = self._pending.find(PLACEHOLDER_OPENING, start + 1)
+        if start == -1:
+            start = self._pending.rfind("(", scanned_to)
+            if start != -1 and not PLACEHOLDER_OPENING.startswith(self._pending[start:]):
+                start = -1
+        if start == -1 or len(self._pending) - start > self.MAX_PENDING:
+            self._pending = ""
+        else:
+            self._pending = self._pending[start:]
+        return new_topics
+
+
+# Starts citation searches while the draft is still streaming. Pass `feed` as
+# (part of) the stream's on_token callback, then call `results()` once the
+# stream is done to collect everything found so far.
+class CitationPrefetcher:
+    # Topics in `known` (normalized topic keys) are already resolved and never searched
+    def __init__(self, client, cache=None, max_concurrency=CITATION_CONCURRENCY, timeout=CITATION_TIMEOUT, known=None):
+        self.client = client
+        self.cache = cache
+        self.timeout = timeout
+        self.known = set(known or ())
+        self.detector = PlaceholderDetector()
+        self._futures = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="citation")
+
+    def feed(self, token):
+        for key, topic in self.detector.feed(token):
+            if key in self.known:
+                continue
+            self._futures[key] = submit_in_context(
+                self._executor, resolve_citation, self.client, topic, self.cache, self.timeout, time.perf_counter()
+            )
+
+    # Wait for every dispatched search; returns {normalized_topic: citation_info}
+    def results(self):
+        resolved = {}
+        for key, future in self._futures.items():
+            citation_info = future.result()
+            if citation_info is not None:
+                resolved[key] = citation_info
+        self._executor.shutdown()
+        return resolved
+
+    # Abandon searches that have not started yet, e.g. when the stream failed
+    def cancel(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.cancel()
+        return False
+
+
+# Resolve every topic of `scan` that is not in `resolved` yet and return the
+# merged {normalized_topic: citation_info}. Failed lookups are left out.
+def resolve_placeholders(client, scan, resolved=None, max_concurrency=CITATION_CONCURRENCY, timeout=CITATION_TIMEOUT, cache=None):
+    # Search for topics not resolved yet concurrently, results stay in topic order
+    resolved = dict(resolved or {})
+    missing = [key for key in scan.topics if key not in resolved]
+    citations = lookup_citations(
+        client, [scan.topics[key] for key in missing],
+        max_concurrency=max_concurrency, timeout=timeout, cache=cache
+    )
+    for key, citation_info in zip(missing, citations):
+        if citation_info is not None:
+            resolved[key] = citation_info
+    return resolved
+
+
+# Replace the placeholders of `case_study` with the in-text citations of
+# `resolved`; placeholders without one are removed. Returns the text and the
+# alphabetized, disambiguated reference list of the topics that appear in it.
+def apply_citations(case_study, scan, resolved):
+    resolved = {key: resolved[key] for key in scan.topics if key in resolved}
+
+    # Give same-author, same-year references distinct year suffixes
+    resolved = disambiguate_citations(resolved)
+
+    # Log the mapping for debugging (will not be displayed to user)
+    for key, topic in scan.topics.items():
+        if key in resolved:
+            print(f"Mapped '(placeholder: {topic})' to {resolved[key]['in_text']}")
+
+    unresolved = [topic for key, topic in scan.topics.items() if key not in resolved]
+    if unresolved:
+        print(f"No source found for {len(unresolved)} placeholder topics, removing them: {'; '.join(unresolved)}")
+
+    # Replace placeholders in the case study and return it with the alphabetized references
+    return remove_placeholders(replace_placeholders(case_study, resolved)), build_reference_list(resolved)
+
+
+# Function to find and replace citation placeholders with real academic sources.
+# Each unique topic is resolved once. When a `cache` is given, known topics are
+# answered from it and only the remaining ones are searched for; new results
+# are written back. `resolved` can carry citations already found while the
+# draft was streaming, so only topics missing from it are searched.
+# Returns the case study with in-text citations and the alphabetized,
+# disambiguated reference list.
+def enhance_citations(client, case_study, max_concurrency=CITATION_CONCURRENCY, timeout=CITATION_TIMEOUT, cache=None, resolved=None):
+    # Extract the unique citation placeholders from the case study
+    scan = extract_placeholders(case_study)
+
+    if not scan.total:
+        return case_study, []  # No placeholders found
+
+    print(f"Found {scan.total} citation placeholders ({scan.unique} unique topics)")
+
+    resolved = resolve_placeholders(
+        client, scan, resolved, max_concurrency=max_concurrency, timeout=timeout, cache=cache
+    )
+    return apply_citations(case_study, scan, resolved)
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+# Which backend caches chat completions: "memory", "disk" or "off"
+COMPLETION_CACHE_BACKEND = os.getenv("COMPLETION_CACHE_BACKEND", "disk")
+
+COMPLETION_CACHE_PATH = os.getenv(
+    "COMPLETION_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".completion_cache.sqlite3")
+)
+
+# Maximum number of cached completions; the least recently used are evicted first
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "1000"))
+
+# Request options that do not change what the model returns
+NON_CONTENT_OPTIONS = ("stream", "stream_options", "timeout", "extra_headers")
+
+# Requests with these options are never cached here. Web search answers are
+# checked and cached by topic in the citation cache, so an answer that turns
+# out not to be a reference is not replayed from this cache.
+UNCACHED_OPTIONS = ("web_search_options",)
+
+
+# Content address of a request: a hash of the model, messages and every other
+# parameter that can influence the response
+def completion_cache_key(request):
+    keyed = {k: v for k, v in request.items() if k not in NON_CONTENT_OPTIONS}
+    canonical = json.dumps(keyed, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# In-process LRU backend
+class MemoryBackend:
+    def __init__(self, max_entries=COMPLETION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# SQLite backend shared by every process using the same file
+class DiskBackend:
+    def __init__(self, path=COMPLETION_CACHE_PATH, max_entries=COMPLETION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM completions WHERE key IN "
+                    "(SELECT key FROM completions ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+
+# Completion cache with hit/miss counters over a pluggable backend
+class CompletionCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, request):
+        value = self.backend.get(completion_cache_key(request))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, request, content, usage=None):
+        self.backend.put(completion_cache_key(request), {"content": content, "usage": usage})
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.backend)}
+
+
+# Build the completion cache configured by COMPLETION_CACHE_BACKEND, or None if it is off
+def create_completion_cache(backend=COMPLETION_CACHE_BACKEND):
+    if backend == "memory":
+        return CompletionCache(MemoryBackend())
+    if backend == "disk":
+        return CompletionCache(DiskBackend())
+    if backend == "off":
+        return None
+    raise ValueError(f"Unknown completion cache backend '{backend}', expected memory, disk or off")
+
+
+def usage_to_dict(usage):
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+    }
+
+
+# Wraps an OpenAI client so that `chat.completions.create` answers repeated
+# requests from `cache`. With `bypass=True` every request goes to the API and
+# its fresh response replaces the cached one (forced regeneration).
+# Streamed requests are replayed as a single chunk on a hit and stored once
+# the stream has been read to the end on a miss.
+class CachedClient:
+    def __init__(self, client, cache, bypass=False):
+        self.client = client
+        self.cache = cache
+        self.bypass = bypass
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    # The same wrapper around another client, e.g. a routed backend's
+    def rewrap(self, client):
+        return CachedClient(client, self.cache, bypass=self.bypass)
+
+    def create(self, **request):
+        if self.cache is None or any(option in request for option in UNCACHED_OPTIONS):
+            return self.client.chat.completions.create(**request)
+
+        if not self.bypass:
+            cached = self.cache.get(request)
+            if cached is not None:
+                return cached_response(cached, stream=request.get("stream", False))
+
+        response = self.client.chat.completions.create(**request)
+        if request.get("stream"):
+            return self._store_stream(request, response)
+
+        self.cache.put(request, response.choices[0].message.content, usage_to_dict(getattr(response, "usage", None)))
+        return response
+
+    def _store_stream(self, request, stream):
+        parts = []
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        self.cache.put(request, "".join(parts))
+
+
+# One-chunk replay of a cached streamed response
+class CachedStream(list):
+    cached = True
+
+
+# Rebuild a completion (or a one-chunk stream) from a cached entry
+def cached_response(cached, stream=False):
+    if stream:
+        return CachedStream([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=cached["content"]))])])
+    usage = cached.get("usage") or {}
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=cached["content"]))],
+        usage=SimpleNamespace(
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+        ),
+        cached=True,
+    )
@@ -0,0 +1,598 @@
+import hashlib
+import html
+import io
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Export of generated case studies to APA-styled DOCX, PDF and HTML. The
+# markdown document shown in the app is parsed into blocks (title, byline,
+# headings, paragraphs, list items and reference entries) and rendered by one
+# renderer per format, all in plain Python so no converter has to be
+# installed: DOCX is written as WordprocessingML into a zip file and PDF with
+# the standard Times fonts every PDF viewer has. Those fonts only cover the
+# WinAnsi character set: other characters are written without their accents
+# where possible (Ł as L), or as "?", and the PDF export is reported as lossy
+# so the app can point to the Word and HTML exports, which keep them.
+#
+# Rendering runs on a background worker pool, off the Streamlit script run.
+# Rendered files are kept in a render cache keyed by a hash of the document
+# and the format, so the download buttons serve ready files straight from it
+# and the same document is never rendered twice. Benchmark large documents
+# with `python docs/benchmark.py export`.
+
+# Export formats by name: (file extension, MIME type, label)
+EXPORT_FORMATS = {
+    "docx": ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "Word"),
+    "pdf": ("pdf", "application/pdf", "PDF"),
+    "html": ("html", "text/html", "HTML"),
+}
+
+# Renders running at once across all sessions
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+
+# Where rendered files are kept (":memory:" to keep them in the process only)
+EXPORT_CACHE_PATH = os.getenv(
+    "EXPORT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".export_cache.sqlite3")
+)
+
+# Maximum number of rendered files kept; the least recently used are evicted first
+EXPORT_CACHE_MAX_ENTRIES = int(os.getenv("EXPORT_CACHE_MAX_ENTRIES", "200"))
+
+# Bumped whenever a renderer changes, so cached files are rendered again
+EXPORT_VERSION = 2
+
+# Bold and italic markdown emphasis
+INLINE_RE = re.compile(r"\*\*(.+?)\*\*|\*(.+?)\*")
+
+LIST_ITEM_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+
+URL_RE = re.compile(r"https?://[^\s<>\"]+[^\s<>\".,;)]")
+
+
+# One block of a document. `runs` is a list of (text, bold, italic).
+#   title, byline, heading, subheading - centered (sub)headings
+#   paragraph                          - body text with a first-line indent
+#   item                               - list item
+#   reference                          - reference entry with a hanging indent
+class Block:
+    def __init__(self, kind, runs):
+        self.kind = kind
+        self.runs = runs
+
+    @property
+    def text(self):
+        return "".join(text for text, _, _ in self.runs)
+
+
+# Split markdown emphasis into (text, bold, italic) runs
+def parse_inline(text):
+    runs = []
+    position = 0
+    for match in INLINE_RE.finditer(text):
+        if match.start() > position:
+            runs.append((text[position:match.start()], False, False))
+        if match.group(1) is not None:
+            runs.append((match.group(1), True, False))
+        else:
+            runs.append((match.group(2), False, True))
+        position = match.end()
+    if position < len(text):
+        runs.append((text[position:], False, False))
+    return runs
+
+
+# Blocks of a case study document as composed by
+# pipeline.compose_case_study_document: "# " title, "**Author:**" byline,
+# "## " headings, paragraphs, lists and the References section
+def parse_document(document):
+    blocks = []
+    in_references = False
+    for paragraph in re.split(r"\n[ \t]*\n", document.strip()):
+        lines = [line.strip() for line in paragraph.strip().splitlines() if line.strip()]
+        while lines:
+            line = lines[0]
+            if line.startswith("#"):
+                level = len(line) - len(line.lstrip("#"))
+                text = line.lstrip("#").strip()
+                kind = "title" if level == 1 else "heading" if level == 2 else "subheading"
+                blocks.append(Block(kind, parse_inline(text)))
+                in_references = kind == "heading" and text.lower().rstrip(":") == "references"
+                lines = lines[1:]
+            elif line.startswith("**Author:**"):
+                blocks.append(Block("byline", parse_inline(line[len("**Author:**"):].strip())))
+                lines = lines[1:]
+            elif re.fullmatch(r"\*\*[^*]+\*\*:?", line):
+                # A bold line of its own, such as "**Acknowledgements**", is a heading
+                blocks.append(Block("heading", parse_inline(line.strip("*:"))))
+                in_references = False
+                lines = lines[1:]
+            elif LIST_ITEM_RE.match(line) and not in_references:
+                for item in lines:
+                    blocks.append(Block("item", parse_inline(LIST_ITEM_RE.sub("", item))))
+                lines = []
+            else:
+                kind = "reference" if in_references else "paragraph"
+                blocks.append(Block(kind, parse_inline(" ".join(lines))))
+                lines = []
+    return blocks
+
+
+def document_title(blocks):
+    return next((block.text for block in blocks if block.kind == "title"), "Case Study")
+
+
+# Stylesheet of the HTML export, following the APA page layout
+HTML_STYLE = """
+    body { font-family: "Times New Roman", Times, serif; font-size: 12pt; line-height: 2; max-width: 6.5in; margin: 1in auto; }
+    h1, h2 { font-size: 12pt; font-weight: bold; text-align: center; margin: 0; }
+    h3 { font-size: 12pt; font-weight: bold; margin: 0; }
+    p { margin: 0; text-indent: 0.5in; }
+    p.byline { text-align: center; text-indent: 0; }
+    p.reference { padding-left: 0.5in; text-indent: -0.5in; }
+    a { color: inherit; }
+    """
+
+HTML_TAGS = {"title": "h1", "heading": "h2", "subheading": "h3"}
+
+
+def html_runs(runs):
+    parts = []
+    for text, bold, italic in runs:
+        text = URL_RE.sub(lambda match: f'<a href="{match.group(0)}">{match.group(0)}</a>', html.escape(text, quote=False))
+        if bold:
+            text = f"<strong>{text}</strong>"
+        if italic:
+            text = f"<em>{text}</em>"
+        parts.append(text)
+    return "".join(parts)
+
+
+def render_html(blocks):
+    body = []
+    in_list = False
+    for block in blocks:
+        if in_list and block.kind != "item":
+            body.append("</ul>")
+            in_list = False
+        content = html_runs(block.runs)
+        if block.kind in HTML_TAGS:
+            body.append(f"<{HTML_TAGS[block.kind]}>{content}</{HTML_TAGS[block.kind]}>")
+        elif block.kind == "item":
+            if not in_list:
+                body.append("<ul>")
+                in_list = True
+            body.append(f"<li>{content}</li>")
+        elif block.kind in ("byline", "reference"):
+            body.append(f'<p class="{block.kind}">{content}</p>')
+        else:
+            body.append(f"<p>{content}</p>")
+    if in_list:
+        body.append("</ul>")
+    return (
+        "<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"utf-8\">\n"
+        f"<title>{html.escape(document_title(blocks))}</title>\n<style>{HTML_STYLE}</style>\n</head>\n"
+        "<body>\n" + "\n".join(body) + "\n</body>\n</html>\n"
+    ).encode("utf-8")
+
+
+# Parts of a minimal DOCX package: content types, relationships, styles and the document
+DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+</Types>"""
+
+DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+DOCX_DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+# APA: Times New Roman 12 pt, double spacing, 0.5 in first-line indent,
+# centered bold headings and hanging indents in the reference list
+DOCX_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+<w:docDefaults>
+<w:rPrDefault><w:rPr><w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman" w:cs="Times New Roman"/><w:sz w:val="24"/><w:szCs w:val="24"/><w:lang w:val="en-US"/></w:rPr></w:rPrDefault>
+<w:pPrDefault><w:pPr><w:spacing w:before="0" w:after="0" w:line="480" w:lineRule="auto"/></w:pPr></w:pPrDefault>
+</w:docDefaults>
+<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:pPr><w:ind w:firstLine="720"/></w:pPr></w:style>
+<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/><w:pPr><w:jc w:val="center"/><w:ind w:firstLine="0"/></w:pPr><w:rPr><w:b/></w:rPr></w:style>
+<w:style w:type="paragraph" w:styleId="Byline"><w:name w:val="Byline"/><w:basedOn w:val="Normal"/><w:pPr><w:jc w:val="center"/><w:ind w:firstLine="0"/></w:pPr></w:style>
+<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/><w:pPr><w:keepNext/><w:jc w:val="center"/><w:ind w:firstLine="0"/><w:outlineLvl w:val="0"/></w:pPr><w:rPr><w:b/></w:rPr></w:style>
+<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/><w:basedOn w:val="Normal"/><w:pPr><w:keepNext/><w:ind w:firstLine="0"/><w:outlineLvl w:val="1"/></w:pPr><w:rPr><w:b/></w:rPr></w:style>
+<w:style w:type="paragraph" w:styleId="ListItem"><w:name w:val="List Item"/><w:basedOn w:val="Normal"/><w:pPr><w:ind w:left="720" w:hanging="360"/></w:pPr></w:style>
+<w:style w:type="paragraph" w:styleId="Reference"><w:name w:val="Reference"/><w:basedOn w:val="Normal"/><w:pPr><w:ind w:left="720" w:hanging="720"/></w:pPr></w:style>
+</w:styles>"""
+
+DOCX_STYLE_IDS = {
+    "title": "Title",
+    "byline": "Byline",
+    "heading": "Heading1",
+    "subheading": "Heading2",
+    "item": "ListItem",
+    "reference": "Reference",
+}
+
+# Characters XML 1.0 does not allow
+XML_INVALID_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def docx_run(text, bold=False, italic=False):
+    properties = ("<w:b/>" if bold else "") + ("<w:i/>" if italic else "")
+    text = html.escape(XML_INVALID_RE.sub("", text), quote=False)
+    return f'<w:r>{f"<w:rPr>{properties}</w:rPr>" if properties else ""}<w:t xml:space="preserve">{text}</w:t></w:r>'
+
+
+def render_docx(blocks):
+    paragraphs = []
+    for block in blocks:
+        style = DOCX_STYLE_IDS.get(block.kind)
+        properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+        runs = [docx_run("•\t")] if block.kind == "item" else []
+        runs += [docx_run(text, bold, italic) for text, bold, italic in block.runs]
+        paragraphs.append(f"<w:p>{properties}{''.join(runs)}</w:p>")
+
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+        + "".join(paragraphs)
+        + '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+        '<w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" w:header="720" w:footer="720" w:gutter="0"/>'
+        "</w:sectPr></w:body></w:document>"
+    )
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        docx.writestr("_rels/.rels", DOCX_RELS)
+        docx.writestr("word/_rels/document.xml.rels", DOCX_DOCUMENT_RELS)
+        docx.writestr("word/styles.xml", DOCX_STYLES)
+        docx.writestr("word/document.xml", document)
+    return output.getvalue()
+
+
+# US Letter with 1 in margins, 12 pt type, double spaced
+PDF_PAGE_WIDTH = 612
+PDF_PAGE_HEIGHT = 792
+PDF_MARGIN = 72
+PDF_FONT_SIZE = 12
+PDF_LEADING = 24
+PDF_INDENT = 36
+
+# Standard fonts by (bold, italic)
+PDF_FONTS = {
+    (False, False): ("F1", "Times-Roman"),
+    (True, False): ("F2", "Times-Bold"),
+    (False, True): ("F3", "Times-Italic"),
+    (True, True): ("F4", "Times-BoldItalic"),
+}
+
+# Advance widths of Times-Roman in 1/1000 em; other characters count as 500
+TIMES_WIDTHS = {
+    **dict.fromkeys(" .,", 250), **dict.fromkeys(":;ijlt/", 278), **dict.fromkeys("fr()-!'[]I", 333),
+    "s": 389, "J": 389, '"': 408, **dict.fromkeys("?acezS", 444), **dict.fromkeys("FP", 556),
+    **dict.fromkeys("ELTZ", 611), **dict.fromkeys("BCR", 667),
+    **dict.fromkeys("wADGHKNOQUVXY", 722), **dict.fromkeys("m&", 778), "%": 833, "M": 889, "W": 944,
+}
+
+# Bold type runs slightly wider
+PDF_BOLD_FACTOR = 1.05
+
+
+def pdf_text_width(text, bold=False):
+    width = sum(TIMES_WIDTHS.get(char, 500) for char in text) * PDF_FONT_SIZE / 1000
+    return width * PDF_BOLD_FACTOR if bold else width
+
+
+# Letters without a decomposition that WinAnsi has a plain form of
+PDF_FALLBACK_CHARACTERS = {
+    "Ł": "L", "ł": "l", "Đ": "D", "đ": "d", "Ħ": "H", "ħ": "h", "ı": "i", "ĸ": "k",
+    "Ŀ": "L", "ŀ": "l", "Ŧ": "T", "ŧ": "t", "‐": "-", "‑": "-", "−": "-",
+}
+
+
+def pdf_encodable(char):
+    try:
+        char.encode("cp1252")
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+# Closest WinAnsi form of a character: without its accents, or "?"
+def pdf_fallback(char):
+    if char in PDF_FALLBACK_CHARACTERS:
+        return PDF_FALLBACK_CHARACTERS[char]
+    plain = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+    return plain if plain and all(pdf_encodable(c) for c in plain) else "?"
+
+
+# Characters of `text` the PDF fonts cannot show, in order of appearance
+def pdf_unsupported_characters(text):
+    if text.isascii():
+        return []
+    return list(dict.fromkeys(char for char in text if not char.isascii() and not pdf_encodable(char)))
+
+
+# Text of a PDF string literal in the fonts' WinAnsi encoding
+def pdf_string(text):
+    for char in pdf_unsupported_characters(text):
+        text = text.replace(char, pdf_fallback(char))
+    encoded = text.encode("cp1252", errors="replace")
+    return encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)").decode("latin-1")
+
+
+# Break a block's runs into lines no wider than `width`, with `first_indent`
+# before the first line and `indent` before the others. Returns lines as
+# (indent, [(text, bold, italic)], line width).
+def wrap_runs(runs, width, first_indent=0, indent=0):
+    words = []
+    for text, bold, italic in runs:
+        for piece in re.findall(r"\s+|\S+", text):
+            if not piece.isspace():
+                words.append((piece, bold, italic))
+            elif words:
+                # Space between runs belongs to the word before it
+                words[-1] = (words[-1][0] + " ", words[-1][1], words[-1][2])
+    lines = []
+    current, current_width = [], 0
+    line_indent = first_indent
+    for word, bold, italic in words:
+        word_width = pdf_text_width(word.rstrip(), bold)
+        if current and current_width + word_width > width - line_indent:
+            lines.append((line_indent, current, current_width))
+            current, current_width, line_indent = [], 0, indent
+        current.append((word, bold, italic))
+        current_width += pdf_text_width(word, bold)
+    if current:
+        lines.append((line_indent, current, current_width))
+    return lines
+
+
+def render_pdf(blocks):
+    text_width = PDF_PAGE_WIDTH - 2 * PDF_MARGIN
+    pages = [[]]
+    y = PDF_PAGE_HEIGHT - PDF_MARGIN
+
+    for block in blocks:
+        runs = block.runs
+        if block.kind in ("title", "heading", "subheading"):
+            runs = [(text, True, italic) for text, _, italic in runs]
+        first_indent, indent = {
+            "paragraph": (PDF_INDENT, 0),
+            "item": (PDF_INDENT / 2, PDF_INDENT),
+            "reference": (0, PDF_INDENT),
+        }.get(block.kind, (0, 0))
+        if block.kind == "item":
+            runs = [("• ", False, False)] + runs
+        lines = wrap_runs(runs, text_width, first_indent, indent)
+        # Keep a heading on the same page as the first line after it
+        needed = PDF_LEADING * (2 if block.kind in ("heading", "subheading") else 1)
+        for line_indent, words, line_width in lines:
+            if y - needed < PDF_MARGIN:
+                pages.append([])
+                y = PDF_PAGE_HEIGHT - PDF_MARGIN
+            needed = PDF_LEADING
+            y -= PDF_LEADING
+            x = PDF_MARGIN + line_indent
+            if block.kind in ("title", "byline", "heading"):
+                x = PDF_MARGIN + (text_width - line_width) / 2
+            pages[-1].append((x, y, words))
+
+    objects = []
+
+    def add_object(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add_object(None)
+    pages_id = add_object(None)
+    fonts = {
+        name: add_object(f"<< /Type /Font /Subtype /Type1 /BaseFont /{base} /Encoding /WinAnsiEncoding >>".encode("ascii"))
+        for name, base in PDF_FONTS.values()
+    }
+    font_resources = " ".join(f"/{name} {object_id} 0 R" for name, object_id in fonts.items())
+
+    page_ids = []
+    for number, lines in enumerate(pages, start=1):
+        # APA page numbers go in the top right corner
+        page_number = str(number)
+        commands = [
+            f"BT /F1 {PDF_FONT_SIZE} Tf "
+            f"{PDF_PAGE_WIDTH - PDF_MARGIN - pdf_text_width(page_number):.2f} {PDF_PAGE_HEIGHT - PDF_MARGIN / 2:.2f} Td "
+            f"({page_number}) Tj ET"
+        ]
+        for x, y, words in lines:
+            commands.append(f"BT {x:.2f} {y:.2f} Td")
+            # One text operation per run of words in the same font
+            font = None
+            for style, run in itertools.groupby(words, key=lambda word: word[1:]):
+                name = PDF_FONTS[style][0]
+                if name != font:
+                    commands.append(f"/{name} {PDF_FONT_SIZE} Tf")
+                    font = name
+                commands.append(f"({pdf_string(''.join(word for word, _, _ in run))}) Tj")
+            commands.append("ET")
+        stream = zlib.compress("\n".join(commands).encode("latin-1"))
+        content = add_object(
+            f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode("ascii") + stream + b"\nendstream"
+        )
+        page_ids.append(add_object(
+            f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {PDF_PAGE_WIDTH} {PDF_PAGE_HEIGHT}] "
+            f"/Resources << /Font << {font_resources} >> >> /Contents {content} 0 R >>".encode("ascii")
+        ))
+
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode("ascii")
+    objects[pages_id - 1] = (
+        f"<< /Type /Pages /Kids [{' '.join(f'{page} 0 R' for page in page_ids)}] /Count {len(page_ids)} >>"
+    ).encode("ascii")
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for object_id, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(f"{object_id} 0 obj\n".encode("ascii") + body + b"\nendobj\n")
+    xref = output.tell()
+    output.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii"))
+    for offset in offsets:
+        output.write(f"{offset:010d} 00000 n \n".encode("ascii"))
+    output.write(f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii"))
+    return output.getvalue()
+
+
+RENDERERS = {"docx": render_docx, "pdf": render_pdf, "html": render_html}
+
+
+# Render a markdown case study document in one of EXPORT_FORMATS
+def render_document(document, export_format):
+    if export_format not in RENDERERS:
+        raise ValueError(f"Unknown export format '{export_format}', expected one of {', '.join(RENDERERS)}")
+    return RENDERERS[export_format](parse_document(document))
+
+
+# Render cache key: a hash of the renderer version, the format and the document
+def export_key(document, export_format):
+    return hashlib.sha256(f"{EXPORT_VERSION}:{export_format}:{document}".encode("utf-8")).hexdigest()
+
+
+# SQLite cache of rendered files by export key, shared by every process using
+# the same file
+class ExportCache:
+    def __init__(self, path=EXPORT_CACHE_PATH, max_entries=EXPORT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS renders (
+                key TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS renders_last_used ON renders (last_used)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM renders WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE renders SET last_used = ? WHERE key = ?", (time.time(), key))
+        return bytes(row[0])
+
+    def put(self, key, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO renders (key, data, last_used) VALUES (?, ?, ?)",
+                (key, sqlite3.Binary(data), time.time())
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM renders").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM renders WHERE key IN (SELECT key FROM renders ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM renders WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM renders").fetchone()[0]
+
+
+# Renders documents on a bounded pool of worker threads into `cache`. The
+# app calls `submit` when a case study is shown and `get` for each download
+# button; a document's formats are rendered once, whichever session asks.
+class ExportManager:
+    def __init__(self, cache=None, max_workers=EXPORT_WORKERS):
+        self.cache = cache if cache is not None else ExportCache()
+        self.rendered = 0
+        self.failed = 0
+        self._pending = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="export")
+
+    # Queue every format of `document` that is neither cached nor rendering
+    def submit(self, document, formats=tuple(EXPORT_FORMATS)):
+        for export_format in formats:
+            key = export_key(document, export_format)
+            with self._lock:
+                if key in self._pending or key in self._errors or key in self.cache:
+                    continue
+                self._pending[key] = self._executor.submit(self._render, key, document, export_format)
+
+    def _render(self, key, document, export_format):
+        start = time.perf_counter()
+        try:
+            data = render_document(document, export_format)
+            self.cache.put(key, data)
+            with self._lock:
+                self.rendered += 1
+            print(f"Rendered {export_format} export ({len(data) / 1024:.0f} KiB) in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            print(f"Error rendering {export_format} export: {str(e)}")
+            with self._lock:
+                self.failed += 1
+                self._errors[key] = str(e)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    # Characters `document` loses in `export_format`, e.g. the letters the PDF
+    # fonts cannot show; empty when the export keeps every character
+    def lost_characters(self, document, export_format):
+        if export_format != "pdf":
+            return []
+        return pdf_unsupported_characters(document)
+
+    # Rendered file, or None while it is still rendering (or failed)
+    def get(self, document, export_format):
+        return self.cache.get(export_key(document, export_format))
+
+    # "ready", "rendering", "failed" or "missing" (never submitted)
+    def status(self, document, export_format):
+        key = export_key(document, export_format)
+        with self._lock:
+            if key in self._pending:
+                return "rendering"
+            if key in self._errors:
+                return "failed"
+        return "ready" if key in self.cache else "missing"
+
+    # Whether any format of `document` is still rendering
+    def pending(self, document, formats=tuple(EXPORT_FORMATS)):
+        return any(self.status(document, export_format) == "rendering" for export_format in formats)
+
+    # Wait until every queued render has finished
+    def wait(self, document, formats=tuple(EXPORT_FORMATS)):
+        for export_format in formats:
+            with self._lock:
+                future = self._pending.get(export_key(document, export_format))
+            if future is not None:
+                future.result()
+
+    def stats(self):
+        with self._lock:
+            return {"rendering": len(self._pending), "rendered": self.rendered, "failed": self.failed, "cached": len(self.cache)}
@@ -0,0 +1,398 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+# Local stand-in for the OpenAI client used to exercise the pipeline offline.
+# Only the `client.chat.completions.create(...)` surface used by the app is
+# implemented. Every call sleeps for `latency` seconds so concurrency and
+# timeouts behave like they would against the real API. Streaming calls
+# then emit one word per chunk, `token_latency` seconds apart.
+
+SURNAMES = ["Holmes", "Selwyn", "Luckin", "Zawacki-Richter", "Kasneci", "Baker", "Williamson", "Popenici"]
+JOURNALS = [
+    "Computers & Education",
+    "British Journal of Educational Technology",
+    "International Journal of Artificial Intelligence in Education",
+    "Educational Technology Research and Development",
+]
+
+
+# Produce a stable, plausible APA reference for a search prompt
+def fake_reference(prompt):
+    digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+    surname = SURNAMES[digest % len(SURNAMES)]
+    journal = JOURNALS[(digest // 7) % len(JOURNALS)]
+    year = 2015 + digest % 10
+    volume = 10 + digest % 40
+    return (
+        f"{surname}, A. B. ({year}). Artificial intelligence in educational practice. "
+        f"{journal}, {volume}(2), 101–120."
+    )
+
+
+# Default reply: references for citation searches, short prose otherwise
+def default_responder(model, messages):
+    prompt = messages[-1]["content"]
+    if "search" in model:
+        return fake_reference(prompt)
+    return "This is a generated response from the fake OpenAI client."
+
+
+# Citation topics and sentences the case study responder builds drafts from
+PLACEHOLDER_TOPICS = [
+    "AI bias in education",
+    "learning analytics",
+    "automated writing feedback",
+    "academic integrity and generative AI",
+    "personalized learning",
+    "teacher professional development for AI",
+    "student data privacy",
+    "universal design for learning",
+    "intelligent tutoring systems",
+    "student engagement with AI tools",
+    "AI literacy",
+    "formative assessment",
+]
+FILLER_SENTENCES = [
+    "The implementation was shaped by the needs of the learners and the constraints of the course.",
+    "Instructors adapted their practice as they observed how students interacted with the tool.",
+    "Early feedback suggested that students valued timely and specific guidance.",
+    "The team documented each decision so that the approach could be reviewed and repeated.",
+    "Institutional policies framed what data could be collected and how it was stored.",
+    "Several unexpected challenges emerged once the tool was used at scale.",
+    "Students reported mixed reactions, ranging from enthusiasm to cautious scepticism.",
+    "These observations informed the next iteration of the course design.",
+]
+
+
+# Deterministic, realistically sized replies for every call the pipeline
+# makes: a draft with one section per heading in the prompt and citation
+# placeholders, references for searches, a rewrite for the citation polish
+# pass and a numbered list of guiding questions. The same prompt always
+# gets the same reply.
+def case_study_responder(words_per_section=180, placeholders_per_section=2):
+    def respond(model, messages):
+        prompt = messages[-1]["content"]
+        if "search" in model:
+            return fake_reference(prompt)
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+        def section_text():
+            sentences = []
+            while sum(len(sentence.split()) for sentence in sentences) < words_per_section:
+                sentences.append(rng.choice(FILLER_SENTENCES))
+            for _ in range(placeholders_per_section):
+                i = rng.randrange(len(sentences))
+                sentences[i] = sentences[i][:-1] + f" (placeholder: {rng.choice(PLACEHOLDER_TOPICS)})."
+            return " ".join(sentences)
+
+        if "Generate a comprehensive case study" in prompt:
+            headings = re.findall(r"^(\d+\. [A-Z][^\n:]*)$", prompt, re.MULTILINE) or ["1. Introduction"]
+            return "\n\n".join(f"## {heading}\n\n" + section_text() for heading in headings)
+
+        if re.match(r"\s*Write section \d+ of \d+", prompt):
+            return section_text()
+
+        if "For each boundary below" in prompt:
+            boundaries = re.findall(r"^\s*Boundary (\d+):", prompt, re.MULTILINE)
+            return "\n".join(f"{n}. {rng.choice(FILLER_SENTENCES)}" for n in boundaries)
+
+        if "Please rewrite this case study" in prompt:
+            case_study = prompt.split("Case Study:", 1)[-1].split("Available References to Integrate:", 1)[0].strip()
+            references = prompt.split("Available References to Integrate:", 1)[-1].split("Important instructions:", 1)[0].strip()
+            surnames = [line.split(",", 1)[0] for line in references.splitlines() if line.strip()] or ["Author"]
+            case_study = re.sub(
+                r"\(placeholder:[^)]*\)",
+                lambda match: f"({rng.choice(surnames)}, {rng.randrange(2015, 2025)})",
+                case_study
+            )
+            return f"{case_study}\n\n## References\n\n{references}"
+
+        if "Please rewrite this part of the case study" in prompt:
+            chunk = prompt.split("Part of the case study:", 1)[-1].split("References for this part:", 1)[0].strip()
+            references = prompt.split("References for this part:", 1)[-1].split("Important instructions:", 1)[0].strip()
+            surnames = [line.split(",", 1)[0] for line in references.splitlines() if line.strip()] or ["Author"]
+            return re.sub(
+                r"\(placeholder:[^)]*\)",
+                lambda match: f"({rng.choice(surnames)}, {rng.randrange(2015, 2025)})",
+                chunk
+            )
+
+        if "thoughtful questions" in prompt:
+            return "\n".join(
+                f"{i}. How could you expand on {rng.choice(PLACEHOLDER_TOPICS)} in this case study?"
+                for i in range(1, 7)
+            )
+        return default_responder(model, messages)
+    return respond
+
+
+# Replay a recorded draft for the drafting model (streamed or not) while
+# citation searches still get generated references
+def replay_responder(draft):
+    def respond(model, messages):
+        if "search" in model:
+            return fake_reference(messages[-1]["content"])
+        return draft
+    return respond
+
+
+class FakeCompletions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model, messages, timeout=None, **kwargs):
+        return self.owner.complete(model, messages, timeout=timeout, **kwargs)
+
+
+class FakeOpenAI:
+    def __init__(self, latency=0.0, responder=default_responder, fail_topics=(), token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.responder = responder
+        self.fail_topics = tuple(fail_topics)
+        self.chat = SimpleNamespace(completions=FakeCompletions(self))
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def complete(self, model, messages, timeout=None, stream=False, **kwargs):
+        with self._lock:
+            self.calls.append({"model": model, "messages": messages, **kwargs})
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            prompt = messages[-1]["content"]
+            if timeout is not None and self.latency > timeout:
+                time.sleep(timeout)
+                raise TimeoutError(f"Request timed out after {timeout}s")
+            time.sleep(self.latency)
+            if any(topic in prompt for topic in self.fail_topics):
+                raise RuntimeError("Simulated API failure")
+            content = self.responder(model, messages)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        prompt_tokens = sum(len(m["content"].split()) for m in messages)
+        completion_tokens = len(content.split())
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+        if stream:
+            include_usage = (kwargs.get("stream_options") or {}).get("include_usage", False)
+            return self._stream(content, usage if include_usage else None)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))],
+            usage=usage,
+        )
+
+    # Yield the response word by word in the shape of streamed completion
+    # chunks, followed by a usage-only chunk when the caller asked for one
+    def _stream(self, content, usage=None):
+        for token in re.findall(r"\S+\s*|\s+", content):
+            time.sleep(self.token_latency)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))], usage=None)
+        if usage is not None:
+            yield SimpleNamespace(choices=[], usage=usage)
+
+
+# Named behaviours of the fake server for benchmarks and load tests.
+# latency: seconds before the first token, varied by +/- latency_jitter (a fraction)
+# token_latency: seconds per generated word (streamed or not)
+# failure_ratio / rate_limit_ratio: share of requests answered with a 500 / a 429
+SERVER_PROFILES = {
+    "instant": {},
+    "fast": {"latency": 0.2, "latency_jitter": 0.2, "token_latency": 0.002},
+    "realistic": {"latency": 0.8, "latency_jitter": 0.5, "token_latency": 0.01},
+    "slow": {"latency": 2.5, "latency_jitter": 0.5, "token_latency": 0.03},
+    "flaky": {
+        "latency": 0.8, "latency_jitter": 0.5, "token_latency": 0.01,
+        "failure_ratio": 0.05, "rate_limit_ratio": 0.05, "retry_after": 0.5,
+    },
+}
+
+
+# Local HTTP server speaking the chat completions API, for pointing a real
+# OpenAI client at (base_url=server.base_url). `rate_limit_ratio` of the
+# requests are answered with 429 and a Retry-After header, as the API does
+# when a rate limit is hit, and `failure_ratio` with a 500. Use
+# FakeChatServer.from_profile() for one of the SERVER_PROFILES.
+class FakeChatServer:
+    def __init__(self, responder=default_responder, latency=0.0, token_latency=0.0,
+                 rate_limit_ratio=0.0, retry_after=1.0, latency_jitter=0.0, failure_ratio=0.0,
+                 host="127.0.0.1", port=0, seed=None):
+        self.responder = responder
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.token_latency = token_latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.failure_ratio = failure_ratio
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @classmethod
+    def from_profile(cls, profile, **kwargs):
+        if profile not in SERVER_PROFILES:
+            raise ValueError(f"Unknown server profile '{profile}', expected one of {', '.join(SERVER_PROFILES)}")
+        return cls(**{**SERVER_PROFILES[profile], **kwargs})
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-chat-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    # Decide how to answer a request: None to serve it, or 429/500 to reject it
+    def _pick_error(self):
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+            if roll < self.rate_limit_ratio:
+                self.rate_limited += 1
+                return 429
+            if roll < self.rate_limit_ratio + self.failure_ratio:
+                self.failed += 1
+                return 500
+        return None
+
+    def _pick_latency(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.latency_jitter, self.latency_jitter)
+        return max(0.0, self.latency * (1 + jitter))
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "rate_limited": self.rate_limited, "failed": self.failed}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+
+                error = server._pick_error()
+                if error == 429:
+                    self._send_json(
+                        429,
+                        {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                        {"Retry-After": f"{server.retry_after:g}"}
+                    )
+                    return
+                if error == 500:
+                    self._send_json(500, {"error": {"message": "Simulated server error", "type": "server_error"}})
+                    return
+
+                time.sleep(server._pick_latency())
+                model = request.get("model", "")
+                messages = request.get("messages", [])
+                content = server.responder(model, messages)
+                prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+                completion_tokens = len(content.split())
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }
+                if request.get("stream"):
+                    include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+                    self._send_stream(model, content, usage if include_usage else None)
+                else:
+                    # Generation time grows with the length of the answer
+                    time.sleep(server.token_latency * completion_tokens)
+                    self._send_json(200, {
+                        "id": f"chatcmpl-{uuid.uuid4().hex}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": usage,
+                    })
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, model, content, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+                def event(payload):
+                    data = f"data: {payload}\n\n".encode("utf-8")
+                    self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                    self.wfile.flush()
+
+                def chunk(choices, chunk_usage=None):
+                    return json.dumps({
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": choices,
+                        "usage": chunk_usage,
+                    })
+
+                for token in re.findall(r"\S+\s*|\s+", content):
+                    time.sleep(server.token_latency)
+                    event(chunk([{"index": 0, "delta": {"content": token}, "finish_reason": None}]))
+                event(chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+                if usage is not None:
+                    event(chunk([], usage))
+                event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, format, *args):
+                pass  # Keep the benchmark output readable
+
+        return Handler
@@ -0,0 +1,216 @@
+# Declarative definition of the case study input form. The schema drives
+# both the Streamlit widgets and the structured prompt sent to the model, so
+# a field is added, relabelled or made required in exactly one place.
+
+
+# One input of the form. `label` is shown on the widget and also prefixes the
+# field's value in the prompt.
+class FormField:
+    def __init__(self, key, label, widget="text_area", placeholder="", help="", height=100, required=False):
+        self.key = key
+        self.label = label
+        self.widget = widget
+        self.placeholder = placeholder
+        self.help = help
+        self.height = height
+        self.required = required
+
+
+# A group of fields. Sections with `in_prompt=False` (title, author,
+# acknowledgements) are shown around the generated text but not sent to the model.
+class FormSection:
+    def __init__(self, title, fields, in_prompt=True):
+        self.title = title
+        self.fields = fields
+        self.in_prompt = in_prompt
+
+
+FORM_SCHEMA = [
+    FormSection(None, [
+        FormField(
+            "case_study_title",
+            "Case Study Title",
+            widget="text_input",
+            placeholder="e.g., Implementing AI in Undergraduate Biology Courses",
+            help="Enter a descriptive title for your case study. This will appear at the top of the case study.",
+            required=True
+        ),
+        FormField(
+            "author_name",
+            "Author's Name",
+            widget="text_input",
+            placeholder="e.g., Jane Doe",
+            help="Enter the full name of the author. This will appear at the top of the case study.",
+            required=True
+        ),
+    ], in_prompt=False),
+    FormSection("1. Introduction and Context of AI Use", [
+        FormField(
+            "course_level",
+            "Course Level",
+            widget="text_input",
+            placeholder="e.g., Undergraduate, Graduate, Professional Development",
+            help="Specify the academic level at which the AI was implemented. This provides context for the educational setting and target audience.",
+            required=True
+        ),
+        FormField(
+            "educational_context",
+            "Educational Context",
+            placeholder="Describe the specific educational context (course, discipline, learner demographics).",
+            help="Include details about the course or program, subject area, discipline, and student demographics. This helps situate your case study in a specific educational framework.",
+            required=True
+        ),
+        FormField(
+            "problem_goal",
+            "Problem, Opportunity, or Goal",
+            placeholder="Define the key problem, opportunity, or goal addressed through AI integration.",
+            help="Clearly articulate what motivated the AI implementation. Was it to solve a particular challenge, improve a process, or enhance learning outcomes? This establishes the purpose of your AI integration.",
+            required=True
+        ),
+    ]),
+    FormSection("2. Description of AI Technology", [
+        FormField(
+            "ai_tools",
+            "AI Tools or Platforms",
+            placeholder="Identify the specific AI tools or platforms used (e.g., specific software, applications, models).",
+            help="Name and describe the specific AI tools, platforms, or technologies used. Be as specific as possible (e.g., 'OpenAI GPT-4' rather than just 'AI'). This helps others understand exactly what tools were employed.",
+            required=True
+        ),
+        FormField(
+            "ai_functionality",
+            "AI Functionality",
+            placeholder="Explain briefly how the technology functions (e.g., machine learning model, generative AI).",
+            help="Provide a concise explanation of how the AI technology works. This doesn't need to be highly technical but should give readers a basic understanding of the technological approach."
+        ),
+        FormField(
+            "ai_justification",
+            "Technology Justification",
+            placeholder="Justify the choice of AI technology in relation to the stated educational objectives.",
+            help="Explain why this specific AI technology was chosen for your educational context. Connect the technology choice directly to your learning objectives or challenges being addressed."
+        ),
+    ]),
+    FormSection("3. Implementation Process", [
+        FormField(
+            "preparation_phase",
+            "Preparation Phase",
+            placeholder="Describe the preparation phase (training faculty, curating datasets, ethical clearance, etc.)",
+            help="Detail the steps taken before actual implementation, such as faculty training, technology setup, data preparation, securing permissions, or pilot testing. This shows the groundwork required for successful implementation."
+        ),
+        FormField(
+            "execution_phase",
+            "Execution Phase",
+            placeholder="Detail the actual deployment in classes, workshops, or support systems.",
+            help="Describe how the AI was actually deployed and used in the educational setting. Include information about the timeline, student interaction, and integration into existing teaching practices."
+        ),
+        FormField(
+            "post_deployment",
+            "Post-deployment Support",
+            placeholder="Explain ongoing technical or pedagogical assistance, monitoring, etc.",
+            help="Outline the support systems put in place after implementation, such as technical support, monitoring for issues, continuous training, or iterative improvements based on feedback."
+        ),
+    ]),
+    FormSection("4. Ethical and Inclusive Considerations", [
+        FormField(
+            "ethical_practices",
+            "Ethical AI Practices",
+            placeholder="Describe specific actions taken to ensure ethical AI practices (e.g., addressing biases, transparency).",
+            help="Explain specific measures taken to ensure ethical use of AI, such as bias detection and mitigation, transparent communication about AI use, data privacy protections, or informed consent processes."
+        ),
+        FormField(
+            "inclusivity",
+            "Inclusivity and Accessibility",
+            placeholder="Detail how inclusivity and accessibility were ensured through AI design or adaptation.",
+            help="Describe how the AI implementation accounted for diverse learning needs, accessibility requirements, and inclusion of all students regardless of background or ability."
+        ),
+        FormField(
+            "edi_principles",
+            "EDI Principles",
+            placeholder="Explain how Equity, Diversity, and Inclusion principles informed decisions about AI use.",
+            help="Articulate how considerations of equity, diversity, and inclusion shaped the implementation approach, including how potential barriers were identified and addressed."
+        ),
+    ]),
+    FormSection("5. Outcomes and Educational Impact", [
+        FormField(
+            "impact",
+            "AI Impact",
+            placeholder="Clearly articulate how AI directly impacted teaching practices, learning experiences, or educational outcomes.",
+            help="Describe the concrete ways in which the AI implementation affected teaching and learning. Focus on specific changes, improvements, or transformations rather than general statements."
+        ),
+        FormField(
+            "evidence",
+            "Evidence of Impact",
+            placeholder="Provide evidence such as student or faculty feedback, qualitative observations, or quantitative measures.",
+            help="Include specific evidence that demonstrates the impact, such as assessment results, student feedback, faculty observations, or comparative data. This strengthens the credibility of your case study."
+        ),
+        FormField(
+            "critical_reflection",
+            "Critical Reflection",
+            placeholder="Reflect critically on the role of AI in enhancing or transforming educational experiences.",
+            help="Offer thoughtful analysis of how and why AI influenced the educational experience, considering both intended and unintended effects, limitations, and deeper implications."
+        ),
+    ]),
+    FormSection("6. Challenges and Limitations of AI Implementation", [
+        FormField(
+            "challenges",
+            "Challenges and Barriers",
+            placeholder="Document any significant technical, pedagogical, or institutional barriers encountered.",
+            help="Honestly describe difficulties encountered during implementation, which might include technical issues, resistance to adoption, institutional constraints, or pedagogical challenges."
+        ),
+        FormField(
+            "mitigation_strategies",
+            "Mitigation Strategies",
+            placeholder="Describe strategies employed to overcome or mitigate these challenges.",
+            help="Explain approaches used to address the challenges identified, including adaptations, workarounds, or solutions developed in response to specific barriers."
+        ),
+        FormField(
+            "reflective_insights",
+            "Reflective Insights",
+            placeholder="Provide reflective insights or recommendations for future AI integrations.",
+            help="Share deeper reflections on what was learned through addressing challenges, including insights that might help others avoid similar issues or more effectively implement AI."
+        ),
+    ]),
+    FormSection("7. Sustainability and Future AI Use", [
+        FormField(
+            "future_plans",
+            "Future Plans",
+            placeholder="Outline plans or possibilities for continuing, scaling, or adapting AI use in similar contexts.",
+            help="Describe how this AI implementation might continue, expand, or evolve in the future, including plans for sustainability, scaling, or adaptation to other contexts."
+        ),
+        FormField(
+            "future_research",
+            "Future Research",
+            placeholder="Highlight potential areas for future research or development arising from the current implementation.",
+            help="Identify questions, gaps, or opportunities for further investigation that emerged from this implementation, suggesting avenues for future research or development."
+        ),
+        FormField(
+            "recommendations",
+            "Recommendations",
+            placeholder="Suggest recommendations for institutional support or policy considerations for ongoing AI adoption.",
+            help="Offer specific, actionable recommendations for institutional policies, support structures, or resources that would facilitate effective AI integration in educational settings."
+        ),
+    ]),
+    FormSection(None, [
+        FormField(
+            "acknowledgements",
+            "Acknowledgements (optional)",
+            placeholder="Add any acknowledgements you wish to include at the end of the case study.",
+            help="This section is optional. Use it to thank contributors, institutions, or anyone who supported your work.",
+            height=70
+        ),
+    ], in_prompt=False),
+]
+
+# Sections whose fields make up the prompt, in order
+SECTIONS = [section for section in FORM_SCHEMA if section.in_prompt]
+
+FIELDS = {field.key: field for section in FORM_SCHEMA for field in section.fields}
+
+# Fields shown around the generated text but not sent to the model
+FRONT_MATTER_FIELDS = [field.key for section in FORM_SCHEMA if not section.in_prompt for field in section.fields]
+
+FIELD_NAMES = list(FIELDS)
+
+# Labels that prefix field values in the prompt
+PROMPT_LABELS = [field.label for section in SECTIONS for field in section.fields]
+
+REQUIRED_FIELDS = [key for key, field in FIELDS.items() if field.required]
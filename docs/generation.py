@@ -0,0 +1,47 @@
+import os
+import time
+
+# Model used to draft the case study
+DRAFT_MODEL = "gpt-4.1"
+
+# Stream the draft so it can be shown while it is generated ("0" to disable)
+STREAM_DRAFT = os.getenv("STREAM_DRAFT", "1") != "0"
+
+
+# Run a chat completion with streaming enabled, calling `on_token` with every
+# piece of text as it arrives. Returns the full text and a timing dict with
+# the time to first token and the total generation time in seconds.
+def stream_chat_completion(client, model, messages, on_token=None, **kwargs):
+    start = time.perf_counter()
+    first_token_time = None
+    parts = []
+
+    stream = client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if first_token_time is None:
+            first_token_time = time.perf_counter() - start
+        parts.append(delta)
+        if on_token is not None:
+            on_token(delta)
+
+    total_time = time.perf_counter() - start
+    timings = {
+        "time_to_first_token": first_token_time if first_token_time is not None else total_time,
+        "total_time": total_time
+    }
+    return "".join(parts), timings
+
+
+# Non-streaming counterpart of stream_chat_completion with the same return
+# shape; the first token only becomes visible once the whole response is back.
+def chat_completion(client, model, messages, **kwargs):
+    start = time.perf_counter()
+    completion = client.chat.completions.create(model=model, messages=messages, **kwargs)
+    total_time = time.perf_counter() - start
+    timings = {"time_to_first_token": total_time, "total_time": total_time}
+    return completion.choices[0].message.content, timings
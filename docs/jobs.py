@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from completion_cache import CachedClient
+from metrics import registry
+from pipeline import run_pipeline
+from scheduler import INTERACTIVE, ScheduledClient
+
+# Background execution of case study generations. The Streamlit script only
+# submits a job and gets its ID back; a bounded worker pool shared by every
+# session runs the pipeline, and the UI polls the job for stage progress and
+# the streamed draft. Jobs live in the server process, so a rerun, a tab
+# switch or a reconnecting browser can pick the job up again by its ID.
+# Finished results are also written to the result store, which outlives
+# both the job and the server process.
+
+# Generations run at once across all sessions; further jobs wait in the queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+
+# How long a finished job is kept for sessions to collect its result
+JOB_RETENTION = float(os.getenv("JOB_RETENTION_MINUTES", "60")) * 60
+
+
+# One generation request and its progress. `speculative` holds the
+# sections drafted ahead of submit (a speculation.SpeculativeClaim).
+class Job:
+    def __init__(self, fields, bypass_cache=False, previous=None, owner=None, speculative=None):
+        self.id = uuid.uuid4().hex
+        self.fields = fields
+        self.bypass_cache = bypass_cache
+        self.previous = previous
+        self.owner = owner
+        self.speculative = speculative
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stages = {}
+        self.result = None
+        self.run_id = None
+        self.error = None
+        self._draft_parts = []
+        self._lock = threading.Lock()
+
+    # Record a stage transition reported by the pipeline
+    def update_stage(self, name, status):
+        with self._lock:
+            self.stages[name] = status
+
+    # Append a streamed draft token
+    def append_draft(self, token):
+        self._draft_parts.append(token)
+
+    @property
+    def draft(self):
+        return "".join(self._draft_parts)
+
+    # Point-in-time copy of the stage statuses, safe to read while the job runs
+    def stage_snapshot(self):
+        with self._lock:
+            return dict(self.stages)
+
+
+# Runs jobs on a bounded pool of worker threads. `client` is the raw OpenAI
+# client; every job wraps it in the scheduler and completion cache itself.
+# With a `result_store`, every successful run is saved and its ID kept in `job.run_id`.
+class JobManager:
+    def __init__(self, client, completion_cache=None, citation_cache=None, result_store=None,
+                 max_workers=JOB_WORKERS, retention=JOB_RETENTION):
+        self.client = client
+        self.completion_cache = completion_cache
+        self.citation_cache = citation_cache
+        self.result_store = result_store
+        self.retention = retention
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        registry.register_gauge(
+            "casestudy_jobs_queued", "Generation jobs waiting for a worker.",
+            lambda: self.count("queued")
+        )
+        registry.register_gauge(
+            "casestudy_jobs_running", "Generation jobs currently running.",
+            lambda: self.count("running")
+        )
+
+    # Queue a generation for `fields` and return its job ID straight away.
+    # `previous` is an earlier result whose unchanged sections are reused,
+    # and so are the sections in `speculative`, drafted ahead of submit;
+    # `owner` is who the result is stored for.
+    def submit(self, fields, bypass_cache=False, previous=None, owner=None, speculative=None):
+        self.prune()
+        job = Job(fields, bypass_cache=bypass_cache, previous=previous, owner=owner, speculative=speculative)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def count(self, status):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == status)
+
+    # Position of a queued job among the jobs waiting for a worker (1 = next)
+    def queue_position(self, job_id):
+        with self._lock:
+            queued = sorted(
+                (job for job in self._jobs.values() if job.status == "queued"),
+                key=lambda job: job.submitted_at
+            )
+        for position, job in enumerate(queued, 1):
+            if job.id == job_id:
+                return position
+        return None
+
+    # Forget finished jobs older than the retention period
+    def prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job.finished_at is not None and job.finished_at < cutoff]:
+                del self._jobs[job_id]
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            # Jobs come from the form, so they go ahead of batch work
+            client = CachedClient(
+                ScheduledClient(self.client, priority=INTERACTIVE),
+                self.completion_cache,
+                bypass=job.bypass_cache
+            )
+            previous = job.previous
+            if job.speculative is not None:
+                # Drafts still running are waited for rather than drafted again
+                speculative = job.speculative.sections()
+                if speculative:
+                    previous = dict(previous or {})
+                    previous["sections"] = (previous.get("sections") or []) + speculative
+                    # The questions of the earlier result do not cover the new drafts
+                    previous.pop("review_questions", None)
+            job.result = run_pipeline(
+                client,
+                job.fields,
+                cache=self.citation_cache,
+                on_token=job.append_draft,
+                on_stage=job.update_stage,
+                previous=previous
+            )
+            if self.result_store is not None:
+                try:
+                    job.run_id = self.result_store.save(job.fields, job.result, owner=job.owner)
+                except Exception as e:
+                    # The result is still handed to the session, just not kept
+                    print(f"Error saving job {job.id} to the result store: {str(e)}")
+            job.status = "done"
+        except Exception as e:
+            print(f"Job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            if job.speculative is not None:
+                job.speculative.settle(job.result)
+            job.finished_at = time.time()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
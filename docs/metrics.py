@@ -0,0 +1,381 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+# Per-stage instrumentation for pipeline runs. A RunMetrics collects one
+# record per stage (draft, each citation lookup, integration, questions) with
+# wall time, queue time, token usage, estimated cost, retries and cache hits.
+# The active run and stage are tracked in context variables, so helpers deep
+# in the pipeline can report into the right record without extra arguments.
+
+# JSON Lines file every run record is appended to (unset: not written)
+METRICS_PATH = os.getenv("METRICS_PATH")
+
+# Port of the Prometheus text endpoint (0: no endpoint)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Address the endpoint listens on; local scrapers only by default, set
+# METRICS_HOST=0.0.0.0 to let a scraper on another host reach it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# USD per million (prompt, completion) tokens, used for cost estimates
+MODEL_PRICES = {
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4o-search-preview": (2.50, 10.00),
+}
+
+_current_run = contextvars.ContextVar("current_run", default=None)
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class StageRecord:
+    def __init__(self, name, queue_time=0.0):
+        self.name = name
+        self.queue_time = queue_time
+        self.wall_time = 0.0
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.retries = 0
+        self.cache_hits = 0
+        self.models = set()
+        self.routes = []
+        self.error = None
+        self._lock = threading.Lock()
+
+    def add_usage(self, model, usage, cached=False):
+        prompt_tokens = (getattr(usage, "prompt_tokens", None) or 0) if usage is not None else 0
+        completion_tokens = (getattr(usage, "completion_tokens", None) or 0) if usage is not None else 0
+        with self._lock:
+            self.calls += 1
+            self.models.add(model)
+            if cached:
+                self.cache_hits += 1
+                return  # Served without an API call, so no tokens were spent
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += estimate_cost(model, prompt_tokens, completion_tokens)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "wall_time": round(self.wall_time, 4),
+            "queue_time": round(self.queue_time, 4),
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost, 6),
+            "retries": self.retries,
+            "cache_hits": self.cache_hits,
+            "models": sorted(self.models),
+            "routes": list(self.routes),
+            "error": self.error,
+        }
+
+
+# Metrics of one pipeline run. `on_stage(name, status)` is called when a
+# stage starts ("running") and ends ("done" or "failed"), e.g. to report progress.
+class RunMetrics:
+    def __init__(self, run_id=None, on_stage=None, **labels):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.on_stage = on_stage
+        self.labels = labels
+        self.started_at = time.time()
+        self.stages = []
+        self._start = time.perf_counter()
+        self._end = None
+        self._lock = threading.Lock()
+
+    # Make this the current run for the code inside the block
+    @contextmanager
+    def activate(self):
+        token = _current_run.set(self)
+        try:
+            yield self
+        finally:
+            _current_run.reset(token)
+            self._end = time.perf_counter()
+
+    # Time a stage. `queued_at` is the perf_counter() value when the work was
+    # queued, so time spent waiting for a worker is reported separately.
+    @contextmanager
+    def stage(self, name, queued_at=None):
+        start = time.perf_counter()
+        record = StageRecord(name, queue_time=start - queued_at if queued_at is not None else 0.0)
+        with self._lock:
+            self.stages.append(record)
+        token = _current_stage.set(record)
+        if self.on_stage is not None:
+            self.on_stage(name, "running")
+        try:
+            yield record
+        except Exception as e:
+            record.error = str(e)
+            raise
+        finally:
+            record.wall_time = time.perf_counter() - start
+            _current_stage.reset(token)
+            if self.on_stage is not None:
+                self.on_stage(name, "failed" if record.error is not None else "done")
+
+    def to_record(self):
+        end = self._end if self._end is not None else time.perf_counter()
+        stages = [record.to_dict() for record in self.stages]
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "total_time": round(end - self._start, 4),
+            **self.labels,
+            "stages": stages,
+            "totals": {
+                "calls": sum(s["calls"] for s in stages),
+                "prompt_tokens": sum(s["prompt_tokens"] for s in stages),
+                "completion_tokens": sum(s["completion_tokens"] for s in stages),
+                "cost_usd": round(sum(s["cost_usd"] for s in stages), 6),
+                "retries": sum(s["retries"] for s in stages),
+                "cache_hits": sum(s["cache_hits"] for s in stages),
+            },
+        }
+
+
+# Time a stage of the current run; does nothing outside of a run
+@contextmanager
+def track_stage(name, queued_at=None):
+    run = _current_run.get()
+    if run is None:
+        yield None
+        return
+    with run.stage(name, queued_at=queued_at) as record:
+        yield record
+
+
+def current_stage():
+    return _current_stage.get()
+
+
+def note_cache_hit():
+    record = _current_stage.get()
+    if record is not None:
+        with record._lock:
+            record.cache_hits += 1
+
+
+# Add time spent waiting for a worker or for rate-limit capacity to the current stage
+def note_queue_time(seconds):
+    record = _current_stage.get()
+    if record is not None and seconds > 0:
+        with record._lock:
+            record.queue_time += seconds
+
+
+def note_retry():
+    record = _current_stage.get()
+    if record is not None:
+        with record._lock:
+            record.retries += 1
+
+
+# Record which backend answered a request of the current stage, how long it
+# took, and whether it was a fallback after another backend failed or was too slow
+def note_route(backend, model, seconds, fallback=False, error=None):
+    record = _current_stage.get()
+    if record is not None:
+        with record._lock:
+            record.routes.append({
+                "backend": backend,
+                "model": model,
+                "latency": round(seconds, 4),
+                "fallback": fallback,
+                "error": error,
+            })
+
+
+# Submit work to an executor so it runs inside the caller's run and stage
+def submit_in_context(executor, fn, *args, **kwargs):
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# Wraps an OpenAI client and adds the usage of every completion to the
+# current stage. Streamed requests ask the API to report usage in the last chunk.
+class MeteredClient:
+    def __init__(self, client):
+        self.client = client
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    # The same wrapper around another client, e.g. a routed backend's
+    def rewrap(self, client):
+        return MeteredClient(client)
+
+    def create(self, **request):
+        model = request.get("model")
+        if request.get("stream"):
+            request.setdefault("stream_options", {"include_usage": True})
+            return self._meter_stream(model, self.client.chat.completions.create(**request))
+
+        response = self.client.chat.completions.create(**request)
+        record = _current_stage.get()
+        if record is not None:
+            record.add_usage(model, getattr(response, "usage", None), cached=getattr(response, "cached", False))
+        return response
+
+    def _meter_stream(self, model, stream):
+        record = _current_stage.get()
+        usage = None
+        cached = getattr(stream, "cached", False)
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            yield chunk
+        if record is not None:
+            record.add_usage(model, usage, cached=cached)
+
+
+# Process-wide aggregates of every exported run, rendered in the Prometheus
+# text format. Other modules can add gauges with register_gauge().
+class MetricsRegistry:
+    def __init__(self):
+        self.runs = 0
+        self.run_seconds = 0.0
+        self.stage_seconds = {}
+        self.stage_count = {}
+        self.tokens = {}
+        self.cost = 0.0
+        self.retries = 0
+        self.cache_hits = 0
+        self.draft_seconds = {}
+        self.draft_count = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, record):
+        with self._lock:
+            self.runs += 1
+            self.run_seconds += record["total_time"]
+            for stage in record["stages"]:
+                # Citation lookups, section drafts and the chunks of a chunked
+                # stage are aggregated under one label each
+                name = stage["name"]
+                if name.startswith(("citation:", "section:")):
+                    name = name.split(":", 1)[0]
+                elif ": chunk " in name:
+                    name = name.split(":", 1)[0] + " chunk"
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + stage["wall_time"]
+                self.stage_count[name] = self.stage_count.get(name, 0) + 1
+                for kind in ("prompt_tokens", "completion_tokens"):
+                    self.tokens[(name, kind)] = self.tokens.get((name, kind), 0) + stage[kind]
+            self.cost += record["totals"]["cost_usd"]
+            self.retries += record["totals"]["retries"]
+            self.cache_hits += record["totals"]["cache_hits"]
+            draft = record.get("draft")
+            if draft:
+                # Draft time per draft mode, to compare the modes side by side
+                mode = draft["mode"]
+                self.draft_seconds[mode] = self.draft_seconds.get(mode, 0.0) + draft["total_time"]
+                self.draft_count[mode] = self.draft_count.get(mode, 0) + 1
+
+    # Expose a value computed on every scrape, e.g. a queue depth
+    def register_gauge(self, name, help_text, read):
+        self.gauges[name] = (help_text, read)
+
+    def render_prometheus(self):
+        with self._lock:
+            lines = [
+                "# HELP casestudy_runs_total Completed pipeline runs.",
+                "# TYPE casestudy_runs_total counter",
+                f"casestudy_runs_total {self.runs}",
+                "# HELP casestudy_run_seconds_total Wall time spent in pipeline runs.",
+                "# TYPE casestudy_run_seconds_total counter",
+                f"casestudy_run_seconds_total {self.run_seconds:.4f}",
+                "# HELP casestudy_stage_seconds Wall time per pipeline stage.",
+                "# TYPE casestudy_stage_seconds summary",
+            ]
+            for name in sorted(self.stage_seconds):
+                lines.append(f'casestudy_stage_seconds_sum{{stage="{name}"}} {self.stage_seconds[name]:.4f}')
+                lines.append(f'casestudy_stage_seconds_count{{stage="{name}"}} {self.stage_count[name]}')
+            lines += [
+                "# HELP casestudy_draft_seconds Wall time of the draft per draft mode.",
+                "# TYPE casestudy_draft_seconds summary",
+            ]
+            for mode in sorted(self.draft_seconds):
+                lines.append(f'casestudy_draft_seconds_sum{{mode="{mode}"}} {self.draft_seconds[mode]:.4f}')
+                lines.append(f'casestudy_draft_seconds_count{{mode="{mode}"}} {self.draft_count[mode]}')
+            lines += [
+                "# HELP casestudy_tokens_total Tokens used per stage.",
+                "# TYPE casestudy_tokens_total counter",
+            ]
+            for (name, kind), value in sorted(self.tokens.items()):
+                lines.append(f'casestudy_tokens_total{{stage="{name}",kind="{kind}"}} {value}')
+            lines += [
+                "# HELP casestudy_cost_usd_total Estimated API cost.",
+                "# TYPE casestudy_cost_usd_total counter",
+                f"casestudy_cost_usd_total {self.cost:.6f}",
+                "# HELP casestudy_retries_total Retried API calls.",
+                "# TYPE casestudy_retries_total counter",
+                f"casestudy_retries_total {self.retries}",
+                "# HELP casestudy_cache_hits_total Requests answered from a cache.",
+                "# TYPE casestudy_cache_hits_total counter",
+                f"casestudy_cache_hits_total {self.cache_hits}",
+            ]
+            gauges = list(self.gauges.items())
+        for name, (help_text, read) in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+# Emit a finished run: one JSON line on stdout, appended to METRICS_PATH if
+# configured, and added to the Prometheus aggregates
+def export_run(record, path=METRICS_PATH):
+    line = json.dumps(record)
+    print(f"Run metrics: {line}")
+    if path:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    registry.observe(record)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the app log
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+# Serve /metrics on `host`:`port` from a background thread; safe to call repeatedly
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    global _server
+    with _server_lock:
+        if _server is None and port:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
@@ -0,0 +1,596 @@
+import os
+import time
+
+from backends import route_client
+from chunking import (
+    CHUNK_MODE,
+    CHUNK_MODES,
+    chunk_headings,
+    chunk_text,
+    join_chunks,
+    map_chunks,
+    plan_chunks,
+    should_chunk,
+    split_units,
+)
+from citations import (
+    CITATION_POLISH,
+    PREFETCH_CITATIONS,
+    CitationPrefetcher,
+    append_reference_section,
+    apply_citations,
+    extract_placeholders,
+    in_text_from_reference,
+    resolve_placeholders,
+)
+from form_schema import PROMPT_LABELS, REQUIRED_FIELDS, SECTIONS
+from generation import DRAFT_MODEL, STREAM_DRAFT, chat_completion, stream_chat_completion
+from metrics import MeteredClient, RunMetrics, export_run, track_stage
+from prompts import build_prompt, count_tokens, prompt_room, truncate_text
+from sections import (
+    DRAFT_MODE,
+    DRAFT_MODES,
+    assign_section_citations,
+    carried_citations,
+    draft_sections,
+    plan_sections,
+    stitch_sections,
+)
+from stages import PIPELINE_MODE, Stage, format_timings, run_stages
+
+# Case study generation pipeline shared by the Streamlit app and the batch
+# CLI. Nothing in here touches the UI; callers pass an OpenAI-compatible
+# client and a dict of form fields keyed by the names in form_schema.
+
+# Model used for the citation polish pass and the guiding questions
+REVIEW_MODEL = "gpt-4.1"
+
+# HTTP connection pool of the OpenAI client. Connections are kept alive
+# between requests, so only the first call of a process pays for TLS setup.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120"))
+
+WRITER_ROLE = "You are an expert academic writer specializing in education technology and AI implementation case studies. You follow APA 7th edition formatting perfectly."
+
+REVIEWER_ROLE = "You are an expert academic reviewer who provides constructive feedback on case studies about AI in education."
+
+
+# Names of required fields that are empty
+def missing_required_fields(fields):
+    return [key for key in REQUIRED_FIELDS if not (fields.get(key) or "").strip()]
+
+
+# Prepare the structured sections, keyed by section heading
+def build_section_content(fields):
+    section_content = {}
+    for section in SECTIONS:
+        section_content[section.title] = "\n\n".join(
+            f"{field.label}: {fields.get(field.key) or ''}" for field in section.fields
+        ).strip()
+    return section_content
+
+
+# Check if the section has any actual content beyond field labels
+def section_has_content(content):
+    for line in content.split('\n'):
+        # Skip lines that are just field labels without content
+        if ':' in line and line.split(':', 1)[1].strip() == '':
+            continue
+        if line.strip():  # Any non-empty line that's not just a field label
+            return True
+    return False
+
+
+# Create the case study structure with only non-empty sections
+def build_case_study_sections(section_content):
+    case_study_sections = ""
+    for title, content in section_content.items():
+        if section_has_content(content):
+            case_study_sections += f"\n\n{title}\n{content}\n"
+    return case_study_sections
+
+
+CASE_STUDY_TEMPLATE = """
+    Generate a comprehensive case study in APA 7th edition format about AI implementation in an educational context based on the following information.
+
+    The case study should be written as a cohesive academic narrative that flows naturally between topics, while covering only these sections that have content:
+
+    {case_study_sections}
+
+    Format guidelines:
+    - Write in a flowing academic narrative style that connects ideas across sections
+    - Include ONLY the main section headings as provided above to improve readability
+    - DO NOT include sections that were not provided in the input
+    - Do NOT include any subheadings within sections
+    - Create placeholder for citations for any academic claim.
+    - The tone should be academic but accessible, with a focus on practical insights
+
+    When you need to include a citation, use the format (placeholder: topic) where "topic" briefly describes what the citation is about. For example, (placeholder: AI bias in education) or (placeholder: learning analytics).
+    """
+
+# The writer role already says who the model is, so the prompt does not repeat it
+CITATION_TEMPLATE = """
+    Below is a case study about AI implementation in education that contains citation placeholders in the format (placeholder: topic).
+
+    Please rewrite this case study by:
+    1. Integrating the following academic references appropriately throughout the text where the placeholders appear
+    2. Maintaining the exact same content and structure of the original case study
+    3. Adding a properly formatted References section at the end following APA 7th edition guidelines
+    4. Using proper in-text citations (Author, Year) that correspond to the references list
+
+    Case Study:
+    {case_study}
+
+    Available References to Integrate:
+    {references}
+
+    Important instructions:
+    - Preserve the academic narrative flow of the case study
+    - Maintain the EXACT same section structure as the original case study - do not add or remove any sections
+    - Keep all section headings exactly as they are in the original
+    - Do NOT add any subheadings
+    - Maintain all original content and insights
+    - Only modify the citation placeholders to use proper academic citations
+    - Use each reference where it is most relevant to the topic being discussed
+    - Ensure every reference is used at least once in the text
+    - Add a properly formatted References section at the end
+    """
+
+REVIEW_TEMPLATE = """
+    Based on the following case study, generate 5-7 thoughtful questions that could help the author expand and improve their work.
+    Focus on areas that might be underdeveloped, need more evidence, or could benefit from additional perspectives.
+
+    Case study: {case_study}
+    """
+
+# Polish pass over one chunk of a long case study. The References section is
+# assembled locally once all chunks are back.
+CITATION_CHUNK_TEMPLATE = """
+    Below is part {part} of {parts} of a case study about AI implementation in education. It contains citation placeholders in the format (placeholder: topic).
+
+    Please rewrite this part of the case study by:
+    1. Replacing each placeholder with a proper in-text citation (Author, Year) of the most relevant reference below
+    2. Maintaining the exact same content and structure of this part
+
+    Part of the case study:
+    {chunk}
+
+    References for this part:
+    {references}
+
+    Important instructions:
+    - Preserve the academic narrative flow
+    - Keep all section headings exactly as they are, and do not add or remove any headings
+    - Only modify the citation placeholders to use proper academic citations
+    - Do NOT add a References section; it is added separately
+    """
+
+REVIEW_CHUNK_TEMPLATE = """
+    Below is part {part} of {parts} of a case study about AI implementation in education. Generate 2-3 thoughtful questions that could help the author expand and improve this part.
+    Focus on areas that might be underdeveloped, need more evidence, or could benefit from additional perspectives.
+
+    Part of the case study: {chunk}
+    """
+
+# Combines the questions asked about each chunk into the final list
+REVIEW_MERGE_TEMPLATE = """
+    The questions below were written about different parts of one case study about AI implementation in education. Combine them into 5-7 thoughtful questions that could help the author expand and improve their work as a whole.
+    Merge overlapping questions and prefer those about underdeveloped areas, missing evidence or additional perspectives.
+
+    Questions: {questions}
+    """
+
+
+# Prepare prompt for case study generation. Over the draft budget, the
+# field values are shortened; every section and field label is kept.
+def build_case_study_prompt(case_study_sections):
+    return build_prompt(
+        "draft", CASE_STUDY_TEMPLATE, model=DRAFT_MODEL,
+        digest_key="case_study_sections", digest_labels=PROMPT_LABELS, case_study_sections=case_study_sections
+    )
+
+
+def build_draft_messages(fields):
+    case_study_prompt = build_case_study_prompt(build_case_study_sections(build_section_content(fields)))
+    return [
+        {"role": "developer", "content": WRITER_ROLE},
+        {"role": "user", "content": case_study_prompt}
+    ]
+
+
+# Function to rewrite case study with proper academic citations (optional polish pass).
+# `fallback` is returned unchanged if the rewrite fails, including when the
+# case study is too long for the integration budget. Long case studies are
+# rewritten chunk by chunk (see chunking.py) when `cited_case_study`, the
+# same case study with its citations inserted locally, is given.
+def integrate_citations(client, case_study, references, fallback=None, cited_case_study=None, chunk_mode=CHUNK_MODE):
+    # Skip if no references were found
+    if not references:
+        return case_study
+
+    room = prompt_room(
+        "integration", CITATION_TEMPLATE, "case_study", model=REVIEW_MODEL, references="\n".join(references)
+    )
+    if cited_case_study is not None and should_chunk(case_study, chunk_mode, max_tokens=room, model=REVIEW_MODEL):
+        return integrate_citations_chunked(client, case_study, cited_case_study, references)
+
+    try:
+        # The whole case study has to be rewritten, so it is never digested
+        citation_prompt = build_prompt(
+            "integration", CITATION_TEMPLATE, model=REVIEW_MODEL,
+            case_study=case_study, references="\n".join(references)
+        )
+
+        # Call OpenAI to rewrite the case study with proper citations
+        completion = client.chat.completions.create(
+            model=REVIEW_MODEL,
+            messages=[
+                {"role": "developer", "content": WRITER_ROLE},
+                {"role": "user", "content": citation_prompt}
+            ]
+        )
+
+        # Return the rewritten case study
+        return completion.choices[0].message.content
+
+    except Exception as e:
+        # If there's an error, log it and fall back to local assembly
+        print(f"Error integrating citations: {str(e)}")
+        return fallback if fallback is not None else append_reference_section(case_study, references)
+
+
+# Polish pass over a long case study, one chunk at a time. Each chunk is sent
+# with only the references cited in it; a chunk without citations, or whose
+# rewrite fails, keeps its locally cited text. The chunks are joined in order
+# and the References section is appended locally.
+def integrate_citations_chunked(client, case_study, cited_case_study, references):
+    units = split_units(case_study)
+    cited_units = split_units(cited_case_study)
+    if len(units) != len(cited_units):
+        # Only a placeholder topic with a sentence break in it changes the split
+        print("Chunked citation integration skipped: draft and cited case study do not align")
+        return append_reference_section(cited_case_study, references)
+
+    spans = plan_chunks(units, model=REVIEW_MODEL)
+    in_text = {reference: in_text_from_reference(reference) for reference in references}
+    print(f"Integrating citations in {len(spans)} chunks")
+
+    def rewrite(index, span):
+        cited_chunk = chunk_text(cited_units, span)
+        chunk_references = [reference for reference in references if in_text[reference] in cited_chunk]
+        if not chunk_references:
+            return cited_chunk
+        try:
+            prompt = build_prompt(
+                "integration", CITATION_CHUNK_TEMPLATE, model=REVIEW_MODEL,
+                part=index + 1, parts=len(spans), chunk=chunk_text(units, span),
+                references="\n".join(chunk_references)
+            )
+            completion = client.chat.completions.create(
+                model=REVIEW_MODEL,
+                messages=[
+                    {"role": "developer", "content": WRITER_ROLE},
+                    {"role": "user", "content": prompt}
+                ]
+            )
+            # Drop a References section the model added anyway
+            return completion.choices[0].message.content.split("\n## References", 1)[0].strip()
+        except Exception as e:
+            print(f"Error integrating citations in chunk {index + 1} ({', '.join(chunk_headings(cited_chunk)) or 'no heading'}): {str(e)}")
+            return cited_chunk
+
+    chunks = map_chunks(rewrite, spans, "integration")
+    return append_reference_section(join_chunks(chunks, cited_units, spans), references)
+
+
+# Function to generate questions that help the author expand their case study.
+# Long case studies are either chunked, with questions asked about every
+# chunk and then merged, or digested.
+def generate_review_questions(client, case_study, chunk_mode=CHUNK_MODE):
+    # The reference list adds nothing to the questions
+    case_study = case_study.split("\n## References", 1)[0]
+    room = prompt_room("questions", REVIEW_TEMPLATE, "case_study", model=REVIEW_MODEL)
+    if should_chunk(case_study, chunk_mode, max_tokens=room, model=REVIEW_MODEL):
+        return generate_review_questions_chunked(client, case_study)
+
+    review_prompt = build_prompt(
+        "questions", REVIEW_TEMPLATE, model=REVIEW_MODEL,
+        digest_key="case_study", case_study=case_study
+    )
+
+    # Generate the review questions using OpenAI API
+    review_completion = client.chat.completions.create(
+        model=REVIEW_MODEL,
+        messages=[
+            {"role": "developer", "content": REVIEWER_ROLE},
+            {"role": "user", "content": review_prompt}
+        ]
+    )
+
+    return review_completion.choices[0].message.content
+
+
+# Guiding questions for a long case study: a few questions per chunk, merged
+# into the final list by more requests that only see the questions. When the
+# questions of every chunk do not fit one merge prompt, they are merged in
+# rounds: batches that fit are merged into a few questions each, until one
+# batch is left for the final merge.
+def generate_review_questions_chunked(client, case_study):
+    units = split_units(case_study)
+    spans = plan_chunks(units, model=REVIEW_MODEL)
+    print(f"Generating review questions over {len(spans)} chunks")
+
+    def ask(index, span):
+        prompt = build_prompt(
+            "questions", REVIEW_CHUNK_TEMPLATE, model=REVIEW_MODEL,
+            part=index + 1, parts=len(spans), chunk=chunk_text(units, span)
+        )
+        completion = client.chat.completions.create(
+            model=REVIEW_MODEL,
+            messages=[
+                {"role": "developer", "content": REVIEWER_ROLE},
+                {"role": "user", "content": prompt}
+            ]
+        )
+        return completion.choices[0].message.content.strip()
+
+    def merge(batch):
+        prompt = build_prompt(
+            "questions", REVIEW_MERGE_TEMPLATE, model=REVIEW_MODEL, questions="\n\n".join(batch)
+        )
+        completion = client.chat.completions.create(
+            model=REVIEW_MODEL,
+            messages=[
+                {"role": "developer", "content": REVIEWER_ROLE},
+                {"role": "user", "content": prompt}
+            ]
+        )
+        return completion.choices[0].message.content.strip()
+
+    # A batch that cannot be merged keeps the questions of its first chunk
+    def merge_batch(index, batch):
+        try:
+            return merge(batch)
+        except Exception as e:
+            print(f"Error merging review questions in batch {index + 1}: {str(e)}")
+            return batch[0]
+
+    questions = map_chunks(ask, spans, "questions")
+    batches = merge_batches(questions)
+    round_number = 1
+    while len(batches) > 1:
+        print(f"Merging review questions in round {round_number}: {len(batches)} batches")
+        questions = map_chunks(merge_batch, batches, f"questions: merge round {round_number}")
+        batches = merge_batches(questions)
+        round_number += 1
+
+    with track_stage("questions: merge"):
+        try:
+            return merge(batches[0])
+        except Exception as e:
+            # The questions of the last batch are still useful unmerged
+            print(f"Error merging review questions: {str(e)}")
+            return "\n\n".join(batches[0])
+
+
+# Split the questions asked about the chunks into consecutive batches that
+# each fit the merge prompt's budget. Each chunk's questions are cut to half
+# of it, so every batch of more than one chunk shrinks when merged.
+def merge_batches(questions):
+    room = prompt_room("questions", REVIEW_MERGE_TEMPLATE, "questions", model=REVIEW_MODEL)
+    if room is None:
+        return [questions]
+    available = max(1, room)
+    separator = count_tokens("\n\n", REVIEW_MODEL)
+    batches = []
+    size = 0
+    for text in questions:
+        tokens = count_tokens(text, REVIEW_MODEL) + separator
+        if tokens > available // 2:
+            text = truncate_text(text, available // 2 - separator, REVIEW_MODEL)
+            tokens = count_tokens(text, REVIEW_MODEL) + separator
+        if batches and size + tokens <= available:
+            batches[-1].append(text)
+            size += tokens
+        else:
+            batches.append([text])
+            size = tokens
+    return batches or [[]]
+
+
+# Run the whole generation pipeline for one set of form fields: draft (optionally
+# streamed to `on_token`), citation search, local assembly or polish pass, and
+# guiding questions. `on_stage(name, status)` is told when each stage starts and
+# ends. In the per-section draft modes, passing the result of an earlier run as
+# `previous` reuses every section whose inputs did not change, along with its
+# citations (and the guiding questions if nothing changed at all).
+# `chunk_mode` decides when long case studies go through the polish pass and
+# the guiding questions in chunks. Returns a dict with the draft, sections,
+# references, final case study, review questions, timings and the run's
+# metrics record.
+def run_pipeline(client, fields, cache=None, on_token=None, stream=STREAM_DRAFT, mode=PIPELINE_MODE,
+                 prefetch=PREFETCH_CITATIONS, polish=CITATION_POLISH, on_stage=None,
+                 draft_mode=DRAFT_MODE, previous=None, chunk_mode=CHUNK_MODE):
+    if draft_mode not in DRAFT_MODES:
+        raise ValueError(f"Unknown draft mode '{draft_mode}', expected one of {', '.join(DRAFT_MODES)}")
+    if chunk_mode not in CHUNK_MODES:
+        raise ValueError(f"Unknown chunk mode '{chunk_mode}', expected one of {', '.join(CHUNK_MODES)}")
+
+    run_metrics = RunMetrics(on_stage=on_stage, mode=mode, stream=stream, draft_mode=draft_mode, chunk_mode=chunk_mode)
+    # Stages are routed to their configured backends after metering, so usage is
+    # attributed to the model that actually answered
+    client = route_client(MeteredClient(client))
+    with run_metrics.activate():
+        result = _run_stages(
+            client, fields, cache, on_token, stream, mode, prefetch, polish, draft_mode, previous, chunk_mode
+        )
+
+    record = run_metrics.to_record()
+    record["time_to_first_token"] = round(result["timings"]["draft"]["time_to_first_token"], 4)
+    # Draft timing per draft mode, for comparing the modes across runs
+    draft_timings = result["timings"]["draft"]
+    record["draft"] = {"mode": draft_mode, "total_time": round(draft_timings["total_time"], 4)}
+    for key in ("slowest_section", "sections_total", "stitch_time"):
+        if key in draft_timings:
+            record["draft"][key] = round(draft_timings[key], 4)
+    if result["sections"] is not None:
+        record["sections_regenerated"] = result["sections_regenerated"]
+        record["sections_reused"] = len(result["sections"]) - result["sections_regenerated"]
+    export_run(record)
+    result["metrics"] = record
+    return result
+
+
+def _run_stages(client, fields, cache, on_token, stream, mode, prefetch, polish, draft_mode, previous, chunk_mode):
+    run_start = time.perf_counter()
+    plan = None
+
+    # Generate the case study, searching for sources as soon as each placeholder has streamed in
+    with track_stage("draft"):
+        if draft_mode != "single":
+            section_content = {
+                title: content for title, content in build_section_content(fields).items()
+                if section_has_content(content)
+            }
+            plan = plan_sections(
+                section_content, WRITER_ROLE, previous=(previous or {}).get("sections"),
+                parallel=draft_mode == "parallel"
+            )
+        carried = carried_citations(plan) if plan is not None else {}
+        prefetcher = CitationPrefetcher(client, cache=cache, known=carried) if stream and prefetch else None
+        try:
+            if plan is not None:
+                draft_timings = draft_sections(
+                    client, plan,
+                    on_token=on_token,
+                    on_generated=prefetcher.feed if prefetcher is not None else None,
+                    stream=stream,
+                    parallel=draft_mode == "parallel"
+                )
+                case_study = stitch_sections(plan)
+            elif stream:
+                def handle_token(token):
+                    if on_token is not None:
+                        on_token(token)
+                    if prefetcher is not None:
+                        prefetcher.feed(token)
+
+                case_study, draft_timings = stream_chat_completion(
+                    client, DRAFT_MODEL, build_draft_messages(fields), on_token=handle_token
+                )
+            else:
+                case_study, draft_timings = chat_completion(client, DRAFT_MODEL, build_draft_messages(fields))
+        except Exception:
+            if prefetcher is not None:
+                prefetcher.cancel()
+            raise
+
+    print(
+        f"Draft generated: first token after {draft_timings['time_to_first_token']:.2f}s, "
+        f"total {draft_timings['total_time']:.2f}s"
+    )
+    regenerated = sum(1 for section in plan if not section.reused) if plan is not None else None
+    if plan is not None:
+        print(f"Sections: {regenerated} regenerated, {len(plan) - regenerated} reused")
+    # Sections are reused wherever they now are, so the draft is only
+    # unchanged when the same sections come back in the same order
+    unchanged = plan is not None and previous is not None and (
+        [section.fingerprint for section in plan]
+        == [section["fingerprint"] for section in previous.get("sections") or []]
+    )
+
+    # Stages after the draft: citations feed the integration step,
+    # while the guiding questions only need the draft. In serial mode
+    # the questions wait for the integrated case study instead.
+    def citations_stage(results):
+        # Only placeholders that are new in this run are searched for
+        resolved = dict(carried)
+        if prefetcher is not None:
+            resolved.update(prefetcher.results())
+        scan = extract_placeholders(case_study)
+        if not scan.total:
+            return case_study, []  # No placeholders found
+        print(f"Found {scan.total} citation placeholders ({scan.unique} unique topics)")
+        resolved = resolve_placeholders(client, scan, resolved, cache=cache)
+        if plan is not None:
+            assign_section_citations(plan, resolved)
+        return apply_citations(case_study, scan, resolved)
+
+    def integration_stage(results):
+        # Citations are inserted locally; the LLM rewrite only runs as an opt-in polish pass
+        cited_case_study, references = results["citations"]
+        assembled = append_reference_section(cited_case_study, references)
+        if references and polish:
+            return integrate_citations(
+                client, case_study, references, fallback=assembled,
+                cited_case_study=cited_case_study, chunk_mode=chunk_mode
+            )
+        return assembled
+
+    def questions_stage(results):
+        # Nothing changed since the previous run, so neither did the questions
+        if unchanged and previous.get("review_questions"):
+            return previous["review_questions"]
+        return generate_review_questions(client, results.get("integration", case_study), chunk_mode=chunk_mode)
+
+    stages = [
+        Stage("citations", citations_stage),
+        Stage("integration", integration_stage, deps=["citations"]),
+        Stage("questions", questions_stage),
+    ]
+    stage_results, stage_timings = run_stages(stages, mode=mode)
+    print(f"Pipeline stages ({mode}): {format_timings(stage_timings)}")
+
+    total_time = time.perf_counter() - run_start
+    print(f"Case study run finished in {total_time:.2f}s")
+
+    return {
+        "draft": case_study,
+        "sections": [section.to_dict() for section in plan] if plan is not None else None,
+        "sections_regenerated": regenerated,
+        "references": stage_results["citations"][1],
+        "final_case_study": stage_results["integration"],
+        "review_questions": stage_results["questions"],
+        "timings": {"draft": draft_timings, "stages": stage_timings, "total_time": total_time},
+    }
+
+
+# Compose the full case study with title, author, and acknowledgements
+def compose_case_study_document(title, author, case_study, acknowledgements=""):
+    document = (
+        f"# {title}\n\n"
+        f"**Author:** {author}\n\n"
+        f"{case_study}"
+    )
+    if acknowledgements and acknowledgements.strip():
+        document += f"\n\n**Acknowledgements**\n{acknowledgements.strip()}"
+    return document
+
+
+# HTTP client with a persistent keep-alive pool for the OpenAI client, or
+# None to use the client's built-in pool when httpx is not importable
+def create_http_client():
+    try:
+        import httpx
+        from openai import DefaultHttpxClient
+    except ImportError:
+        return None
+    return DefaultHttpxClient(limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+    ))
+
+
+# Create the OpenAI client from the environment (.env is loaded if present).
+# The client's own retries are disabled because the request scheduler
+# retries with rate-limit-aware backoff. openai and dotenv are imported here
+# rather than at module level because they are slow to import and only
+# needed once a generation starts.
+def create_client():
+    from dotenv import load_dotenv
+    from openai import OpenAI
+
+    load_dotenv()
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0, http_client=create_http_client())
@@ -0,0 +1,220 @@
+import json
+import os
+import re
+import textwrap
+import threading
+
+# Prompt building with token budgets. Prompt templates are written as
+# indented triple-quoted strings for readability; before they are sent the
+# indentation and blank-line padding are stripped. Every stage has a token
+# budget for its prompt: documents that push a prompt over budget are
+# replaced by a section digest (each section's heading and opening
+# sentences), form content keeps every field label and has its longest
+# values cut down, and prompts that cannot be shortened are refused so the
+# caller can fall back. Token counts before and after compaction are logged for
+# every prompt.
+#
+# Tokens are counted with tiktoken when it is installed and its encoding
+# files are available. Otherwise a local approximation of the same
+# pre-tokenization is used, which tends to overcount slightly.
+
+# Per-stage prompt budgets in tokens, overridable with
+# PROMPT_BUDGETS='{"questions": 3000}'. Stages without an entry are not limited.
+DEFAULT_PROMPT_BUDGETS = {
+    "draft": 6000,
+    "section": 2000,
+    "stitch": 3000,
+    "integration": 16000,
+    "questions": 4000,
+    "search": 300,
+}
+PROMPT_BUDGETS = {**DEFAULT_PROMPT_BUDGETS, **json.loads(os.getenv("PROMPT_BUDGETS", "{}"))}
+
+# Tokenizer used for models tiktoken does not know
+DEFAULT_ENCODING = "o200k_base"
+
+# Sentences kept from each section of a document digest, at most
+DIGEST_SENTENCES = 3
+
+# Approximation of the tiktoken pre-tokenizer: contractions, words with
+# their leading space, short digit groups, punctuation runs, line breaks and
+# other whitespace
+PIECE_RE = re.compile(r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s*[\r\n]+|\s+(?!\S)|\s+", re.IGNORECASE)
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+# tiktoken encoding for `model`, or None when tiktoken or its encoding files
+# are unavailable. The outcome is remembered per model.
+def get_encoding(model):
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                import tiktoken
+
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding(DEFAULT_ENCODING)
+            except Exception:
+                # Not installed, or the encoding files cannot be downloaded
+                _encodings[model] = None
+        return _encodings[model]
+
+
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Long words are split into several tokens
+    return sum(1 + len(piece.strip()) // 10 for piece in PIECE_RE.findall(text))
+
+
+# Remove formatting whitespace from a prompt template: the common
+# indentation, indentation left on its lines, trailing spaces and runs of
+# blank lines
+def compact_template(template):
+    lines = [line.strip() for line in textwrap.dedent(template).strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+
+# Tokens left for the value named `key` in a prompt of `stage` built from
+# `template` and the other `values`: the stage's budget minus everything
+# else in the prompt. None if the stage has no budget.
+def prompt_room(stage, template, key, model=None, **values):
+    budget = PROMPT_BUDGETS.get(stage)
+    if budget is None:
+        return None
+    values = {name: str(value).strip() for name, value in values.items()}
+    return budget - count_tokens(compact_template(template).format(**{**values, key: ""}), model)
+
+
+# Shorten `text` to at most `budget` tokens by keeping, for every "## "
+# section, its heading and as many opening sentences as fit (up to
+# DIGEST_SENTENCES). Text without headings is treated as one section.
+def digest_document(text, budget, model=None):
+    sections = re.split(r"\n(?=## )", text.strip())
+    parsed = []
+    for section in sections:
+        heading, _, body = section.partition("\n") if section.startswith("## ") else ("", "", section)
+        sentences = [s for s in SENTENCE_END_RE.split(" ".join(body.split())) if s]
+        parsed.append((heading, sentences))
+
+    # Every section gets an equal share of the budget, minus its heading
+    share = max(0, budget // max(1, len(parsed)))
+    parts = []
+    for heading, sentences in parsed:
+        remaining = share - count_tokens(heading, model)
+        kept = []
+        for sentence in sentences[:DIGEST_SENTENCES]:
+            cost = count_tokens(sentence, model) + 1
+            if cost > remaining:
+                break
+            kept.append(sentence)
+            remaining -= cost
+        if len(kept) < len(sentences):
+            kept.append("[...]")
+        parts.append("\n".join(part for part in (heading, " ".join(kept)) if part))
+    return "\n\n".join(parts)
+
+
+# Cut `text` to about `max_tokens` tokens at a sentence boundary, or at a
+# word boundary when not even its first sentence fits, marking the cut
+def truncate_text(text, max_tokens, model=None):
+    marker = "[...]"
+    remaining = max_tokens - count_tokens(" " + marker, model)
+    kept = []
+    pieces = [s for s in SENTENCE_END_RE.split(text.strip()) if s]
+    for sentence in pieces:
+        cost = count_tokens(sentence, model) + 1
+        if cost > remaining:
+            break
+        kept.append(sentence)
+        remaining -= cost
+    if not kept and pieces:
+        for word in pieces[0].split():
+            cost = count_tokens(" " + word, model)
+            if cost > remaining:
+                break
+            kept.append(word)
+            remaining -= cost
+    return " ".join(kept + [marker])
+
+
+# Shorten form content ("Label: value" entries, possibly under heading
+# lines) to at most `budget` tokens. Unlike a document digest, every label
+# and heading is kept: values that fit an equal share of the budget stay
+# whole, and the longer ones are cut to share what is left. `labels` are the
+# field labels that can start an entry.
+def digest_fields(text, budget, labels, model=None):
+    label_re = re.compile(
+        r"^(?:" + "|".join(re.escape(label) for label in sorted(labels, key=len, reverse=True)) + r"):[ \t]*",
+        re.MULTILINE
+    )
+    matches = list(label_re.finditer(text))
+    if not matches:
+        return digest_document(text, budget, model)
+
+    # Alternating fixed parts and values; a heading line right before the
+    # next label belongs to the fixed part
+    parts = [text[:matches[0].start()]]
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        chunk = text[match.end():end]
+        heading = re.search(r"\n\n[^\n]+\n$", chunk) if i + 1 < len(matches) else None
+        value = chunk[:heading.start() if heading else len(chunk)].rstrip()
+        parts[-1] += match.group(0)
+        parts += [value, chunk[len(value):]]
+
+    values = parts[1::2]
+    # One token of slack per value for tokens merging across the joins
+    available = budget - count_tokens("".join(parts[0::2]), model) - len(values)
+    sizes = [count_tokens(value, model) for value in values]
+    limits = [0] * len(values)
+    order = sorted(range(len(values)), key=lambda i: sizes[i])
+    for n, i in enumerate(order):
+        limits[i] = min(sizes[i], max(0, available // (len(values) - n)))
+        available -= limits[i]
+    for i, value in enumerate(values):
+        if sizes[i] > limits[i]:
+            parts[2 * i + 1] = truncate_text(value, limits[i], model)
+    return "".join(parts)
+
+
+# Build a prompt from an indented `template` with str.format fields. The
+# template is compacted and the values are stripped before they are filled
+# in. If the prompt exceeds the stage's budget, the value named by
+# `digest_key` is replaced by its section digest, or, when it is form content
+# with the field labels `digest_labels`, by its shortened fields. Without a
+# `digest_key`, or if the digest still does not fit, ValueError is raised.
+# Logs the token count of the uncompacted prompt next to the one that is sent.
+def build_prompt(stage, template, model=None, digest_key=None, digest_labels=None, **values):
+    values = {key: str(value).strip() for key, value in values.items()}
+    before = count_tokens(template.format(**values), model)
+    compact = compact_template(template)
+    prompt = compact.format(**values)
+    after = count_tokens(prompt, model)
+
+    budget = PROMPT_BUDGETS.get(stage)
+    note = ""
+    if budget is not None and after > budget:
+        if digest_key is None:
+            raise ValueError(f"Prompt for stage '{stage}' has {after} tokens, over its budget of {budget}")
+        overhead = after - count_tokens(values[digest_key], model)
+        if digest_labels:
+            values[digest_key] = digest_fields(values[digest_key], budget - overhead, digest_labels, model)
+        else:
+            values[digest_key] = digest_document(values[digest_key], budget - overhead, model)
+        prompt = compact.format(**values)
+        after = count_tokens(prompt, model)
+        if after > budget:
+            raise ValueError(f"Prompt for stage '{stage}' has {after} tokens after digesting, over its budget of {budget}")
+        note = f", {digest_key} digested"
+
+    print(f"Prompt tokens ({stage}): {before} -> {after}" + (f" of {budget}" if budget is not None else "") + note)
+    return prompt
@@ -0,0 +1,181 @@
+import difflib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Durable history of generated case studies. Every finished run is stored
+# once under the hash of its content (inputs and outputs), as a
+# zlib-compressed JSON blob. The columns needed to list and group runs are
+# kept outside the blob and indexed, so listing the history or finding the
+# earlier versions of a case study never decompresses anything. Runs are
+# listed per owner (one browser of the app), so nobody sees the case studies
+# other people generated; a run is only shown to someone else who has its ID.
+
+RESULT_STORE_PATH = os.getenv(
+    "RESULT_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".results.sqlite3")
+)
+
+# Parts of a pipeline result that are stored with each run
+STORED_RESULT_KEYS = ("draft", "sections", "references", "final_case_study", "review_questions", "metrics")
+
+
+def content_hash(value):
+    canonical = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# Runs with the same (case-insensitive, whitespace-normalized) title are
+# treated as versions of one case study
+def title_key(title):
+    return " ".join((title or "").lower().split())
+
+
+class ResultStore:
+    def __init__(self, path=RESULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                id TEXT PRIMARY KEY,
+                input_hash TEXT NOT NULL,
+                title_key TEXT NOT NULL,
+                title TEXT NOT NULL,
+                author TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                total_time REAL,
+                cost_usd REAL,
+                payload BLOB NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS runs_created_at ON runs (created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS runs_title ON runs (title_key, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS runs_input ON runs (input_hash, created_at)")
+        # Who generated each run. Identical runs share one row in `runs`, but
+        # are listed in the history of every owner that generated them.
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS run_owners (
+                owner TEXT NOT NULL,
+                run_id TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (owner, run_id)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS run_owners_created_at ON run_owners (owner, created_at)")
+
+    # Store a run for `owner` and return its ID. Saving the same inputs and
+    # outputs again returns the existing ID without writing a second copy.
+    def save(self, fields, result, owner=None):
+        payload = {"fields": fields, **{key: result.get(key) for key in STORED_RESULT_KEYS}}
+        run_id = content_hash({key: value for key, value in payload.items() if key != "metrics"})
+        metrics = result.get("metrics") or {}
+        blob = zlib.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO runs "
+                "(id, input_hash, title_key, title, author, created_at, total_time, cost_usd, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id,
+                    content_hash(fields),
+                    title_key(fields.get("case_study_title")),
+                    fields.get("case_study_title") or "",
+                    fields.get("author_name") or "",
+                    time.time(),
+                    metrics.get("total_time"),
+                    (metrics.get("totals") or {}).get("cost_usd"),
+                    blob,
+                )
+            )
+            if owner:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO run_owners (owner, run_id, created_at) VALUES (?, ?, ?)",
+                    (owner, run_id, time.time())
+                )
+        return run_id
+
+    # The stored run with its fields, outputs and summary columns, or None
+    def get(self, run_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, title, author, created_at, total_time, cost_usd, payload FROM runs WHERE id = ?",
+                (run_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        run = self._summary(row[:6])
+        run.update(json.loads(zlib.decompress(row[6]).decode("utf-8")))
+        return run
+
+    # Most recent runs of `owner` first, without their content. Pass the
+    # `created_at` of the last run of a page as `before` to get the next page.
+    def history(self, owner, limit=20, before=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT runs.id, title, author, run_owners.created_at, total_time, cost_usd "
+                "FROM run_owners JOIN runs ON runs.id = run_owners.run_id "
+                "WHERE owner = ? AND run_owners.created_at < ? ORDER BY run_owners.created_at DESC LIMIT ?",
+                (owner, before if before is not None else float("inf"), limit)
+            ).fetchall()
+        return [self._summary(row) for row in rows]
+
+    # Other versions of a run's case study among the runs of `owner` (same
+    # title and author), newest first
+    def versions(self, run_id, owner, limit=20):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT runs.id, title, author, run_owners.created_at, total_time, cost_usd "
+                "FROM run_owners JOIN runs ON runs.id = run_owners.run_id "
+                "WHERE owner = ? AND runs.id != ? "
+                "AND (title_key, author) = (SELECT title_key, author FROM runs WHERE id = ?) "
+                "ORDER BY run_owners.created_at DESC LIMIT ?",
+                (owner, run_id, run_id, limit)
+            ).fetchall()
+        return [self._summary(row) for row in rows]
+
+    def delete(self, run_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM run_owners WHERE run_id = ?", (run_id,))
+            self._conn.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _summary(row):
+        run_id, title, author, created_at, total_time, cost_usd = row
+        return {
+            "id": run_id,
+            "title": title,
+            "author": author,
+            "created_at": created_at,
+            "total_time": total_time,
+            "cost_usd": cost_usd,
+        }
+
+
+# Unified diff of two texts, line by line
+def diff_texts(old, new, old_label="earlier version", new_label="this version"):
+    return "\n".join(difflib.unified_diff(
+        (old or "").splitlines(),
+        (new or "").splitlines(),
+        fromfile=old_label,
+        tofile=new_label,
+        lineterm=""
+    ))
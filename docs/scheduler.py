@@ -0,0 +1,332 @@
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from metrics import note_queue_time, note_retry, registry
+
+# Process-wide scheduler every OpenAI request goes through. Requests for a
+# model wait for capacity in that model's request and token buckets; waiting
+# requests are served by priority (interactive before batch) and then in
+# arrival order. Rate-limit and transient errors are retried with jittered
+# exponential backoff that honours the Retry-After header.
+#
+# Priority only decides which waiting request goes next, so it only takes
+# effect while requests wait: when RATE_LIMITS has an entry for the model
+# and its buckets run dry, or during the pause after a 429. Without either,
+# every request is sent at once whatever its priority, and batch work
+# (speculative drafts, batch runs) competes with interactive jobs for the
+# account's real limits.
+
+INTERACTIVE = 0
+BATCH = 1
+
+# Per-model limits to enforce locally, e.g. RATE_LIMITS='{"gpt-4.1": {"rpm": 500, "tpm": 30000}}'
+# with the limits of your account tier. Off by default: models without an
+# entry are not throttled locally, only back off when the API answers 429,
+# and give interactive requests no head start over batch ones.
+RATE_LIMITS = json.loads(os.getenv("RATE_LIMITS", "{}"))
+
+SCHEDULER_MAX_RETRIES = int(os.getenv("SCHEDULER_MAX_RETRIES", "5"))
+SCHEDULER_BACKOFF_BASE = float(os.getenv("SCHEDULER_BACKOFF_BASE", "1.0"))
+SCHEDULER_BACKOFF_MAX = float(os.getenv("SCHEDULER_BACKOFF_MAX", "60"))
+
+# Completion tokens assumed for a request that does not set max_tokens
+DEFAULT_COMPLETION_ESTIMATE = 1000
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+# Token bucket refilled continuously at `per_minute` units per minute
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `amount` units are available (0 if they are now)
+    def time_until(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    # Take units out; the balance may go negative when usage exceeded the estimate
+    def consume(self, amount):
+        self.available -= amount
+
+
+class ModelLimits:
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+
+    def time_until(self, tokens):
+        now = time.monotonic()
+        wait = max(0.0, self.paused_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.time_until(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.time_until(tokens, now))
+        return wait
+
+    def consume(self, tokens):
+        if self.requests is not None:
+            self.requests.consume(1)
+        if self.tokens is not None:
+            self.tokens.consume(tokens)
+
+
+# Rough token count of a request: prompt characters / 4 plus the completion allowance
+def estimate_request_tokens(request):
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in request.get("messages", []))
+    completion = request.get("max_completion_tokens") or request.get("max_tokens") or DEFAULT_COMPLETION_ESTIMATE
+    return prompt_chars // 4 + completion
+
+
+def error_status(error):
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+
+# Seconds the server asked us to wait, from Retry-After / retry-after-ms
+def retry_after_seconds(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass  # HTTP-date form or garbage; fall back to our own backoff
+    return None
+
+
+def is_retryable(error):
+    if error_status(error) in RETRYABLE_STATUS_CODES:
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        import openai
+    except ImportError:
+        return False
+    return isinstance(error, (openai.APIConnectionError, openai.APITimeoutError))
+
+
+class RequestScheduler:
+    def __init__(self, rate_limits=RATE_LIMITS, max_retries=SCHEDULER_MAX_RETRIES,
+                 backoff_base=SCHEDULER_BACKOFF_BASE, backoff_max=SCHEDULER_BACKOFF_MAX):
+        self.rate_limits = rate_limits
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._limits = {}
+        self._queues = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.completed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def _limits_for(self, model):
+        if model not in self._limits:
+            config = self.rate_limits.get(model, {})
+            self._limits[model] = ModelLimits(config.get("rpm"), config.get("tpm"))
+        return self._limits[model]
+
+    # Block until the request may be sent. Returns the seconds spent waiting.
+    def acquire(self, model, tokens, priority=INTERACTIVE):
+        start = time.monotonic()
+        with self._cond:
+            limits = self._limits_for(model)
+            queue = self._queues.setdefault(model, [])
+            ticket = (priority, next(self._seq))
+            heapq.heappush(queue, ticket)
+            try:
+                while True:
+                    wait = None
+                    if queue[0] == ticket:
+                        wait = limits.time_until(tokens)
+                        if wait <= 0:
+                            heapq.heappop(queue)
+                            limits.consume(tokens)
+                            self.in_flight += 1
+                            self._cond.notify_all()
+                            return time.monotonic() - start
+                    self._cond.wait(timeout=wait)
+            except BaseException:
+                if ticket in queue:
+                    queue.remove(ticket)
+                    heapq.heapify(queue)
+                    self._cond.notify_all()
+                raise
+
+    def release(self, model, estimated_tokens, used_tokens=None):
+        with self._cond:
+            self.in_flight -= 1
+            limits = self._limits_for(model)
+            # Settle the difference between the estimate and the real usage
+            if used_tokens is not None and limits.tokens is not None:
+                limits.tokens.consume(used_tokens - estimated_tokens)
+            self._cond.notify_all()
+
+    # Hold back every request for `model`, e.g. after a 429 with Retry-After
+    def pause(self, model, seconds):
+        with self._cond:
+            limits = self._limits_for(model)
+            limits.paused_until = max(limits.paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def backoff_delay(self, attempt, retry_after=None):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    # Run `send()` under the limits of `model`, retrying rate-limit and
+    # transient errors. Other errors, or the last one after max_retries,
+    # are raised to the caller. A `stream` holds its slot until it has been
+    # read to the end, and its reservation is settled with the usage in its
+    # last chunk.
+    def call(self, send, model, estimated_tokens, priority=INTERACTIVE, stream=False):
+        attempt = 0
+        while True:
+            note_queue_time(self.acquire(model, estimated_tokens, priority))
+            used_tokens = None
+            try:
+                response = send()
+                usage = getattr(response, "usage", None)
+                if usage is not None and getattr(usage, "total_tokens", None):
+                    used_tokens = usage.total_tokens
+            except Exception as e:
+                self.release(model, estimated_tokens)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    with self._cond:
+                        self.failed += 1
+                    raise
+                retry_after = retry_after_seconds(e)
+                delay = self.backoff_delay(attempt, retry_after)
+                with self._cond:
+                    self.retries += 1
+                    if error_status(e) == 429:
+                        self.rate_limited += 1
+                note_retry()
+                print(f"Retrying {model} request in {delay:.1f}s after error: {e}")
+                if error_status(e) == 429:
+                    # Hold back every request for this model, not just this one
+                    self.pause(model, delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
+                continue
+            if stream:
+                return self._settle_stream(model, estimated_tokens, response)
+            self.release(model, estimated_tokens, used_tokens)
+            with self._cond:
+                self.completed += 1
+            return response
+
+    def _settle_stream(self, model, estimated_tokens, stream):
+        used_tokens = None
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None and getattr(usage, "total_tokens", None):
+                    used_tokens = usage.total_tokens
+                yield chunk
+        finally:
+            self.release(model, estimated_tokens, used_tokens)
+            with self._cond:
+                self.completed += 1
+
+    def queue_depth(self, priority=None):
+        with self._cond:
+            return sum(
+                1 for queue in self._queues.values() for ticket in queue
+                if priority is None or ticket[0] == priority
+            )
+
+    def stats(self):
+        with self._cond:
+            queued = {model: len(queue) for model, queue in self._queues.items() if queue}
+            return {
+                "queued": sum(queued.values()),
+                "queued_by_model": queued,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "failed": self.failed,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# The scheduler shared by every client in this process
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+            registry.register_gauge(
+                "casestudy_scheduler_queue_depth", "Requests waiting for rate-limit capacity.",
+                _scheduler.queue_depth
+            )
+            registry.register_gauge(
+                "casestudy_scheduler_interactive_queue_depth", "Interactive requests waiting for capacity.",
+                lambda: _scheduler.queue_depth(INTERACTIVE)
+            )
+            registry.register_gauge(
+                "casestudy_scheduler_batch_queue_depth", "Batch requests waiting for capacity.",
+                lambda: _scheduler.queue_depth(BATCH)
+            )
+            registry.register_gauge(
+                "casestudy_scheduler_in_flight", "Requests currently being sent.",
+                lambda: _scheduler.in_flight
+            )
+            registry.register_gauge(
+                "casestudy_scheduler_rate_limited", "429 responses received since start.",
+                lambda: _scheduler.rate_limited
+            )
+        return _scheduler
+
+
+# Wraps an OpenAI client so that every chat completion goes through the scheduler
+class ScheduledClient:
+    def __init__(self, client, scheduler=None, priority=INTERACTIVE):
+        self.client = client
+        self.scheduler = scheduler or get_scheduler()
+        self.priority = priority
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    # The same wrapper around another client, e.g. a routed backend's
+    def rewrap(self, client):
+        return ScheduledClient(client, scheduler=self.scheduler, priority=self.priority)
+
+    def create(self, **request):
+        return self.scheduler.call(
+            lambda: self.client.chat.completions.create(**request),
+            request.get("model"),
+            estimate_request_tokens(request),
+            self.priority,
+            stream=bool(request.get("stream"))
+        )
@@ -0,0 +1,379 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from citations import extract_placeholders
+from form_schema import PROMPT_LABELS
+from generation import DRAFT_MODEL, chat_completion, stream_chat_completion
+from metrics import submit_in_context, track_stage
+from prompts import build_prompt
+
+# Section-by-section drafting. Every non-empty section of the form is
+# written by its own request, and the section's own inputs (heading,
+# content, model and prompt version) are fingerprinted. When the form is
+# submitted again, sections whose fingerprint is unchanged reuse their
+# earlier text and citations, so editing, filling in or clearing one field
+# only regenerates that field's section and only searches for the citation
+# placeholders that section introduces. The section's place in the case
+# study is left out of the fingerprint: in sequential mode each prompt names
+# its neighbours so the sections read as one narrative, and a reused
+# section keeps the transitions it was written with. In parallel mode the
+# sections are drafted at once, so the draft takes about as long as its
+# slowest section, and a short stitching pass then writes a transition
+# sentence between neighbouring sections instead of the sections bridging
+# to each other themselves.
+
+# How the draft is written:
+#   "parallel" - one request per section, all sent at once, followed by a stitching
+#                pass; unchanged sections are reused
+#   "sections" - the same requests one after the other, each section streaming
+#                in order; unchanged sections are reused
+#   "single"   - the whole case study in one request
+# Parallel is the default: a first generation takes about as long as its
+# slowest section, and a resubmitted form still only redrafts what changed.
+DRAFT_MODE = os.getenv("DRAFT_MODE", "parallel")
+
+DRAFT_MODES = ("sections", "parallel", "single")
+
+# Sections drafted at once in parallel mode
+SECTION_CONCURRENCY = int(os.getenv("SECTION_CONCURRENCY", "8"))
+
+# Model writing the transitions between sections in parallel mode
+STITCH_MODEL = os.getenv("STITCH_MODEL", DRAFT_MODEL)
+
+# Characters of each side of a section boundary shown to the stitching pass
+STITCH_CONTEXT_CHARS = 400
+
+# Bump when the section prompt changes so earlier section drafts are not reused
+SECTION_PROMPT_VERSION = 3
+
+SECTION_TEMPLATE = """
+    Write section {position} of {total} of a case study in APA 7th edition format about AI implementation in an educational context, based on the following information.
+
+    {title}
+    {content}
+
+    {opening}
+    {closing}
+
+    Format guidelines:
+    - Write in a flowing academic narrative style
+    - Do NOT include the section heading or any subheadings; the heading is added separately
+    - Only cover the information provided for this section
+    - Create placeholder for citations for any academic claim.
+    - The tone should be academic but accessible, with a focus on practical insights
+
+    When you need to include a citation, use the format (placeholder: topic) where "topic" briefly describes what the citation is about. For example, (placeholder: AI bias in education) or (placeholder: learning analytics).
+    """
+
+TRANSITION_TEMPLATE = """
+    The sections of a case study about AI implementation in an educational context were written separately. For each boundary below, write one sentence that opens the second section and carries the narrative on from the end of the first.
+
+    {boundaries}
+
+    Important instructions:
+    - Answer with one line per boundary in the form "N. sentence"
+    - Each sentence must read naturally before the start of the second section
+    - Do not add citations, placeholders or headings
+    """
+
+
+# Prompt for one section. `previous_title` and `next_title` are the headings
+# of the neighbouring non-empty sections (None at either end). With
+# `parallel`, the stitching pass writes the transitions between sections, so
+# the section itself is asked not to bridge to its neighbours.
+def build_section_prompt(title, content, position, total, previous_title=None, next_title=None, parallel=False):
+    if not previous_title:
+        opening = "It opens the case study; begin by setting the scene."
+    elif parallel:
+        opening = f'It follows the section "{previous_title}"; a transition from it is added separately, so begin directly with this section\'s content.'
+    else:
+        opening = f'It follows the section "{previous_title}"; open with a sentence that carries the narrative on from it.'
+    if not next_title:
+        closing = "It closes the case study; end with a concluding thought."
+    elif parallel:
+        closing = f'It is followed by the section "{next_title}"; end with this section\'s own content rather than leading into it.'
+    else:
+        closing = f'It is followed by the section "{next_title}"; end in a way that leads into it.'
+
+    return build_prompt(
+        "section", SECTION_TEMPLATE, model=DRAFT_MODEL, digest_key="content", digest_labels=PROMPT_LABELS,
+        position=position, total=total, title=title, content=content, opening=opening, closing=closing
+    )
+
+
+def build_section_messages(writer_role, prompt):
+    return [
+        {"role": "developer", "content": writer_role},
+        {"role": "user", "content": prompt}
+    ]
+
+
+# Fingerprint of a section's own inputs. Its position and neighbours are
+# left out, so adding or removing another section does not invalidate it.
+def section_fingerprint(model, writer_role, title, content, parallel=False):
+    canonical = json.dumps(
+        {
+            "version": SECTION_PROMPT_VERSION, "model": model, "role": writer_role,
+            "title": title, "content": content, "parallel": parallel,
+        },
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# One section of the draft. `citations` maps the normalized placeholder
+# topics of `text` to their resolved citation info once citations are known.
+# `transition` is the sentence the stitching pass put before the section,
+# coming from the section with fingerprint `transition_from`.
+class SectionDraft:
+    def __init__(self, title, fingerprint, messages, text=None, citations=None, transition=None,
+                 transition_from=None):
+        self.title = title
+        self.fingerprint = fingerprint
+        self.messages = messages
+        self.text = text
+        self.citations = citations or {}
+        self.transition = transition
+        self.transition_from = transition_from
+        self.reused = text is not None
+        self.draft_time = 0.0
+
+    def to_dict(self):
+        return {
+            "title": self.title,
+            "fingerprint": self.fingerprint,
+            "text": self.text,
+            "citations": self.citations,
+            "transition": self.transition,
+            "transition_from": self.transition_from,
+        }
+
+
+# Work out the sections to draft from `section_content` (heading -> content
+# of the non-empty sections, in order). Sections whose fingerprint matches one
+# in `previous` (the "sections" of an earlier result) come back with their
+# text and citations filled in, wherever they now are in the case study; the
+# rest still need to be generated. `parallel` plans the prompts of parallel
+# mode, whose fingerprints differ.
+def plan_sections(section_content, writer_role, previous=None, model=DRAFT_MODEL, parallel=False):
+    earlier = {section["fingerprint"]: section for section in previous or []}
+    titles = list(section_content)
+    plan = []
+    for i, title in enumerate(titles):
+        prompt = build_section_prompt(
+            title,
+            section_content[title],
+            i + 1,
+            len(titles),
+            titles[i - 1] if i > 0 else None,
+            titles[i + 1] if i + 1 < len(titles) else None,
+            parallel=parallel
+        )
+        messages = build_section_messages(writer_role, prompt)
+        fingerprint = section_fingerprint(model, writer_role, title, section_content[title], parallel)
+        match = earlier.get(fingerprint)
+        if match is not None:
+            plan.append(SectionDraft(
+                title, fingerprint, messages, match["text"], match.get("citations"), match.get("transition"),
+                match.get("transition_from")
+            ))
+        else:
+            plan.append(SectionDraft(title, fingerprint, messages))
+    return plan
+
+
+def section_heading(title):
+    return f"## {title}\n\n"
+
+
+# Join the section drafts into one case study, in form order
+def stitch_sections(sections):
+    return "\n\n".join(
+        section_heading(section.title)
+        + (f"{section.transition.strip()} " if section.transition else "")
+        + section.text.strip()
+        for section in sections
+    )
+
+
+# Passes section text to `on_token` and `on_generated` in document order
+# while sections may be drafted concurrently: the first unfinished section
+# streams live, later sections are held back until every section before them
+# is complete. Reused sections are only passed to `on_token`.
+class OrderedSectionOutput:
+    def __init__(self, plan, on_token=None, on_generated=None):
+        self.plan = plan
+        self.on_token = on_token
+        self.on_generated = on_generated
+        self.first_output_at = None
+        self._parts = [[] for _ in plan]
+        self._sent = [0] * len(plan)
+        self._done = [False] * len(plan)
+        self._head = 0
+        self._heading_sent = False
+        self._lock = threading.Lock()
+
+    def feed(self, index, text):
+        with self._lock:
+            self._parts[index].append(text)
+            self._release()
+
+    def finish(self, index):
+        with self._lock:
+            self._done[index] = True
+            self._release()
+
+    def _release(self):
+        while self._head < len(self.plan):
+            i = self._head
+            section = self.plan[i]
+            if not self._heading_sent:
+                self._emit(("\n\n" if i else "") + section_heading(section.title))
+                self._heading_sent = True
+            for part in self._parts[i][self._sent[i]:]:
+                self._emit(part)
+                if not section.reused:
+                    if self.first_output_at is None:
+                        self.first_output_at = time.perf_counter()
+                    if self.on_generated is not None:
+                        self.on_generated(part)
+            self._sent[i] = len(self._parts[i])
+            if not self._done[i]:
+                return
+            self._head += 1
+            self._heading_sent = False
+
+    def _emit(self, text):
+        if self.on_token is not None:
+            self.on_token(text)
+
+
+# Generate the text of every section in `plan` that is not reused, one after
+# the other or, with `parallel`, up to `max_concurrency` at once followed by
+# the stitching pass. `on_token` sees the whole case study as it is stitched:
+# headings, reused sections at once and new sections token by token.
+# `on_generated` only sees newly generated text, e.g. to search for its new
+# placeholders. Returns draft timings in the shape of stream_chat_completion's,
+# plus the time spent on each section and on stitching.
+def draft_sections(client, plan, on_token=None, on_generated=None, stream=True, model=DRAFT_MODEL,
+                   parallel=False, max_concurrency=SECTION_CONCURRENCY):
+    start = time.perf_counter()
+    output = OrderedSectionOutput(plan, on_token, on_generated)
+
+    def draft(index):
+        section = plan[index]
+        section_start = time.perf_counter()
+        with track_stage(f"section: {section.title}"):
+            if stream:
+                section.text, _ = stream_chat_completion(
+                    client, model, section.messages, on_token=lambda token: output.feed(index, token)
+                )
+            else:
+                section.text, _ = chat_completion(client, model, section.messages)
+                output.feed(index, section.text)
+        section.draft_time = time.perf_counter() - section_start
+        output.finish(index)
+
+    for i, section in enumerate(plan):
+        if section.reused:
+            output.feed(i, section.text.strip())
+            output.finish(i)
+
+    if not parallel:
+        # Transitions only exist in parallel mode
+        for section in plan:
+            section.transition = section.transition_from = None
+
+    pending = [i for i, section in enumerate(plan) if not section.reused]
+    if parallel and len(pending) > 1:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pending))),
+                                thread_name_prefix="section") as executor:
+            futures = [submit_in_context(executor, draft, i) for i in pending]
+            for future in futures:
+                future.result()
+    else:
+        for i in pending:
+            draft(i)
+
+    stitch_time = 0.0
+    if parallel:
+        stitch_start = time.perf_counter()
+        with track_stage("stitch"):
+            write_transitions(client, plan)
+        stitch_time = time.perf_counter() - stitch_start
+
+    total_time = time.perf_counter() - start
+    section_times = [section.draft_time for section in plan if not section.reused]
+    return {
+        "time_to_first_token": output.first_output_at - start if output.first_output_at is not None else total_time,
+        "total_time": total_time,
+        "slowest_section": max(section_times, default=0.0),
+        "sections_total": sum(section_times),
+        "stitch_time": stitch_time,
+    }
+
+
+def build_transition_prompt(boundaries, model=STITCH_MODEL):
+    blocks = "\n\n".join(
+        f'''Boundary {n}:
+End of "{before.title}": ...{before.text.strip()[-STITCH_CONTEXT_CHARS:]}
+Start of "{after.title}": {after.text.strip()[:STITCH_CONTEXT_CHARS]}...'''
+        for n, (before, after) in enumerate(boundaries, 1)
+    )
+    return build_prompt("stitch", TRANSITION_TEMPLATE, model=model, boundaries=blocks)
+
+
+# Stitching pass of parallel mode: ask for a transition sentence at every
+# section boundary that has a newly drafted side or new neighbours.
+# Transitions between two reused sections that were already neighbours are
+# kept. If the answer cannot be parsed, the affected sections are simply
+# joined without a transition.
+def write_transitions(client, plan, model=STITCH_MODEL):
+    boundaries = []
+    for before, after in zip(plan, plan[1:]):
+        if before.reused and after.reused and after.transition and after.transition_from == before.fingerprint:
+            continue
+        after.transition = None
+        after.transition_from = before.fingerprint
+        boundaries.append((before, after))
+    if plan:
+        plan[0].transition = plan[0].transition_from = None
+    if not boundaries:
+        return
+
+    try:
+        messages = [{"role": "user", "content": build_transition_prompt(boundaries, model)}]
+        answer, _ = chat_completion(client, model, messages)
+    except Exception as e:
+        print(f"Error writing section transitions, joining sections without them: {str(e)}")
+        return
+
+    transitions = {}
+    for line in answer.splitlines():
+        match = re.match(r"^\s*(\d+)[.:)]\s*(.+?)\s*$", line)
+        if match:
+            transitions[int(match.group(1))] = match.group(2)
+    for n, (_, after) in enumerate(boundaries, 1):
+        after.transition = transitions.get(n)
+    print(f"Stitched {len(boundaries)} section boundaries, {len(transitions)} transitions written")
+
+
+# Attach to each section the resolved citations of the placeholders in its text
+def assign_section_citations(plan, resolved):
+    for section in plan:
+        topics = extract_placeholders(section.text or "").topics
+        section.citations = {key: resolved[key] for key in topics if key in resolved}
+
+
+# Citations already known from reused sections, {normalized_topic: citation_info}
+def carried_citations(plan):
+    carried = {}
+    for section in plan:
+        if section.reused:
+            carried.update(section.citations)
+    return carried
@@ -0,0 +1,342 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from types import SimpleNamespace
+
+from backends import route_client
+from citations import extract_placeholders, resolve_placeholders
+from completion_cache import CachedClient
+from generation import DRAFT_MODEL, chat_completion
+from metrics import MeteredClient, RunMetrics, registry, track_stage
+from pipeline import WRITER_ROLE, build_section_content, missing_required_fields, section_has_content
+from scheduler import BATCH, ScheduledClient
+from sections import DRAFT_MODE, plan_sections
+
+# Speculative drafting of sections while the form is still being filled in.
+# Once every required field has a value, each section whose inputs have not
+# changed for SPECULATIVE_SETTLE_SECONDS is drafted in the background, and
+# the citations of its placeholders are looked up. On submit, the finished
+# drafts are handed to the pipeline like the sections of an earlier result,
+# so every section whose fingerprint still matches is reused instead of
+# drafted again. Drafts still running at submit are handed over to the
+# generation job, which waits for them before drafting, and a draft only
+# counts as used once the job's pipeline has actually reused it. The
+# single-request draft mode has no sections to reuse, so nothing is drafted
+# ahead in it.
+#
+# A section's fingerprint covers only its own inputs, but its prompt names
+# its neighbours, so drafts are written for the layout the form is expected
+# to end up with: the sections filled in so far plus every section after
+# them. A draft whose inputs change before submit, or that does not match
+# the submitted form, is wasted. Its API calls are counted, and a
+# session stops speculating once SPECULATIVE_MAX_WASTED_CALLS calls have been
+# wasted. Speculative requests run at batch priority, but the scheduler only
+# orders requests that have to wait: without RATE_LIMITS for the model (and
+# outside a 429 pause) they are sent at once, alongside the generation jobs'
+# requests. Set RATE_LIMITS to keep drafting ahead from competing with jobs.
+
+# Draft sections ahead of submit by default ("1"); each session can opt in or out
+SPECULATIVE_DRAFTING = os.getenv("SPECULATIVE_DRAFTING", "0") == "1"
+
+# Seconds a section's inputs must stay unchanged before it is drafted
+SPECULATIVE_SETTLE_SECONDS = float(os.getenv("SPECULATIVE_SETTLE_SECONDS", "10"))
+
+# Wasted API calls after which a session stops drafting ahead
+SPECULATIVE_MAX_WASTED_CALLS = int(os.getenv("SPECULATIVE_MAX_WASTED_CALLS", "12"))
+
+# Seconds a generation job waits for drafts still running when it starts
+SPECULATIVE_HANDOVER_TIMEOUT = float(os.getenv("SPECULATIVE_HANDOVER_TIMEOUT", "60"))
+
+# Speculative sections drafted at once across all sessions
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "2"))
+
+
+# Sections the submitted form is expected to have, heading -> content: the
+# sections with content, plus every section after the last of them, assuming
+# the form is filled in from top to bottom. Sections left empty above the
+# last filled one are expected to stay empty.
+def expected_section_content(fields):
+    section_content = build_section_content(fields)
+    filled = [i for i, content in enumerate(section_content.values()) if section_has_content(content)]
+    last = max(filled, default=-1)
+    return {
+        title: content for i, (title, content) in enumerate(section_content.items())
+        if i > last or section_has_content(content)
+    }
+
+
+# One section drafted ahead of submit. `calls` is the number of API calls it
+# made, counted once it has finished.
+class SpeculativeDraft:
+    def __init__(self, section):
+        self.section = section
+        self.future = None
+        self.calls = 0
+
+
+# Client wrapper counting the completions that were not served from the
+# cache. Copies made with rewrap() count into the same total.
+class CallCounter:
+    def __init__(self, client, total=None):
+        self.client = client
+        self.calls = 0
+        self.total = total or self
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def rewrap(self, client):
+        return CallCounter(client, total=self.total)
+
+    def create(self, **request):
+        response = self.client.chat.completions.create(**request)
+        if not getattr(response, "cached", False):
+            total = self.total
+            with total._lock:
+                total.calls += 1
+        return response
+
+
+# Worker pool drafting sections for every session, with process-wide totals
+# of speculative calls and how many of them were wasted. `client` is the raw
+# OpenAI client.
+class SpeculationManager:
+    def __init__(self, client, completion_cache=None, citation_cache=None, max_workers=SPECULATIVE_WORKERS):
+        self.client = client
+        self.completion_cache = completion_cache
+        self.citation_cache = citation_cache
+        self.calls = 0
+        self.wasted_calls = 0
+        self.sections_used = 0
+        self.sections_wasted = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        registry.register_gauge(
+            "casestudy_speculative_calls_total", "API calls made drafting sections ahead of submit.",
+            lambda: self.calls
+        )
+        registry.register_gauge(
+            "casestudy_speculative_wasted_calls_total", "Speculative API calls whose drafts were never used.",
+            lambda: self.wasted_calls
+        )
+        registry.register_gauge(
+            "casestudy_speculative_sections_used_total", "Speculative section drafts reused on submit.",
+            lambda: self.sections_used
+        )
+        registry.register_gauge(
+            "casestudy_speculative_sections_wasted_total", "Speculative section drafts thrown away.",
+            lambda: self.sections_wasted
+        )
+
+    # Speculation state of one browser session
+    def session(self, settle_seconds=SPECULATIVE_SETTLE_SECONDS, max_wasted_calls=SPECULATIVE_MAX_WASTED_CALLS,
+                draft_mode=DRAFT_MODE):
+        return Speculator(self, settle_seconds=settle_seconds, max_wasted_calls=max_wasted_calls, draft_mode=draft_mode)
+
+    # Queue the draft of a planned section
+    def submit(self, section):
+        draft = SpeculativeDraft(section)
+        draft.future = self._executor.submit(self._run, draft)
+        return draft
+
+    def _run(self, draft):
+        section = draft.section
+        # Same wrapping as a generation job, but queued behind the jobs' requests.
+        # The run metrics are not exported; they only give the requests their
+        # stage, so they are routed like the job's.
+        counter = CallCounter(CachedClient(ScheduledClient(self.client, priority=BATCH), self.completion_cache))
+        client = route_client(MeteredClient(counter))
+        try:
+            with RunMetrics(speculative=True).activate():
+                with track_stage(f"section: {section.title}"):
+                    section.text, _ = chat_completion(client, DRAFT_MODEL, section.messages)
+                scan = extract_placeholders(section.text)
+                resolved = resolve_placeholders(client, scan, cache=self.citation_cache) if scan.total else {}
+                section.citations = {key: resolved[key] for key in scan.topics if key in resolved}
+        finally:
+            draft.calls = counter.calls
+            with self._lock:
+                self.calls += draft.calls
+        print(f"Drafted section '{section.title}' ahead of submit with {draft.calls} API calls")
+        return section.to_dict()
+
+    def note_used(self, count):
+        with self._lock:
+            self.sections_used += count
+
+    def note_wasted(self, draft):
+        with self._lock:
+            self.wasted_calls += draft.calls
+            self.sections_wasted += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "wasted_calls": self.wasted_calls,
+                "sections_used": self.sections_used,
+                "sections_wasted": self.sections_wasted,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+# Speculative drafts of one session, keyed by section fingerprint. observe()
+# is called with the form values whenever they may have changed, claim() on
+# submit. Sessions drafting in `draft_mode` "single" never speculate.
+class Speculator:
+    def __init__(self, manager, settle_seconds=SPECULATIVE_SETTLE_SECONDS, max_wasted_calls=SPECULATIVE_MAX_WASTED_CALLS,
+                 draft_mode=DRAFT_MODE):
+        self.manager = manager
+        self.settle_seconds = settle_seconds
+        self.max_wasted_calls = max_wasted_calls
+        self.draft_mode = draft_mode
+        self.wasted_calls = 0
+        self._seen = {}
+        self._drafts = {}
+        self._submitted = set()
+        self._lock = threading.Lock()
+
+    # Whether this session has wasted its allowance of speculative calls
+    @property
+    def exhausted(self):
+        with self._lock:
+            return self.wasted_calls >= self.max_wasted_calls
+
+    # Drafts finished and still in progress, for display
+    def counts(self):
+        with self._lock:
+            drafts = list(self._drafts.values())
+        ready = sum(1 for draft in drafts if draft.future.done() and not draft.future.cancelled()
+                    and draft.future.exception() is None)
+        return ready, sum(1 for draft in drafts if not draft.future.done())
+
+    # Note the current form values. Drafts the values no longer match are
+    # discarded, and settled sections without a draft are queued, unless
+    # their fingerprint is in `known` (sections of the result on screen) or
+    # was part of a form already submitted.
+    def observe(self, fields, known=(), now=None):
+        now = time.time() if now is None else now
+        if self.draft_mode == "single" or missing_required_fields(fields):
+            return
+        section_content = expected_section_content(fields)
+        for title, content in section_content.items():
+            seen = self._seen.get(title)
+            if seen is None or seen[0] != content:
+                self._seen[title] = (content, now)
+        plan = plan_sections(section_content, WRITER_ROLE, parallel=self.draft_mode == "parallel")
+        current = {section.fingerprint for section in plan}
+
+        with self._lock:
+            stale = [fingerprint for fingerprint in self._drafts if fingerprint not in current]
+            discarded = [self._drafts.pop(fingerprint) for fingerprint in stale]
+        for draft in discarded:
+            self._discard(draft)
+
+        if self.exhausted:
+            return
+        for section in plan:
+            content, since = self._seen[section.title]
+            if not section_has_content(content) or now - since < self.settle_seconds:
+                continue
+            if section.fingerprint in known:
+                continue
+            with self._lock:
+                if section.fingerprint not in self._drafts and section.fingerprint not in self._submitted:
+                    self._drafts[section.fingerprint] = self.manager.submit(section)
+
+    # Hand the drafts that match the submitted `fields`, finished or still
+    # running, to the generation job as a SpeculativeClaim (None if there
+    # are none). Every other draft is discarded; the submitted sections are
+    # drafted by the job and not speculated on again.
+    def claim(self, fields):
+        section_content = {
+            title: content for title, content in build_section_content(fields).items()
+            if section_has_content(content)
+        }
+        wanted = {
+            section.fingerprint
+            for section in plan_sections(section_content, WRITER_ROLE, parallel=self.draft_mode == "parallel")
+        }
+        with self._lock:
+            drafts = list(self._drafts.values())
+            self._drafts = {}
+            self._submitted = wanted
+
+        claimed = []
+        for draft in drafts:
+            future = draft.future
+            failed = future.done() and (future.cancelled() or future.exception() is not None)
+            if draft.section.fingerprint in wanted and not failed:
+                claimed.append(draft)
+            else:
+                self._discard(draft)
+        if drafts:
+            print(f"Handing {len(claimed)} of {len(drafts)} speculative section drafts to the generation job")
+        return SpeculativeClaim(self, claimed) if claimed else None
+
+    # Discard every draft, e.g. when the session opts out
+    def reset(self):
+        with self._lock:
+            drafts = list(self._drafts.values())
+            self._drafts = {}
+            self._seen = {}
+        for draft in drafts:
+            self._discard(draft)
+
+    # Drop a draft: one still queued is cancelled for free, the calls of one
+    # already running are counted as wasted once it finishes
+    def _discard(self, draft):
+        if draft.future.cancel():
+            return
+        draft.future.add_done_callback(lambda _: self._waste(draft))
+
+    def _waste(self, draft):
+        with self._lock:
+            before = self.wasted_calls
+            self.wasted_calls += draft.calls
+        self.manager.note_wasted(draft)
+        if before < self.max_wasted_calls <= self.wasted_calls:
+            print(f"Speculative drafting stopped after {self.wasted_calls} wasted API calls")
+
+
+# Speculative drafts handed to a generation job. The job takes their
+# sections before drafting, then settles the claim with its result.
+class SpeculativeClaim:
+    def __init__(self, speculator, drafts):
+        self.speculator = speculator
+        self.drafts = drafts
+
+    # Sections of the drafts, as the "sections" of an earlier result, waiting
+    # up to `timeout` seconds for the ones still running. Drafts that do not
+    # finish in time are discarded.
+    def sections(self, timeout=SPECULATIVE_HANDOVER_TIMEOUT):
+        running = [draft.future for draft in self.drafts if not draft.future.done()]
+        if running:
+            print(f"Waiting for {len(running)} speculative section drafts still running")
+            wait(running, timeout=timeout)
+        ready = []
+        for draft in self.drafts:
+            future = draft.future
+            if future.done() and not future.cancelled() and future.exception() is None:
+                ready.append(draft)
+            else:
+                self.speculator._discard(draft)
+        self.drafts = ready
+        return [draft.future.result() for draft in ready]
+
+    # Count the drafts the pipeline reused (their sections are in `result`)
+    # as used and the others as wasted. `result` is None if the job failed.
+    def settle(self, result):
+        reused = {section["fingerprint"] for section in (result or {}).get("sections") or []}
+        used = [draft for draft in self.drafts if draft.section.fingerprint in reused]
+        for draft in self.drafts:
+            if draft not in used:
+                self.speculator._waste(draft)
+        self.speculator.manager.note_used(len(used))
+        self.drafts = []
+        print(f"Reused {len(used)} speculative section drafts")
@@ -0,0 +1,90 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import submit_in_context, track_stage
+
+# How pipeline stages are executed:
+#   "serial"     - one after another, in the order they are declared
+#   "overlapped" - every stage starts as soon as its dependencies are done
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "overlapped")
+
+PIPELINE_MODES = ("serial", "overlapped")
+
+
+# One step of the generation pipeline. `func` receives a dict with the
+# results of the stages that already finished and returns this stage's result.
+class Stage:
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+# Run `stages` (declared in a valid serial order) and return
+# (results, timings). Timings map each stage name to its start offset and
+# duration in seconds, plus "total_time" for the whole graph.
+def run_stages(stages, mode=PIPELINE_MODE, max_workers=None):
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode '{mode}', expected one of {', '.join(PIPELINE_MODES)}")
+
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        unknown = [dep for dep in stage.deps if dep not in names]
+        if unknown:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stage(s): {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    results = {}
+    timings = {}
+
+    def run(stage, inputs, queued_at):
+        stage_start = time.perf_counter()
+        try:
+            with track_stage(stage.name, queued_at=queued_at):
+                return stage.func(inputs)
+        finally:
+            timings[stage.name] = {
+                "start": stage_start - start,
+                "duration": time.perf_counter() - stage_start
+            }
+
+    if mode == "serial":
+        for stage in stages:
+            results[stage.name] = run(stage, dict(results), time.perf_counter())
+    else:
+        pending = list(stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers or len(stages) or 1, thread_name_prefix="stage") as executor:
+            while pending or running:
+                # Start every stage whose dependencies have all finished
+                for stage in list(pending):
+                    if all(dep in results for dep in stage.deps):
+                        pending.remove(stage)
+                        inputs = {dep: results[dep] for dep in stage.deps}
+                        running[submit_in_context(executor, run, stage, inputs, time.perf_counter())] = stage
+                if not running:
+                    raise ValueError("Pipeline stages contain a dependency cycle")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        results[stage.name] = future.result()
+                    except Exception:
+                        for other in running:
+                            other.cancel()
+                        raise
+
+    timings["total_time"] = time.perf_counter() - start
+    return results, timings
+
+
+# Format stage timings as one log line, e.g. "citations 4.10s, questions 3.02s (total 6.35s)"
+def format_timings(timings):
+    stage_times = ", ".join(
+        f"{name} {timing['duration']:.2f}s"
+        for name, timing in timings.items()
+        if name != "total_time"
+    )
+    return f"{stage_times} (total {timings['total_time']:.2f}s)"
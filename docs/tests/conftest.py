@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules live next to this directory and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import citations  # noqa: E402
+
+
+# Every placeholder goes to the (fake) search model rather than the local index
+@pytest.fixture(autouse=True)
+def no_citation_index(monkeypatch):
+    monkeypatch.setattr(citations, "get_citation_index", lambda: None)
@@ -0,0 +1,55 @@
+from backends import route_client
+from citations import CITATION_MODEL, lookup_citations
+from completion_cache import CachedClient, CompletionCache, MemoryBackend
+from fake_openai import FakeOpenAI, fake_reference
+from metrics import MeteredClient, RunMetrics, track_stage
+from scheduler import RequestScheduler, ScheduledClient
+
+ROUTES = {
+    "citation": {"backend": "local", "model": "local-search", "fallback": ""},
+    "questions": {"backend": "local", "model": "local-chat", "fallback": ""},
+}
+
+
+def routed_client(default, local, scheduler, cache):
+    client = MeteredClient(CachedClient(ScheduledClient(default, scheduler=scheduler), cache))
+    return route_client(client, routes=ROUTES, backend_clients={"local": local},
+                        backends={"local": {"base_url": "http://localhost:8080/v1"}})
+
+
+def test_citation_stage_is_routed_to_the_backend_without_openai_options():
+    default = FakeOpenAI()
+    local = FakeOpenAI(responder=lambda model, messages: fake_reference(messages[-1]["content"]))
+    scheduler = RequestScheduler(rate_limits={})
+    client = routed_client(default, local, scheduler, CompletionCache(MemoryBackend()))
+
+    run = RunMetrics()
+    with run.activate():
+        results = lookup_citations(client, ["AI tutors"])
+
+    assert results[0] is not None
+    assert default.calls == []
+    assert [call["model"] for call in local.calls] == ["local-search"]
+    assert "web_search_options" not in local.calls[0]
+    # The routed request went through the scheduler and the run metrics
+    assert scheduler.stats()["completed"] == 1
+    stage = run.to_record()["stages"][0]
+    assert stage["calls"] == 1 and stage["routes"][0]["backend"] == "local"
+    assert CITATION_MODEL not in stage["models"]
+
+
+def test_routed_streams_are_filtered_and_cached():
+    local = FakeOpenAI()
+    client = routed_client(FakeOpenAI(), local, RequestScheduler(rate_limits={}), CompletionCache(MemoryBackend()))
+    request = {"model": "gpt-4.1", "messages": [{"role": "user", "content": "Questions?"}], "stream": True}
+
+    with RunMetrics().activate():
+        with track_stage("questions"):
+            first = "".join(chunk.choices[0].delta.content or "" for chunk in client.chat.completions.create(**request)
+                            if chunk.choices)
+            second = "".join(chunk.choices[0].delta.content or "" for chunk in client.chat.completions.create(**request)
+                             if chunk.choices)
+
+    assert first == second
+    assert len(local.calls) == 1
+    assert "stream_options" not in local.calls[0]
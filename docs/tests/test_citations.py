@@ -0,0 +1,77 @@
+import random
+import time
+
+from citation_cache import CitationCache
+from citations import CITATION_MODEL, enhance_citations, lookup_citations
+from completion_cache import CachedClient, CompletionCache, MemoryBackend
+from fake_openai import FakeOpenAI, fake_reference
+
+TOPICS = [f"topic {i}" for i in range(12)]
+
+
+def test_lookups_respect_the_concurrency_cap():
+    client = FakeOpenAI(latency=0.05)
+
+    results = lookup_citations(client, TOPICS, max_concurrency=3)
+
+    assert len(client.calls) == len(TOPICS)
+    assert client.max_in_flight == 3
+    assert all(result is not None for result in results)
+
+
+def test_timed_out_lookups_come_back_as_none():
+    client = FakeOpenAI(latency=1.0)
+
+    start = time.perf_counter()
+    results = lookup_citations(client, TOPICS[:4], max_concurrency=4, timeout=0.05)
+
+    assert results == [None] * 4
+    assert time.perf_counter() - start < 0.5
+
+
+def test_results_come_back_in_placeholder_order():
+    # Each topic gets its own author and a random delay, so lookups finish out of order
+    authors = {topic: f"Author{chr(ord('A') + i)}" for i, topic in enumerate(TOPICS)}
+    delays = random.Random(7)
+
+    def respond(model, messages):
+        assert model == CITATION_MODEL
+        prompt = messages[-1]["content"]
+        topic = next(topic for topic in TOPICS if f"'{topic}'" in prompt)
+        time.sleep(delays.uniform(0, 0.05))
+        reference = fake_reference(prompt)
+        return authors[topic] + reference[reference.index(","):]
+
+    results = lookup_citations(FakeOpenAI(responder=respond), TOPICS, max_concurrency=6)
+
+    assert [result["full_reference"].split(",")[0] for result in results] == [authors[topic] for topic in TOPICS]
+    assert all(result["in_text"].startswith(f"({authors[topic]}, ") for result, topic in zip(results, TOPICS))
+
+
+def test_apologetic_search_answers_are_not_cited_or_cached():
+    answer = "Sorry, I could not find a source. However, see Smith (2020)."
+    client = FakeOpenAI(responder=lambda model, messages: answer)
+    cache = CitationCache(":memory:")
+    completion_cache = CompletionCache(MemoryBackend())
+    case_study = "Tutors help (placeholder: AI tutors). Feedback matters (placeholder: feedback)."
+
+    for _ in range(2):
+        cited, references = enhance_citations(CachedClient(client, completion_cache), case_study, cache=cache)
+
+        assert cited == "Tutors help. Feedback matters."
+        assert references == []
+    # Searched again on the second run: nothing was cached or counted as a hit
+    assert len(client.calls) == 4
+    assert cache.stats()["entries"] == 0 and cache.stats()["hits"] == 0
+    assert completion_cache.stats()["hits"] == 0
+
+
+def test_cached_entries_that_are_not_references_are_dropped():
+    cache = CitationCache(":memory:")
+    cache.put("AI tutors", "I could not find a specific source.", "(I could not find a specific source, n.d.)")
+
+    results = lookup_citations(FakeOpenAI(), ["AI tutors"], cache=cache)
+
+    assert results[0]["full_reference"] != "I could not find a specific source."
+    assert cache.stats()["hits"] == 0 and cache.stats()["misses"] == 1
+    assert cache.get("AI tutors")["full_reference"] == results[0]["full_reference"]
@@ -0,0 +1,26 @@
+import re
+import zlib
+
+from export import ExportCache, ExportManager, render_document
+
+DOCUMENT = "# Case Study\n\nBy Łukasz Żak and José Müller\n\nThe course ran for one term.\n"
+
+
+def pdf_text(pdf):
+    streams = re.findall(rb"stream\n(.*?)\nendstream", pdf, re.S)
+    return "\n".join(zlib.decompress(stream).decode("latin-1") for stream in streams)
+
+
+def test_pdf_drops_accents_the_fonts_cannot_show():
+    text = pdf_text(render_document(DOCUMENT, "pdf"))
+
+    assert "(By Lukasz Zak and Jos\xe9 M\xfcller) Tj" in text
+    assert "?" not in text
+
+
+def test_pdf_export_reports_lost_characters():
+    exports = ExportManager(cache=ExportCache(":memory:"), max_workers=1)
+
+    assert exports.lost_characters(DOCUMENT, "pdf") == ["Ł", "Ż"]
+    assert exports.lost_characters(DOCUMENT, "docx") == []
+    assert exports.lost_characters("# Plain\n\nOnly ASCII.\n", "pdf") == []
@@ -0,0 +1,70 @@
+import random
+
+from citations import CitationPrefetcher, PlaceholderDetector, extract_placeholders
+from fake_openai import FakeOpenAI, case_study_responder, replay_responder
+from generation import DRAFT_MODEL, stream_chat_completion
+
+DRAFT = case_study_responder(words_per_section=120, placeholders_per_section=3)(
+    DRAFT_MODEL, [{"role": "user", "content": "Write section 1 of 1 of a case study."}]
+) + (
+    " Results were mixed (see Table 2), as reported before (placeholder: Learning Analytics.)"
+    " and again (placeholder:learning  analytics) (placeholder: formative assessment)."
+    " Tutoring (placeholder: effect of AI (LLM) tutors) helped (as expected)."
+)
+
+
+# Cut `text` into random pieces of 1 to `longest` characters
+def random_split(text, rng, longest):
+    pieces = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, longest)
+        pieces.append(text[i:i + size])
+        i += size
+    return pieces
+
+
+def test_streamed_detection_matches_the_full_scan():
+    expected = extract_placeholders(DRAFT)
+    assert expected.unique >= 3
+
+    rng = random.Random(5)
+    for longest in (1, 2, 5, 20, 200):
+        for _ in range(20):
+            detector = PlaceholderDetector()
+            found = []
+            for piece in random_split(DRAFT, rng, longest):
+                found += detector.feed(piece)
+            assert detector.scan.topics == expected.topics
+            assert detector.scan.total == expected.total
+            assert found == list(expected.topics.items())
+
+
+def test_placeholder_split_inside_a_nested_paren_is_found_while_streaming():
+    text = "Tutors helped (placeholder: effect of AI (LLM) tutors) in class."
+    expected = extract_placeholders(text)
+    split = text.index("LM)")
+
+    detector = PlaceholderDetector()
+    assert detector.feed(text[:split]) == []
+    assert detector.feed(text[split:]) == list(expected.topics.items())
+
+    client = FakeOpenAI(responder=replay_responder(text))
+    prefetcher = CitationPrefetcher(client)
+    prefetcher.feed(text[:split])
+    prefetcher.feed(text[split:])
+    assert set(prefetcher.results()) == set(expected.topics)
+
+
+def test_prefetcher_searches_every_topic_once_while_the_draft_streams():
+    client = FakeOpenAI(responder=replay_responder(DRAFT))
+    prefetcher = CitationPrefetcher(client, max_concurrency=4)
+
+    text, _ = stream_chat_completion(client, DRAFT_MODEL, [{"role": "user", "content": "Draft"}], on_token=prefetcher.feed)
+    resolved = prefetcher.results()
+
+    expected = extract_placeholders(DRAFT)
+    assert text == DRAFT
+    assert set(resolved) == set(expected.topics)
+    searches = [call for call in client.calls if "search" in call["model"]]
+    assert len(searches) == expected.unique
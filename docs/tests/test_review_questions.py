@@ -0,0 +1,61 @@
+from chunking import CHUNK_TOKENS
+from fake_openai import FILLER_SENTENCES, FakeOpenAI
+from pipeline import generate_review_questions
+from prompts import PROMPT_BUDGETS, count_tokens
+
+QUESTION = "How did the team measure the effect of the tool on student outcomes, and what evidence supports it?"
+QUESTIONS = "\n".join(f"{i}. {QUESTION}" for i in range(1, 4))
+# Long enough that the questions of every chunk exceed one merge prompt
+CHUNK_QUESTIONS = "\n".join(f"{i}. {QUESTION}" for i in range(1, 13))
+
+
+def long_case_study(sections):
+    return "".join(f"## Section {i}\n\n" + " ".join(FILLER_SENTENCES * 6) + "\n\n" for i in range(sections))
+
+
+def is_merge(messages):
+    return messages[-1]["content"].startswith("The questions below")
+
+
+def test_questions_are_merged_in_rounds_within_budget():
+    merge_prompts = []
+
+    def respond(model, messages):
+        if is_merge(messages):
+            merge_prompts.append(messages[-1]["content"])
+            return QUESTIONS
+        return CHUNK_QUESTIONS
+
+    questions = generate_review_questions(FakeOpenAI(responder=respond), long_case_study(60), chunk_mode="always")
+
+    assert questions == QUESTIONS
+    assert len(merge_prompts) > 1
+    assert all(count_tokens(prompt) <= PROMPT_BUDGETS["questions"] for prompt in merge_prompts)
+
+
+def test_failed_merge_falls_back_to_unmerged_questions():
+    def respond(model, messages):
+        if is_merge(messages):
+            raise RuntimeError("merge failed")
+        return CHUNK_QUESTIONS
+
+    questions = generate_review_questions(FakeOpenAI(responder=respond), long_case_study(60), chunk_mode="always")
+
+    assert questions.startswith(CHUNK_QUESTIONS)
+    assert count_tokens(questions) <= PROMPT_BUDGETS["questions"]
+
+
+def test_auto_mode_only_chunks_documents_that_do_not_fit_one_prompt():
+    # Longer than one chunk, but within the questions budget
+    case_study = long_case_study(1)
+    while count_tokens(case_study) < CHUNK_TOKENS + 300:
+        case_study += long_case_study(1)
+    assert count_tokens(case_study) < PROMPT_BUDGETS["questions"] - 300
+    client = FakeOpenAI(responder=lambda model, messages: QUESTIONS)
+
+    assert generate_review_questions(client, case_study, chunk_mode="auto") == QUESTIONS
+    assert len(client.calls) == 1
+
+    client = FakeOpenAI(responder=lambda model, messages: QUESTIONS)
+    generate_review_questions(client, case_study * 2, chunk_mode="auto")
+    assert len(client.calls) > 2
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from fake_openai import FakeChatServer, default_responder
+from scheduler import BATCH, INTERACTIVE, RequestScheduler, ScheduledClient
+
+openai = pytest.importorskip("openai")
+
+MODEL = "gpt-4.1"
+
+
+# Stub server that answers its first requests with the given status codes
+# (429 or 500) and every later one normally
+class ScriptedServer(FakeChatServer):
+    def __init__(self, errors=(), **kwargs):
+        super().__init__(**kwargs)
+        self.script = list(errors)
+
+    def _pick_error(self):
+        with self._lock:
+            self.requests += 1
+            error = self.script.pop(0) if self.script else None
+            if error == 429:
+                self.rate_limited += 1
+        return error
+
+
+def scheduled_client(server, scheduler, priority=INTERACTIVE):
+    client = openai.OpenAI(api_key="test", base_url=server.base_url, max_retries=0)
+    return ScheduledClient(client, scheduler=scheduler, priority=priority)
+
+
+def ask(client, content="Hello"):
+    return client.chat.completions.create(model=MODEL, messages=[{"role": "user", "content": content}])
+
+
+def test_retry_after_is_honoured():
+    scheduler = RequestScheduler(rate_limits={}, backoff_base=0.01)
+    with ScriptedServer(errors=[429], retry_after=0.4) as server:
+        start = time.monotonic()
+        response = ask(scheduled_client(server, scheduler))
+        elapsed = time.monotonic() - start
+
+    assert response.choices[0].message.content
+    assert elapsed >= 0.4
+    assert server.stats()["requests"] == 2
+    stats = scheduler.stats()
+    assert (stats["retries"], stats["rate_limited"], stats["completed"]) == (1, 1, 1)
+
+
+def test_a_429_pauses_every_request_for_the_model():
+    scheduler = RequestScheduler(rate_limits={}, backoff_base=0.01)
+    with ScriptedServer(errors=[429], retry_after=0.5) as server:
+        client = scheduled_client(server, scheduler)
+        first = threading.Thread(target=ask, args=(client,))
+        first.start()
+        limits = scheduler._limits_for(MODEL)
+        deadline = time.monotonic() + 5
+        while limits.paused_until <= time.monotonic() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        remaining = limits.paused_until - time.monotonic()
+        assert remaining > 0.2
+
+        # A request that never saw the 429 still waits for the pause to end
+        start = time.monotonic()
+        ask(client, "Second")
+        assert time.monotonic() - start >= remaining - 0.05
+        first.join()
+
+    assert server.stats()["requests"] == 3
+
+
+def test_interactive_requests_go_before_batch_requests():
+    received = []
+
+    def respond(model, messages):
+        received.append(messages[-1]["content"])
+        return default_responder(model, messages)
+
+    # One request every 50ms, and none for the first half second while the
+    # requests queue up: the bucket is overdrawn by ten requests
+    scheduler = RequestScheduler(rate_limits={MODEL: {"rpm": 1200}})
+    scheduler._limits_for(MODEL).requests.available = -10
+    with ScriptedServer(responder=respond) as server:
+        threads = []
+        for priority, name in [(BATCH, "batch"), (INTERACTIVE, "interactive")]:
+            client = scheduled_client(server, scheduler, priority)
+            for i in range(3):
+                thread = threading.Thread(target=ask, args=(client, f"{name} {i}"))
+                thread.start()
+                threads.append(thread)
+                # Queue the requests one by one so their arrival order is known
+                while scheduler.queue_depth() < len(threads):
+                    time.sleep(0.001)
+        assert scheduler.queue_depth(BATCH) == 3 and scheduler.queue_depth(INTERACTIVE) == 3
+        for thread in threads:
+            thread.join()
+
+    assert received == ["interactive 0", "interactive 1", "interactive 2", "batch 0", "batch 1", "batch 2"]
@@ -0,0 +1,47 @@
+import pytest
+
+from fake_openai import FakeOpenAI, case_study_responder
+from pipeline import run_pipeline
+
+FIELDS = {
+    "case_study_title": "Chatbot tutors in first-year biology",
+    "author_name": "Jane Doe",
+    "course_level": "Undergraduate",
+    "educational_context": "A first-year biology course with 300 students.",
+    "problem_goal": "Students needed faster feedback on lab reports.",
+    "ai_tools": "A chatbot tutor built on a large language model.",
+    "challenges": "Some answers were wrong.",
+}
+
+
+def section_calls(client):
+    return [call for call in client.calls if call["messages"][-1]["content"].startswith("Write section")]
+
+
+@pytest.mark.parametrize("draft_mode", ["sections", "parallel"])
+def test_filling_in_a_section_only_drafts_that_section(draft_mode):
+    client = FakeOpenAI(responder=case_study_responder())
+    first = run_pipeline(client, FIELDS, stream=False, prefetch=False, draft_mode=draft_mode)
+    assert len(section_calls(client)) == 3
+
+    # A new section between the ones already drafted moves them and changes their neighbours
+    fields = {**FIELDS, "preparation_phase": "Instructors wrote sample questions with the students."}
+    client = FakeOpenAI(responder=case_study_responder())
+    second = run_pipeline(client, fields, stream=False, prefetch=False, draft_mode=draft_mode, previous=first)
+
+    calls = section_calls(client)
+    assert len(calls) == 1
+    assert "Implementation Process" in calls[0]["messages"][-1]["content"]
+    reused = {section["fingerprint"] for section in first["sections"]}
+    assert len([section for section in second["sections"] if section["fingerprint"] in reused]) == 3
+
+
+def test_clearing_a_section_reuses_the_others_but_not_the_questions():
+    fields = {**FIELDS, "preparation_phase": "Instructors wrote sample questions with the students."}
+    first = run_pipeline(FakeOpenAI(responder=case_study_responder()), fields, stream=False, prefetch=False)
+
+    client = FakeOpenAI(responder=case_study_responder())
+    run_pipeline(client, FIELDS, stream=False, prefetch=False, previous=first)
+
+    assert section_calls(client) == []
+    assert any("questions that could help the author" in call["messages"][-1]["content"] for call in client.calls)
@@ -0,0 +1,54 @@
+import time
+
+from citation_cache import CitationCache
+from fake_openai import FakeOpenAI, case_study_responder
+from jobs import JobManager
+from speculation import SpeculationManager
+
+FIELDS = {
+    "case_study_title": "Chatbot tutors in first-year biology",
+    "author_name": "Jane Doe",
+    "course_level": "Undergraduate",
+    "educational_context": "A first-year biology course with 300 students.",
+    "problem_goal": "Students needed faster feedback on lab reports.",
+    "ai_tools": "A chatbot tutor built on a large language model.",
+}
+
+
+def section_calls(client):
+    return [call for call in client.calls if call["messages"][-1]["content"].startswith("Write section")]
+
+
+def finished(job_manager, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while job_manager.get(job_id).status in ("queued", "running") and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job_manager.get(job_id)
+
+
+def test_drafts_still_running_at_submit_are_handed_to_the_job():
+    client = FakeOpenAI(latency=0.3, responder=case_study_responder())
+    manager = SpeculationManager(client, citation_cache=CitationCache(":memory:"))
+    speculator = manager.session(settle_seconds=0)
+    speculator.observe(FIELDS, now=0)
+    assert speculator.counts() == (0, 2)
+
+    claim = speculator.claim(FIELDS)
+    jobs = JobManager(client, citation_cache=CitationCache(":memory:"))
+    job = finished(jobs, jobs.submit(FIELDS, speculative=claim))
+
+    assert job.status == "done"
+    assert job.result["sections_regenerated"] == 0
+    assert len(section_calls(client)) == 2
+    assert manager.stats()["sections_used"] == 2 and manager.stats()["sections_wasted"] == 0
+
+
+def test_single_draft_mode_does_not_speculate():
+    client = FakeOpenAI(responder=case_study_responder())
+    speculator = SpeculationManager(client).session(settle_seconds=0, draft_mode="single")
+
+    speculator.observe(FIELDS, now=0)
+
+    assert speculator.counts() == (0, 0)
+    assert speculator.claim(FIELDS) is None
+    assert client.calls == []